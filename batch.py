@@ -0,0 +1,283 @@
+import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+import jpeg_ls
+
+# Files picked from the directories given as inputs, per action
+DEFAULT_PATTERNS = {'enc': '*.y4m', 'dec': '*_enc'}
+
+# Name of the manifest in the output directory, unless given
+MANIFEST_NAME = 'manifest.jsonl'
+
+# Suffix of outputs being written. They are renamed once complete, so an interrupted run never leaves a truncated
+# output behind under its final name.
+PARTIAL_SUFFIX = '.part'
+
+HASH_CHUNK_SIZE = 1 << 20
+
+BatchJob = collections.namedtuple('BatchJob', ['input_path', 'output_path', 'size', 'mtime_ns'])
+
+
+def find_inputs(paths, pattern):
+    """
+        Expands the inputs of a batch: files, directories (the files in them matching pattern, subdirectories
+    included) and glob patterns
+    :param paths: list of paths
+    :param pattern: glob pattern of the files to take from directories
+    :return: list of (input path, output name) tuples. Files found in a directory keep their path relative to it as
+    output name, the others their file name.
+    """
+    inputs = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for input_path in sorted(glob.glob(os.path.join(path, '**', pattern), recursive=True)):
+                if os.path.isfile(input_path):
+                    inputs.append((input_path, os.path.relpath(input_path, path)))
+
+        elif os.path.isfile(path):
+            inputs.append((path, os.path.basename(path)))
+
+        else:
+            matches = sorted(input_path for input_path in glob.glob(path, recursive=True) if os.path.isfile(input_path))
+            if not matches:
+                raise FileNotFoundError(f'No input files match {path}')
+
+            inputs.extend((input_path, os.path.basename(input_path)) for input_path in matches)
+
+    return inputs
+
+
+def plan_jobs(inputs, output_dir, action):
+    """
+        One job per input file, largest first: long jobs start early and short ones fill the gaps at the end, which
+    keeps every process of the pool busy until the last few files
+    :param inputs: as returned by find_inputs()
+    :param output_dir:
+    :param action: 'enc' or 'dec'
+    :return: list of BatchJob
+    """
+    jobs = {}
+
+    for input_path, output_name in inputs:
+        input_path = os.path.abspath(input_path)
+        output_path = os.path.abspath(os.path.join(output_dir, output_name + '_' + action))
+
+        if output_path in jobs and jobs[output_path].input_path != input_path:
+            raise ValueError(f'{input_path} and {jobs[output_path].input_path} would both be written to {output_path}')
+
+        stat_result = os.stat(input_path)
+        jobs[output_path] = BatchJob(input_path, output_path, stat_result.st_size, stat_result.st_mtime_ns)
+
+    return sorted(jobs.values(), key=lambda job: job.size, reverse=True)
+
+
+def file_hash(file_path):
+    """
+        SHA-256 of a file, read in chunks
+    :param file_path:
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+
+    with open(file_path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def run_job(action, job, options):
+    """
+        Worker process entry point: encodes or decodes one file
+    :param action: 'enc' or 'dec'
+    :param job: BatchJob
+    :param options: JpegLs options (encoding only)
+    :return: manifest entry of the job
+    """
+    os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+    partial_path = job.output_path + PARTIAL_SUFFIX
+    start = time.perf_counter()
+
+    try:
+        if action == 'enc':
+            jpeg_ls.encode(job.input_path, partial_path, **options)
+
+        else:
+            jpeg_ls.decode(job.input_path, partial_path)
+
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+        raise
+
+    seconds = time.perf_counter() - start
+    os.replace(partial_path, job.output_path)
+    output_size = os.path.getsize(job.output_path)
+
+    return {
+        'action': action,
+        'input': job.input_path,
+        'output': job.output_path,
+        'input_sha256': file_hash(job.input_path),
+        'input_size': job.size,
+        'input_mtime_ns': job.mtime_ns,
+        'output_size': output_size,
+        'ratio': round(output_size / job.size, 6) if job.size else None,
+        'seconds': round(seconds, 3),
+        'options': options,
+    }
+
+
+def load_manifest(manifest_path):
+    """
+        Reads the entries of the jobs completed by earlier runs
+    :param manifest_path:
+    :return: dict of output path -> latest manifest entry
+    """
+    entries = {}
+
+    if not os.path.exists(manifest_path):
+        return entries
+
+    with open(manifest_path) as manifest_file:
+        for line in manifest_file:
+            try:
+                entry = json.loads(line)
+
+            except ValueError:
+                # Last line of a run that was killed while writing it
+                continue
+
+            entries[entry['output']] = entry
+
+    return entries
+
+
+def is_done(job, action, options, entry):
+    """
+        Whether a job was completed by an earlier run and its input has not changed since (same size and modification
+    time, which saves hashing every input again)
+    :param job: BatchJob
+    :param action:
+    :param options:
+    :param entry: manifest entry of the job's output, or None
+    :return:
+    """
+    return entry is not None and 'error' not in entry and entry['action'] == action and entry['options'] == options \
+        and entry['input'] == job.input_path and entry['input_size'] == job.size \
+        and entry['input_mtime_ns'] == job.mtime_ns and os.path.exists(job.output_path) \
+        and os.path.getsize(job.output_path) == entry['output_size']
+
+
+def run(paths, output_dir, action='enc', options=None, processes=0, manifest_path=None, pattern=None):
+    """
+        Encodes (or decodes) every input file into output_dir with a pool of processes, appending a manifest entry
+    per completed file. Files the manifest already has are skipped, so running the same batch again resumes it.
+    :param paths: files, directories and glob patterns, see find_inputs()
+    :param output_dir:
+    :param action: 'enc' or 'dec'
+    :param options: JpegLs options of the encoder (adaptive, near, intra_period, segments, stripe_rows, frame_index)
+    :param processes: size of the pool (0 = one per CPU)
+    :param manifest_path: defaults to MANIFEST_NAME in output_dir
+    :param pattern: files to take from directories, defaults to DEFAULT_PATTERNS[action]
+    :return: dict with the number of files done, skipped and failed
+    """
+    options = dict(options or {}) if action == 'enc' else {}
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+
+    jobs = plan_jobs(find_inputs(paths, pattern or DEFAULT_PATTERNS[action]), output_dir, action)
+    manifest = load_manifest(manifest_path)
+
+    pending_jobs = [job for job in jobs if not is_done(job, action, options, manifest.get(job.output_path))]
+    summary = {'done': 0, 'skipped': len(jobs) - len(pending_jobs), 'failed': 0}
+
+    print(f'{len(pending_jobs)} files to {action}, {summary["skipped"]} already done', file=sys.stderr)
+
+    if not pending_jobs:
+        return summary
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    executor = ProcessPoolExecutor(max_workers=processes if processes > 0 else os.cpu_count())
+    futures = {}
+
+    try:
+        with open(manifest_path, 'a') as manifest_file:
+            futures = {executor.submit(run_job, action, job, options): job for job in pending_jobs}
+
+            for future in as_completed(futures):
+                job = futures[future]
+
+                try:
+                    entry = future.result()
+                    summary['done'] += 1
+                    print(f'[{summary["done"] + summary["failed"]}/{len(pending_jobs)}] {job.input_path}: '
+                          f'{entry["seconds"]:.2f} s, ratio {entry["ratio"]}', file=sys.stderr)
+
+                except Exception as error:
+                    entry = {'action': action, 'input': job.input_path, 'output': job.output_path, 'error': repr(error)}
+                    summary['failed'] += 1
+                    print(f'[{summary["done"] + summary["failed"]}/{len(pending_jobs)}] {job.input_path}: '
+                          f'FAILED {error!r}', file=sys.stderr)
+
+                # One line per job as soon as it ends: an interrupted run loses at most the jobs in flight
+                manifest_file.write(json.dumps(entry) + '\n')
+                manifest_file.flush()
+
+    finally:
+        # When interrupted, the jobs that have not started yet are dropped instead of run without being recorded.
+        # Cancelled one by one, as shutdown(cancel_futures=True) needs Python 3.9.
+        for future in futures:
+            future.cancel()
+
+        executor.shutdown(wait=True)
+
+    return summary
+
+
+def main(argv=None):
+    """
+        Command line entry point. Exits with status 1 when a file failed.
+    :param argv: arguments (defaults to sys.argv[1:])
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Encodes or decodes many files with a pool of processes')
+    parser.add_argument('action', choices=['enc', 'dec'])
+    parser.add_argument('inputs', nargs='+', help='input files, directories or glob patterns (quoted)')
+    parser.add_argument('--output-dir', required=True, help='directory the outputs are written to')
+    parser.add_argument('--pattern', help='files to take from input directories (default: *.y4m, or *_enc for dec)')
+    parser.add_argument('--processes', type=int, default=0, help='files coded in parallel (0 = one per CPU)')
+    parser.add_argument('--manifest', help=f'manifest file (default: OUTPUT_DIR/{MANIFEST_NAME})')
+    parser.add_argument('--adaptive', action='store_true', help='(enc) see jpeg_ls_cli.py')
+    parser.add_argument('--near', type=int, default=0, help='(enc) see jpeg_ls_cli.py')
+    parser.add_argument('--intra-period', type=int, default=1, help='(enc) see jpeg_ls_cli.py')
+    parser.add_argument('--segments', action='store_true', help='(enc) see jpeg_ls_cli.py')
+    parser.add_argument('--stripe-rows', type=int, default=0, help='(enc) see jpeg_ls_cli.py')
+    parser.add_argument('--index', action='store_true', help='(enc) see jpeg_ls_cli.py')
+
+    args = parser.parse_args(argv)
+
+    options = {'adaptive': args.adaptive, 'near': args.near, 'intra_period': args.intra_period,
+               'segments': args.segments, 'stripe_rows': args.stripe_rows, 'frame_index': args.index}
+
+    try:
+        summary = run(args.inputs, args.output_dir, args.action, options, args.processes, args.manifest, args.pattern)
+
+    except (FileNotFoundError, ValueError) as error:
+        parser.error(str(error))
+    print(f'Done: {summary["done"]}, skipped: {summary["skipped"]}, failed: {summary["failed"]}', file=sys.stderr)
+
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import golomb
+import jpeg_ls
+import prediction
+from bit_stream import BitStream, OpenMode
+from yuv_player import YuvDecoder, plane_shapes
+
+# Synthetic clips: name -> (width, height, color space)
+SYNTHETIC_CLIPS = {
+    'qcif-420': (176, 144, '4:2:0'),
+    'cif-420': (352, 288, '4:2:0'),
+    'cif-422': (352, 288, '4:2:2'),
+    'cif-444': (352, 288, '4:4:4'),
+    'cif-mono': (352, 288, 'mono'),
+    '720p-420': (1280, 720, '4:2:0'),
+}
+
+# Clip shipped with the repository, benchmarked along with the synthetic ones when it is present
+SAMPLE_CLIP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'new_flowers.y4m')
+
+DEFAULT_CLIPS = ['qcif-420', 'cif-420', 'cif-422', 'cif-444', 'cif-mono', 'new_flowers']
+
+Y4M_COLOR_TAGS = {'4:2:0': '420jpeg', '4:2:2': '422', '4:4:4': '444', 'mono': 'mono'}
+
+# Golomb parameter of the component stages, the one jpeg_ls uses by default
+GOLOMB_M_PARAM = 128
+
+STAGES = ['y4m_read', 'prediction', 'reconstruction', 'golomb_encode', 'golomb_decode', 'bitstream_write',
+          'bitstream_read', 'encode', 'decode']
+
+
+def synthetic_frames(width, height, color_space, frame_count, seed=0):
+    """
+        Generates frames mixing the content the codec sees in practice: smooth gradients, flat areas (run mode),
+    sharp edges and noisy texture, moving from one frame to the next
+    :param width:
+    :param height:
+    :param color_space: '4:4:4', '4:2:2', '4:2:0' or 'mono'
+    :param frame_count:
+    :param seed: seed of the noise, so every run codes the same clip
+    :return: list of [y, u, v] lists of 2D uint8 arrays
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+
+    for frame_number in range(frame_count):
+        planes = []
+
+        for rows, cols in plane_shapes(width, height, color_space):
+            row_idx, col_idx = np.mgrid[0:rows, 0:cols]
+            shift = frame_number * 3
+
+            plane = (col_idx + row_idx // 2 + shift) % 256
+            # Flat block and a block of hard edges
+            plane[rows // 4:rows // 2, cols // 8:cols // 2] = 90
+            plane[rows // 2:, cols // 2:] = np.where((col_idx[rows // 2:, cols // 2:] + shift) // 8 % 2, 220, 30)
+            # Noisy texture on the bottom left quarter
+            texture = plane[rows // 2:, :cols // 2]
+            texture += rng.integers(-20, 21, texture.shape)
+
+            planes.append(np.clip(plane, 0, 255).astype(np.uint8))
+
+        frames.append(planes)
+
+    return frames
+
+
+def write_y4m(path, header, frames):
+    """
+        Writes a Y4M file
+    :param path:
+    :param header: header line, with its trailing newline (bytes)
+    :param frames: list of [y, u, v] planes
+    :return:
+    """
+    with open(path, 'wb') as y4m_file:
+        y4m_file.write(header)
+
+        for planes in frames:
+            y4m_file.write(b'FRAME\n')
+
+            for plane in planes:
+                y4m_file.write(plane.tobytes())
+
+
+def prepare_clip(name, frame_count, directory):
+    """
+        Writes the clip to benchmark to directory
+    :param name: key of SYNTHETIC_CLIPS, or 'new_flowers'
+    :param frame_count: number of frames (the sample clip is cut to it)
+    :param directory:
+    :return: (path of the Y4M file, frames)
+    """
+    path = os.path.join(directory, name + '.y4m')
+
+    if name == 'new_flowers':
+        sample = YuvDecoder(SAMPLE_CLIP_PATH)
+        frames = []
+
+        while len(frames) < frame_count:
+            y, u, v, ret = sample.read_frame()
+            if not ret:
+                break
+
+            frames.append([y.copy(), u.copy(), v.copy()])
+
+        header = sample.raw_header
+        sample.close()
+
+    else:
+        width, height, color_space = SYNTHETIC_CLIPS[name]
+        header = f'YUV4MPEG2 W{width} H{height} F25:1 Ip A1:1 C{Y4M_COLOR_TAGS[color_space]}\n'.encode()
+        frames = synthetic_frames(width, height, color_space, frame_count)
+
+    write_y4m(path, header, frames)
+
+    return path, frames
+
+
+def best_time(run, repeat):
+    """
+        Runs the function repeat times
+    :param run: function()
+    :param repeat:
+    :return: fastest run time in seconds
+    """
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def stage_runs(path, frames, codec_options, directory):
+    """
+        Builds the function measured for every stage. Each one processes all the frames of the clip.
+    :param path: Y4M file of the clip
+    :param frames: its frames
+    :param codec_options: options of the full encode / decode (see jpeg_ls.encode())
+    :param directory: where encoded and decoded files go
+    :return: dict stage -> function()
+    """
+    planes = [plane for frame_planes in frames for plane in frame_planes if plane.size]
+    residuals = [np.mod(prediction.residuals(plane), 256) for plane in planes]
+    packed_planes = [golomb.pack_array(plane_residuals, GOLOMB_M_PARAM) for plane_residuals in residuals]
+    code_values, code_lengths = golomb.code_table(GOLOMB_M_PARAM)
+    # Golomb codes of every plane, as (values, lengths) lists of code pieces of at most 32 bits
+    codes = []
+
+    for plane_residuals in residuals:
+        values = code_values[plane_residuals.ravel() + 255].ravel()
+        lengths = code_lengths[plane_residuals.ravel() + 255].ravel()
+        codes.append((values[lengths > 0].tolist(), lengths[lengths > 0].tolist()))
+    encoded_path = os.path.join(directory, 'clip.y4m_enc')
+    decoded_path = os.path.join(directory, 'clip.y4m_enc_dec')
+
+    def y4m_read():
+        y4m_file = YuvDecoder(path)
+
+        # The codec copies every frame out of the file (see YuvDecoder.prefetch_frames())
+        while True:
+            y, u, v, ret = y4m_file.read_frame()
+            if not ret:
+                break
+
+            y.copy(), u.copy(), v.copy()
+
+        y4m_file.close()
+
+    def predict():
+        for plane in planes:
+            prediction.residuals(plane)
+
+    def reconstruct():
+        for plane_residuals in residuals:
+            prediction.reconstruct_plane(plane_residuals)
+
+    def golomb_encode():
+        for plane_residuals in residuals:
+            golomb.pack_array(plane_residuals, GOLOMB_M_PARAM)
+
+    def golomb_decode():
+        for (packed_plane, _), plane_residuals in zip(packed_planes, residuals):
+            golomb.decode_array(GOLOMB_M_PARAM, plane_residuals.size, BitStream(io.BytesIO(packed_plane), OpenMode.READ))
+
+    def bitstream_write():
+        output_stream = BitStream(io.BytesIO(), OpenMode.WRITE)
+        write_bits = output_stream.write_bits
+
+        for values, lengths in codes:
+            for value, length in zip(values, lengths):
+                write_bits(value, length)
+
+        output_stream.flush()
+
+    def bitstream_read():
+        for (packed_plane, _), (_, lengths) in zip(packed_planes, codes):
+            read_bits = BitStream(io.BytesIO(packed_plane), OpenMode.READ).read_bits
+
+            for length in lengths:
+                read_bits(length)
+
+    def encode():
+        jpeg_ls.encode(path, encoded_path, **codec_options)
+
+    def decode():
+        jpeg_ls.decode(encoded_path, decoded_path, workers=codec_options.get('workers', 1))
+
+    return {
+        'y4m_read': y4m_read,
+        'prediction': predict,
+        'reconstruction': reconstruct,
+        'golomb_encode': golomb_encode,
+        'golomb_decode': golomb_decode,
+        'bitstream_write': bitstream_write,
+        'bitstream_read': bitstream_read,
+        'encode': encode,
+        'decode': decode,
+    }
+
+
+def benchmark_clip(name, frame_count, stages, repeat, codec_options):
+    """
+        Measures the stages on one clip. Throughput is counted in raw (Y4M) frame data for every stage, so the
+    numbers of different stages can be compared with each other.
+    :param name: see prepare_clip()
+    :param frame_count:
+    :param stages: names of the stages to run, in order (decode needs encode)
+    :param repeat: runs per stage, the fastest one counts
+    :param codec_options: see stage_runs()
+    :return: dict stage -> {'seconds', 'mb_per_s', 'frames_per_s'}
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path, frames = prepare_clip(name, frame_count, directory)
+        frame_bytes = sum(plane.size for plane in frames[0])
+        runs = stage_runs(path, frames, codec_options, directory)
+        results = {}
+
+        for stage in stages:
+            if stage == 'decode' and 'encode' not in stages:
+                runs['encode']()
+
+            seconds = best_time(runs[stage], repeat)
+            results[stage] = {
+                'seconds': round(seconds, 6),
+                'mb_per_s': round(len(frames) * frame_bytes / seconds / 1e6, 3),
+                'frames_per_s': round(len(frames) / seconds, 3),
+            }
+
+        y4m_file = YuvDecoder(path)
+        clip_results = {'width': y4m_file.frame_width, 'height': y4m_file.frame_height,
+                        'color_space': y4m_file.color_space, 'frames': len(frames), 'stages': results}
+        y4m_file.close()
+
+        return clip_results
+
+
+def compare(results, baseline, max_slowdown):
+    """
+        Compares the throughput of every stage with a baseline run
+    :param results: as returned by run()
+    :param baseline: results of an earlier run
+    :param max_slowdown: largest accepted drop in throughput (0.1 = 10 % slower)
+    :return: list of (clip, stage, throughput change) tuples over the limit. The change is a fraction (-0.2 = 20 %
+    slower).
+    """
+    regressions = []
+
+    for clip, clip_results in results['clips'].items():
+        baseline_stages = baseline.get('clips', {}).get(clip, {}).get('stages', {})
+
+        for stage, stage_results in clip_results['stages'].items():
+            if stage not in baseline_stages:
+                continue
+
+            change = stage_results['mb_per_s'] / baseline_stages[stage]['mb_per_s'] - 1
+            stage_results['vs_baseline'] = round(change, 4)
+
+            if change < -max_slowdown:
+                regressions.append((clip, stage, change))
+
+    return regressions
+
+
+def run(clips, frame_count, stages, repeat, codec_options):
+    """
+        Benchmarks every clip
+    :return: JSON serializable results
+    """
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'settings': {'frames': frame_count, 'repeat': repeat, 'codec_options': codec_options},
+        'clips': {},
+    }
+
+    for clip in clips:
+        print(f'Benchmarking {clip}...', file=sys.stderr)
+        results['clips'][clip] = benchmark_clip(clip, frame_count, stages, repeat, codec_options)
+
+    return results
+
+
+def print_results(results):
+    """
+        Prints the throughput of every stage, and its change against the baseline when compared with one
+    :param results: as returned by run()
+    :return:
+    """
+    print(f'{"clip":<14}{"stage":<18}{"MB/s":>10}{"frames/s":>11}{"vs base":>10}')
+
+    for clip, clip_results in results['clips'].items():
+        for stage, stage_results in clip_results['stages'].items():
+            change = stage_results.get('vs_baseline')
+            change = f'{change * 100:+.1f}%' if change is not None else ''
+            print(f'{clip:<14}{stage:<18}{stage_results["mb_per_s"]:>10.2f}{stage_results["frames_per_s"]:>11.2f}{change:>10}')
+
+
+def main(argv=None):
+    """
+        Command line entry point. Exits with status 1 when a stage is slower than the baseline by more than
+    --max-slowdown.
+    :param argv: arguments (defaults to sys.argv[1:])
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Measures the throughput of the codec stages')
+    parser.add_argument('--clips', nargs='+', default=DEFAULT_CLIPS, choices=list(SYNTHETIC_CLIPS) + ['new_flowers'],
+                        help='clips to benchmark')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='stages to measure')
+    parser.add_argument('--frames', type=int, default=5, help='frames per clip')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the fastest one counts')
+    parser.add_argument('--adaptive', action='store_true', help='full encode / decode with LOCO-I context modeling')
+    parser.add_argument('--workers', type=int, default=1, help='processes used by the full encode / decode')
+    parser.add_argument('--segments', action='store_true', help='full encode with independent plane segments')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--max-slowdown', type=float, default=0.1,
+                        help='fail when a stage is this much slower than the baseline (0.1 = 10%%)')
+
+    args = parser.parse_args(argv)
+
+    codec_options = {'adaptive': args.adaptive, 'workers': args.workers, 'segments': args.segments}
+    stages = [stage for stage in STAGES if stage in args.stages]
+    clips = [clip for clip in args.clips if clip != 'new_flowers' or os.path.exists(SAMPLE_CLIP_PATH)]
+
+    results = run(clips, args.frames, stages, args.repeat, codec_options)
+    regressions = []
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        if baseline.get('settings') != results['settings']:
+            print('Warning: the baseline was run with different settings', file=sys.stderr)
+
+        regressions = compare(results, baseline, args.max_slowdown)
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    for clip, stage, change in regressions:
+        print(f'REGRESSION: {clip} {stage} is {-change * 100:.1f}% slower than the baseline', file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,12 @@
+import io
 import logging
+import os
 from enum import Enum
 import struct
-import sys
+
+# Number of leading 1 bits of every byte value
+LEADING_ONES = [8 - (0xFF ^ byte).bit_length() for byte in range(256)]
+
 
 class OpenMode(Enum):
     WRITE = 0
@@ -13,22 +18,42 @@ class BitStream(object):
         Bit-level write and read operations to a file
     """
     __file_object = None
-    __byte_buffer = 0
-    __idx = 0
+    # False when the caller handed over an already open file object, which is then left open on close()
+    __owns_file_object = True
+    # Set by close(). The file object may be closed by its owner afterwards, so there is nothing to flush anymore.
+    __closed = False
     __logger = None
     __open_mode = None
 
-    # Entire file buffer. Only used in OpenMode.READ mode
+    # Part of the file being read (OpenMode.READ), topped up a chunk at a time as it is consumed, so memory use does
+    # not depend on the file size. __buffer_offset is the position of its first byte in the file.
     __file_buffer = None
     __current_byte_position = 0
+    __buffer_offset = 0
+    __read_chunk_size = 1 << 16
+    __end_of_file = False
+
+    # Bits read from the file buffer but not consumed yet (OpenMode.READ). Holds up to 64 bits.
+    __window = 0
+    __window_bits = 0
+    # Set when a bit read went past the end of the file (OpenMode.READ), see read_past_end()
+    __read_past_end = False
 
     __padding_with_zeros = True
 
+    # Pending bits (OpenMode.WRITE). Whole bytes are moved to the write buffer, which goes to the file in large chunks
+    __accumulator = 0
+    __accumulator_bits = 0
+    __write_buffer = None
+    __write_chunk_size = 1 << 16
+    # Bytes already handed to the file object (OpenMode.WRITE)
+    __bytes_written = 0
+
     def __init__(self, file_path: str, open_mode: OpenMode, padding_with_zeros=True):
         """
             Constructor of BitStream. Note: logging level should be set using the appropriate cmd flag (Python3 logging
         --log=INFO/DEBUG/etc)
-        :param file_path: string representing the file path to be opened
+        :param file_path: string representing the file path to be opened, or an open binary file object (e.g. io.BytesIO)
         :param open_mode: specify wether to read or write to the file
         """
 
@@ -38,6 +63,7 @@ class BitStream(object):
         rwb = None
         self.__current_byte_position = 0
         self.__padding_with_zeros = padding_with_zeros
+        self.__write_buffer = bytearray()
 
         if open_mode == OpenMode.WRITE:
             rwb = 'wb'
@@ -48,7 +74,12 @@ class BitStream(object):
         else:
             self.__logger.critical('Unexpected Open Mode specified!')
 
-        self.__file_object = open(file_path, rwb)
+        if hasattr(file_path, 'read') or hasattr(file_path, 'write'):
+            self.__file_object = file_path
+            self.__owns_file_object = False
+
+        else:
+            self.__file_object = open(file_path, rwb)
 
         if open_mode == OpenMode.READ:
             self.__init_read_buffer()
@@ -60,13 +91,44 @@ class BitStream(object):
 
     def __init_read_buffer(self):
         """
-            Called if OpenMode == READ. It will read the entire content of the file to memory.
+            Called if OpenMode == READ. Nothing is read until the first bits are requested.
+        :return:
+        """
+        self.__file_buffer = b''
+        self.__end_of_file = False
+        self.__buffer_offset = self.__file_object.tell() if self.__is_seekable() else 0
+
+    def __is_seekable(self):
+        return hasattr(self.__file_object, 'seekable') and self.__file_object.seekable()
+
+    def __fill_buffer(self, num_of_bytes):
+        """
+            Makes sure at least num_of_bytes unread bytes are buffered, unless the file ends first. Bytes consumed
+        before the last 8 (which the read window may still refer to) are dropped.
+        :param num_of_bytes:
         :return:
         """
-        self.__file_buffer = self.__file_object.read()
+        available_bytes = len(self.__file_buffer) - self.__current_byte_position
+        if available_bytes >= num_of_bytes or self.__end_of_file:
+            return
+
+        kept_position = max(0, self.__current_byte_position - 8)
+        chunks = [self.__file_buffer[kept_position:]]
+        self.__buffer_offset += kept_position
+        self.__current_byte_position -= kept_position
+
+        while available_bytes < num_of_bytes:
+            # Blocks until the chunk is complete or the input ends, so pipes work too
+            chunk = self.__file_object.read(max(self.__read_chunk_size, num_of_bytes - available_bytes))
 
-        self.__file_object.close()
-        # self.__read_byte()
+            if not chunk:
+                self.__end_of_file = True
+                break
+
+            chunks.append(chunk)
+            available_bytes += len(chunk)
+
+        self.__file_buffer = b''.join(chunks)
 
     def flush(self):
         """
@@ -75,82 +137,234 @@ class BitStream(object):
         """
         if self.__open_mode != OpenMode.WRITE:
             self.__logger.critical('OpenMode is not WRITE. Flush not performed.')
+            return
+
+        self.align_to_byte()
+        self.__write_out_buffer()
+
+        # Pipes and other file objects owned by the caller stay open, but the bytes must reach them
+        if not self.__owns_file_object and hasattr(self.__file_object, 'flush'):
+            self.__file_object.flush()
+
+    def align_to_byte(self):
+        """
+            Moves the stream to the next byte boundary. In OpenMode.WRITE the pending partial byte is padded (see
+        set_padding_mode()); in OpenMode.READ the rest of the current byte is skipped.
+        :return:
+        """
+        if self.__open_mode == OpenMode.READ:
+            # The window always holds whole bytes plus the unread part of the current one
+            self.skip_bits(self.__window_bits & 7)
+            return
+
+        self.__drain_accumulator()
 
-        if self.__idx != 0:
-            self.__logger.debug('Flushing {} bits of data to file'.format(self.__idx))
-            self.__write_byte()
+        if self.__accumulator_bits != 0:
+            self.__logger.debug('Flushing {} bits of data to file'.format(self.__accumulator_bits))
+            bitwise_length = 8 - self.__accumulator_bits
+            padding = 0 if self.__padding_with_zeros else 0xFF >> self.__accumulator_bits
+            self.__write_buffer.append((self.__accumulator << bitwise_length) | padding)
+
+            self.__logger.debug('Padded with {} {}'.format(bitwise_length, 'zeroes' if self.__padding_with_zeros else 'ones'))
+            self.__accumulator = 0
+            self.__accumulator_bits = 0
 
         else:
             self.__logger.debug('Byte buffer was empty. Flushing operation not performed')
 
-    def __write_byte(self):
+    def tell_bits(self) -> int:
         """
-            Writes byte buffer to file
+            Position of the stream in bits: bits written so far (OpenMode.WRITE, including the ones still buffered)
+        or bits consumed so far (OpenMode.READ)
         :return:
         """
-        if self.__open_mode != OpenMode.WRITE:
-            self.__logger.critical('OpenMode is not WRITE. __write_byte not performed.')
+        if self.__open_mode == OpenMode.READ:
+            return ((self.__buffer_offset + self.__current_byte_position) << 3) - self.__window_bits
+
+        return ((self.__bytes_written + len(self.__write_buffer)) << 3) + self.__accumulator_bits
+
+    def seek(self, byte_position, whence=os.SEEK_SET):
+        """
+            Moves the read position to a byte boundary (OpenMode.READ). Same arguments as file.seek(). Files that
+        cannot seek (pipes) can only move forward, which reads and drops the bytes in between.
+        :param byte_position:
+        :param whence: os.SEEK_SET, os.SEEK_CUR (from the current byte boundary) or os.SEEK_END
+        :return: new position in bytes
+        """
+        if self.__open_mode != OpenMode.READ:
+            self.__logger.critical('OpenMode is not READ. seek not performed.')
             return
 
-        if self.__idx == 8:
-            self.__file_object.write(self.__byte_buffer.to_bytes(1, byteorder='big'))
-            self.__byte_buffer = 0
+        if whence == os.SEEK_CUR:
+            byte_position += self.tell_bits() >> 3
+
+        elif whence == os.SEEK_END:
+            byte_position += self.__file_object.seek(0, os.SEEK_END)
+            self.__file_object.seek(self.__buffer_offset + len(self.__file_buffer))
 
-        # This should only run if self.flush() calls self.__write_byte()
-        elif self.__idx < 8:
-            bitwise_length = 8 - self.__idx
-            self.__byte_buffer = self.__byte_buffer << bitwise_length
+        byte_position = max(0, byte_position)
+        self.__window = 0
+        self.__window_bits = 0
+        self.__read_past_end = False
 
-            if not self.__padding_with_zeros:
-                mask = 0xFF >> self.__idx
-                self.__byte_buffer = self.__byte_buffer | mask
-                self.__logger.debug('Padded with {} ones'.format(bitwise_length))
-            else:
-                self.__logger.debug('Padded with {} zeroes'.format(bitwise_length))
+        buffer_position = byte_position - self.__buffer_offset
 
-            # print('IDX:', self.__idx)
-            # print('BUF:', bin(self.__byte_buffer))
-            # self.__byte_buffer = self.__byte_buffer | (~self.__byte_buffer)
+        if 0 <= buffer_position <= len(self.__file_buffer):
+            self.__current_byte_position = buffer_position
 
-            # print('BUF:', bin(self.__byte_buffer))
+        elif self.__is_seekable():
+            # Positions past the end stop at the end, like with a stream that has to be read through
+            byte_position = min(byte_position, self.__file_object.seek(0, os.SEEK_END))
+            self.__file_object.seek(byte_position)
+            self.__file_buffer = b''
+            self.__buffer_offset = byte_position
+            self.__current_byte_position = 0
+            self.__end_of_file = False
 
-            self.__file_object.write(self.__byte_buffer.to_bytes(1, byteorder='big'))
+        elif buffer_position > 0:
+            bytes_to_skip = buffer_position - len(self.__file_buffer)
+            self.__buffer_offset += len(self.__file_buffer)
+            self.__file_buffer = b''
+            self.__current_byte_position = 0
+
+            while bytes_to_skip > 0 and not self.__end_of_file:
+                chunk = self.__file_object.read(min(bytes_to_skip, self.__read_chunk_size))
+                self.__end_of_file = not chunk
+                self.__buffer_offset += len(chunk)
+                bytes_to_skip -= len(chunk)
 
         else:
-            self.__logger.debug(
-                '__write_byte was called in an unexpected state. Current byte buffer size: {}'.format(self.__idx))
+            raise io.UnsupportedOperation('Cannot seek backwards in a stream that is not seekable')
 
-        self.__idx = 0
+        return self.__buffer_offset + self.__current_byte_position
 
-    def write_bit(self, bit: str):
+    def __drain_accumulator(self):
         """
-            Writes one bit to file. Note: the actual content is only written when the buffer has been filled or flush was called.
-        :param bit:
+            Moves the complete bytes of the bit accumulator to the write buffer, leaving at most 7 bits behind
+        :return:
+        """
+        remaining_bits = self.__accumulator_bits & 7
+        self.__write_buffer += (self.__accumulator >> remaining_bits).to_bytes(self.__accumulator_bits >> 3, byteorder='big')
+        self.__accumulator &= (1 << remaining_bits) - 1
+        self.__accumulator_bits = remaining_bits
+
+        if len(self.__write_buffer) >= self.__write_chunk_size:
+            self.__write_out_buffer()
+
+    def __write_out_buffer(self):
+        """
+            Writes the buffered bytes to file
+        :return:
+        """
+        if self.__write_buffer:
+            self.__file_object.write(self.__write_buffer)
+            self.__bytes_written += len(self.__write_buffer)
+            self.__write_buffer = bytearray()
+
+    def write_bits(self, value: int, num_of_bits: int):
+        """
+            Writes the num_of_bits least significant bits of value, most significant bit first. Note: the actual
+        content is only written once enough bytes have been buffered or flush was called.
+        :param value: non-negative integer holding the code
+        :param num_of_bits: length of the code in bits
         :return:
         """
         if self.__open_mode != OpenMode.WRITE:
-            self.__logger.critical('OpenMode is not WRITE. Write_bit not performed.')
+            self.__logger.critical('OpenMode is not WRITE. write_bits not performed.')
             return
 
-        self.__idx = self.__idx + 1
+        self.__accumulator = (self.__accumulator << num_of_bits) | (value & ((1 << num_of_bits) - 1))
+        self.__accumulator_bits += num_of_bits
+
+        if self.__accumulator_bits >= 64:
+            self.__drain_accumulator()
+
+    def write_codes(self, values, lengths):
+        """
+            Writes a sequence of codes. Same as calling write_bits(value, length) for each pair, without the per
+        call overhead.
+        :param values: sequence (or numpy array) of non-negative integers, each fitting in its length
+        :param lengths: sequence (or numpy array) of code lengths in bits
+        :return:
+        """
+        if self.__open_mode != OpenMode.WRITE:
+            self.__logger.critical('OpenMode is not WRITE. write_codes not performed.')
+            return
+
+        if hasattr(values, 'tolist'):
+            values = values.tolist()
+
+        if hasattr(lengths, 'tolist'):
+            lengths = lengths.tolist()
 
+        accumulator = self.__accumulator
+        accumulator_bits = self.__accumulator_bits
+        write_buffer = self.__write_buffer
+
+        for value, length in zip(values, lengths):
+            accumulator = (accumulator << length) | value
+            accumulator_bits += length
+
+            if accumulator_bits >= 64:
+                remaining_bits = accumulator_bits & 7
+                write_buffer += (accumulator >> remaining_bits).to_bytes(accumulator_bits >> 3, byteorder='big')
+                accumulator &= (1 << remaining_bits) - 1
+                accumulator_bits = remaining_bits
+
+        self.__accumulator = accumulator
+        self.__accumulator_bits = accumulator_bits
+
+        if len(write_buffer) >= self.__write_chunk_size:
+            self.__write_out_buffer()
+
+    def write_packed_bits(self, data, num_of_bits: int):
+        """
+            Writes the first num_of_bits bits of an already packed (MSB first) byte sequence
+        :param data: bytes-like object
+        :param num_of_bits:
+        :return:
+        """
+        if self.__open_mode != OpenMode.WRITE:
+            self.__logger.critical('OpenMode is not WRITE. write_packed_bits not performed.')
+            return
+
+        self.__drain_accumulator()
+
+        if self.__accumulator_bits != 0:
+            # Not byte aligned. Shift the whole sequence into place as one integer
+            self.write_bits(int.from_bytes(data, byteorder='big') >> ((len(data) << 3) - num_of_bits), num_of_bits)
+            self.__drain_accumulator()
+            return
+
+        whole_bytes = num_of_bits >> 3
+        self.__write_buffer += memoryview(data)[:whole_bytes]
+        self.__accumulator_bits = num_of_bits & 7
+
+        if self.__accumulator_bits:
+            self.__accumulator = data[whole_bytes] >> (8 - self.__accumulator_bits)
+
+        if len(self.__write_buffer) >= self.__write_chunk_size:
+            self.__write_out_buffer()
+
+    def write_bit(self, bit: str):
+        """
+            Writes one bit to file. Note: the actual content is only written when the buffer has been filled or flush was called.
+        :param bit:
+        :return:
+        """
         if bit == '0':
-            self.__byte_buffer = self.__byte_buffer << 1
+            self.write_bits(0, 1)
 
         elif bit == '1':
-            self.__byte_buffer = self.__byte_buffer << 1
-            self.__byte_buffer = self.__byte_buffer | 1
+            self.write_bits(1, 1)
 
         else:
             self.__logger.error('Unexpected bit value: {}. Ignoring.'.format(bit))
 
-        if self.__idx >= 8:
-            self.__write_byte()
-
-    def write_n_bits(self, bits: [int]):
+    def write_n_bits(self, bits: str):
         """
             Writes n bits to the file
-        :param bits: list of integers representing the bit sequence
+        :param bits: string of '0' and '1' characters representing the bit sequence
         :return:
         """
 
@@ -158,85 +372,239 @@ class BitStream(object):
             self.__logger.critical('OpenMode is not WRITE. write_n_bits not performed.')
             return
 
+        if bits and not bits.strip('01'):
+            self.write_bits(int(bits, 2), len(bits))
+            return
+
         for b in bits:
             self.write_bit(b)
 
-    def __read_byte(self):
-        """"
-            Reads the next byte from buffer
+    def __refill_window(self):
         """
+            Tops up the read window with whole bytes from the buffer, up to 64 bits
+        :return:
+        """
+        n_bytes = (64 - self.__window_bits) >> 3
+        if self.__current_byte_position + n_bytes > len(self.__file_buffer):
+            self.__fill_buffer(n_bytes)
 
-        if self.__current_byte_position >= len(self.__file_buffer):
-            self.__logger.info('Reached end of file. Cannot read further.')
-            self.__byte_buffer = None
-            return False
+        chunk = self.__file_buffer[self.__current_byte_position:self.__current_byte_position + n_bytes]
 
-        self.__byte_buffer = self.__file_buffer[self.__current_byte_position]
-        self.__current_byte_position = self.__current_byte_position + 1
-        return True
+        self.__window = (self.__window << (len(chunk) << 3)) | int.from_bytes(chunk, byteorder='big')
+        self.__window_bits += len(chunk) << 3
+        self.__current_byte_position += len(chunk)
 
-    def read_bit(self) -> int:
+    def read_past_end(self) -> bool:
         """
-            Reads one bit from file
+            Whether a bit read since the last seek() asked for bits after the end of the file (OpenMode.READ). Such
+        reads return -1 or zeros instead of failing, so decoders check this once they are done with a block.
         :return:
         """
+        return self.__read_past_end
+
+    def bits_remaining(self) -> int:
+        """
+            Number of bits that can be read without waiting for more input (OpenMode.READ). Exact near the end of
+        the file; before that it is at least half a read chunk, not the size of the rest of the file.
+        :return:
+        """
+        if len(self.__file_buffer) - self.__current_byte_position < self.__read_chunk_size >> 1:
+            self.__fill_buffer(self.__read_chunk_size)
+
+        return ((len(self.__file_buffer) - self.__current_byte_position) << 3) + self.__window_bits
+
+    def __available_bits(self, num_of_bits):
+        """
+            Buffers enough input for the next num_of_bits bits if the file has them
+        :param num_of_bits:
+        :return: number of buffered bits, at least num_of_bits unless the file ends first
+        """
+        self.__fill_buffer((num_of_bits >> 3) + 1)
+
+        return ((len(self.__file_buffer) - self.__current_byte_position) << 3) + self.__window_bits
+
+    def peek_bits(self, num_of_bits: int) -> int:
+        """
+            Returns the next num_of_bits bits as an integer without consuming them. Bits past the end of the file
+        are read as zeros.
+        :param num_of_bits:
+        :return:
+        """
+        if self.__window_bits < num_of_bits:
+            self.__refill_window()
+
+            if self.__window_bits < num_of_bits:
+                self.__fill_buffer((num_of_bits >> 3) + 1)
+
+                if self.__current_byte_position < len(self.__file_buffer):
+                    # Longer than the window. Read it straight from the buffer
+                    bit_position = (self.__current_byte_position << 3) - self.__window_bits
+                    chunk = self.__file_buffer[bit_position >> 3:(bit_position + num_of_bits + 7) >> 3]
+                    available_bits = (len(chunk) << 3) - (bit_position & 7)
+                    value = int.from_bytes(chunk, byteorder='big') & ((1 << available_bits) - 1)
+
+                    if available_bits >= num_of_bits:
+                        return value >> (available_bits - num_of_bits)
+
+                    return value << (num_of_bits - available_bits)
+
+                return self.__window << (num_of_bits - self.__window_bits)
+
+        return (self.__window >> (self.__window_bits - num_of_bits)) & ((1 << num_of_bits) - 1)
+
+    def skip_bits(self, num_of_bits: int):
+        """
+            Consumes the next num_of_bits bits
+        :param num_of_bits:
+        :return:
+        """
+        if num_of_bits <= self.__window_bits:
+            self.__window_bits -= num_of_bits
+            self.__window &= (1 << self.__window_bits) - 1
+            return
+
+        num_of_bits -= self.__window_bits
+        self.__window = 0
+        self.__window_bits = 0
+        self.__fill_buffer((num_of_bits >> 3) + 8)
+
+        if self.__current_byte_position + (num_of_bits >> 3) > len(self.__file_buffer):
+            self.__read_past_end = True
+
+        self.__current_byte_position = min(self.__current_byte_position + (num_of_bits >> 3), len(self.__file_buffer))
+        self.__refill_window()
+
+        if self.__window_bits < num_of_bits & 7:
+            self.__read_past_end = True
+
+        self.__window_bits = max(self.__window_bits - (num_of_bits & 7), 0)
+        self.__window &= (1 << self.__window_bits) - 1
+
+    def read_bits(self, num_of_bits: int) -> int:
+        """
+            Reads the next num_of_bits bits as an unsigned integer (first bit is the most significant)
+        :param num_of_bits:
+        :return: the value read, or -1 if the file ends before num_of_bits bits could be read
+        """
         if self.__open_mode != OpenMode.READ:
-            self.__logger.critical('OpenMode is not READ. read_bit not performed.')
+            self.__logger.critical('OpenMode is not READ. read_bits not performed.')
             return -1
 
-        if self.__idx >= 8:
-            # Read next byte from file and update buffer
-            # Reset pointer to first bit
-            self.__idx = 0
-            if not self.__read_byte():
-                return -1
-
-        if self.__byte_buffer == None:
+        if self.__window_bits < num_of_bits and self.__available_bits(num_of_bits) < num_of_bits:
+            self.__logger.info('Reached end of file. Cannot read further.')
+            self.__read_past_end = True
             return -1
 
-        mask = int(2 ** (7 - self.__idx))
-        bit = self.__byte_buffer & mask
+        value = self.peek_bits(num_of_bits)
+        self.skip_bits(num_of_bits)
+
+        return value
+
+    def count_leading_ones(self) -> int:
+        """
+            Consumes consecutive 1 bits and returns how many there were. The terminating 0 is not consumed. Works
+        a byte at a time with a lookup table.
+        :return:
+        """
+        count = 0
+
+        while True:
+            if self.__window_bits < 8:
+                self.__refill_window()
+
+                if self.__window_bits < 8:
+                    # End of file. Missing bits are zeros, so this byte ends the run
+                    ones = LEADING_ONES[(self.__window << (8 - self.__window_bits)) & 0xFF]
+                    if ones == self.__window_bits:
+                        # No terminating 0 before the end
+                        self.__read_past_end = True
+
+                    self.__window_bits -= ones
+                    self.__window &= (1 << self.__window_bits) - 1
+                    return count + ones
+
+            ones = LEADING_ONES[self.__window >> (self.__window_bits - 8)]
+            self.__window_bits -= ones
+            self.__window &= (1 << self.__window_bits) - 1
+            count += ones
+
+            if ones < 8:
+                return count
+
+    def read_bit(self) -> int:
+        """
+            Reads one bit from file
+        :return: the bit, or -1 at the end of the file
+        """
+        if self.__open_mode != OpenMode.READ:
+            self.__logger.critical('OpenMode is not READ. read_bit not performed.')
+            return -1
 
-        self.__idx = self.__idx + 1
-        return 1 if bit != 0 else 0
+        return self.read_bits(1)
 
     def read_n_bits(self, num_of_bits: int) -> str:
         """
             Reads n bits from the sequence
         :param num_of_bits:
-        :return: bit sequence represented as a string
+        :return: bit sequence represented as a string. Shorter than num_of_bits if the file ended first.
         """
-        if self.__current_byte_position >= len(self.__file_buffer) and self.__byte_buffer is None:
+        bits_remaining = self.__available_bits(max(num_of_bits, 1))
+
+        if bits_remaining <= 0:
             return -1
 
-        # lst = []
-        bit_sequence_str = ''
-        for i in range(0, num_of_bits):
-            bit = self.read_bit()
+        num_of_bits = min(num_of_bits, bits_remaining)
+
+        if num_of_bits == 0:
+            return ''
 
-            if bit == -1:
-                return bit_sequence_str
+        return format(self.read_bits(num_of_bits), '0{}b'.format(num_of_bits))
 
-            bit_sequence_str = bit_sequence_str + str(bit)
+    def __read_aligned_bytes(self, num_of_bytes):
+        """
+            Skips what is left of the current byte and reads the next num_of_bytes bytes
+        :param num_of_bytes:
+        :return: bytes object, or None if the file ends first
+        """
+        # Leftover bits are all in the window, which always holds whole bytes plus the unread part of one byte
+        self.__current_byte_position -= self.__window_bits >> 3
+        self.__window = 0
+        self.__window_bits = 0
+
+        self.__fill_buffer(num_of_bytes)
+
+        if self.__current_byte_position + num_of_bytes > len(self.__file_buffer):
+            self.__logger.info('Reached end of file. Cannot read further.')
+            self.__current_byte_position = len(self.__file_buffer)
+            return None
 
-        return bit_sequence_str
+        sequence = self.__file_buffer[self.__current_byte_position:self.__current_byte_position + num_of_bytes]
+        self.__current_byte_position += num_of_bytes
+
+        return sequence
 
     def close(self):
         """
             Closes file handler and flushes buffer if necessary
         :return:
         """
+        if self.__closed:
+            return
+
         if self.__open_mode == OpenMode.WRITE:
             self.flush()
 
         elif self.__open_mode == OpenMode.READ:
-            self.__file_buffer == None
-            self.__byte_buffer == None
+            self.__file_buffer = None
+
+        if self.__owns_file_object:
+            self.__file_object.close()
 
-        self.__file_object.close()
+        self.__closed = True
 
     def __del__(self):
-        if self.__open_mode == OpenMode.WRITE:
+        if self.__open_mode == OpenMode.WRITE and not self.__closed and self.__file_object is not None and \
+                not self.__file_object.closed:
             self.flush()
 
 
@@ -249,15 +617,9 @@ class BitStream(object):
             self.__logger.critical('OpenMode is not READ. readint not performed.')
             return
 
-        sequence = []
-        for x in range(0, n_bytes):
-            if not self.__read_byte():
-                return None
-
-            sequence.append(self.__byte_buffer)
-
-        # Advance to next byte since everything from the current one was consumed
-        self.__idx += 8
+        sequence = self.__read_aligned_bytes(n_bytes)
+        if sequence is None:
+            return None
 
         return int.from_bytes(sequence, byteorder='big')
 
@@ -270,16 +632,11 @@ class BitStream(object):
             self.__logger.critical('OpenMode is not READ. readint not performed.')
             return
 
-        if not self.__read_byte():
+        sequence = self.__read_aligned_bytes(1)
+        if sequence is None:
             return None
 
-        # Advance to next byte since everything from the current one was consumed
-        self.__idx += 8
-
-        print('Content:', self.__byte_buffer)
-        t = struct.unpack('b', self.__byte_buffer.to_bytes(1, sys.byteorder))[0]
-        print('t: ', type(t))
-        return t
+        return struct.unpack('b', sequence)[0]
 
     def write_int(self, number, n_bytes):
         """
@@ -291,7 +648,7 @@ class BitStream(object):
             return
 
         # self.__file_object.write(struct.pack('B', number))
-        self.__file_object.write(number.to_bytes(n_bytes, byteorder='big'))
+        self.write_bytes(number.to_bytes(n_bytes, byteorder='big'))
 
     def write_signed_int(self, number):
         """
@@ -302,43 +659,45 @@ class BitStream(object):
             self.__logger.critical('OpenMode is not WRITE. write_int not performed.')
             return
 
-        self.__file_object.write(struct.pack('b', number))
+        self.write_bytes(struct.pack('b', number))
 
     def write_bytes(self, bs):
         if self.__open_mode != OpenMode.WRITE:
             self.__logger.critical('OpenMode is not WRITE. write_int not performed.')
             return
 
-        self.__file_object.write(bs)
+        # Byte-level writes go after the complete bytes but before a pending partial byte
+        self.__drain_accumulator()
+
+        if len(bs) >= self.__write_chunk_size:
+            # Large blocks (e.g. whole decoded planes) go straight to the file instead of through the buffer
+            self.__write_out_buffer()
+            self.__file_object.write(bs)
+            self.__bytes_written += len(bs)
+            return
+
+        self.__write_buffer += bs
+
+        if len(self.__write_buffer) >= self.__write_chunk_size:
+            self.__write_out_buffer()
 
     def write_str(self, string):
         if self.__open_mode != OpenMode.WRITE:
             self.__logger.critical('OpenMode is not WRITE. write_int not performed.')
             return
 
-        self.__file_object.write(string.encode('utf-8'))
+        self.write_bytes(string.encode('utf-8'))
 
     def read_bytes(self, num_of_bytes):
         if self.__open_mode != OpenMode.READ:
             self.__logger.critical('OpenMode is not READ. readint not performed.')
             return
 
-        sequence = []
-        for x in range(0, num_of_bytes):
-            if not self.__read_byte():
-                return None
-
-            sequence.append(self.__byte_buffer)
-
-        self.__idx += 8
+        sequence = self.__read_aligned_bytes(num_of_bytes)
+        if sequence is None:
+            return None
 
-        return sequence
+        return bytes(sequence)
 
     def has_reached_eof(self):
-        if self.__current_byte_position == len(self.__file_buffer) and self.__idx >= 8:
-            return True
-
-        return False
-
-        
-
+        return self.bits_remaining() <= 0
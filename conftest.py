@@ -0,0 +1,19 @@
+import io
+
+# test_video_player.py runs the player from the command line, it holds no tests
+collect_ignore = ['test_video_player.py']
+
+
+class UnseekableReader(io.RawIOBase):
+    """
+        Binary file object that can only be read forward, like a pipe
+    """
+
+    def __init__(self, data):
+        self.__data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.__data.readinto(buffer)
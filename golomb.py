@@ -1,9 +1,10 @@
+import functools
 import math
+import numpy as np
 from bit_stream import BitStream, OpenMode
 import binascii
 import os
 import logging
-from time_perf import get_delta
 
 def __truncated_binary_encoding(n: int, b: int) -> str:
     """Return string representing given number in truncated binary encoding.
@@ -12,7 +13,12 @@ def __truncated_binary_encoding(n: int, b: int) -> str:
     """
     k = math.floor(math.log2(b))
     u = (1 << k+1) - b
-    return f"{{0:0{k}b}}".format(n if n < u else n+u)
+
+    if n < u:
+        return f"{{0:0{k}b}}".format(n)
+
+    # The remaining values take one more bit
+    return f"{{0:0{k+1}b}}".format(n+u)
 
 def encode(input, m):
     signal_bit = '0'
@@ -25,6 +31,86 @@ def encode(input, m):
 
     return write_str
 
+# Number of residuals packed per step by pack_array. Bounds the size of the temporary bit arrays.
+PACK_CHUNK_SIZE = 1 << 16
+
+
+@functools.lru_cache(maxsize=None)
+def code_table(m):
+    """
+        Builds (once per m) the codes produced by encode() for every residual in [-255, 255]. Codes longer than
+    32 bits are split in 32-bit pieces.
+    :param m: Golomb parameter
+    :return: (values, lengths) arrays of shape (511, pieces). Row r + 255 holds the pieces of the code of residual r,
+    right-aligned: unused leading pieces have length 0.
+    """
+    codes = [encode(residual, m) for residual in range(-255, 256)]
+    pieces = max(math.ceil(len(code) / 32) for code in codes)
+
+    values = np.zeros((len(codes), pieces), dtype=np.uint32)
+    lengths = np.zeros((len(codes), pieces), dtype=np.uint8)
+
+    for row, code in enumerate(codes):
+        for piece in range(pieces - 1, -1, -1):
+            code, bits = code[:-32], code[-32:]
+
+            if bits:
+                values[row, piece] = int(bits, 2)
+                lengths[row, piece] = len(bits)
+
+    return values, lengths
+
+
+def pack_array(residuals, m):
+    """
+        Golomb-encodes a whole array of residuals at once. The result is the concatenation of encode(r, m) for
+    every residual, in raster order, packed MSB first.
+    :param residuals: integer array with values in [-255, 255]
+    :param m: Golomb parameter
+    :return: (bytes, number of bits). The last byte is padded with zeros.
+    """
+    values, lengths = code_table(m)
+    width = int(lengths.max())
+
+    # Bit i of a piece, counted from the left of a width-bit field
+    shifts = np.arange(width - 1, -1, -1, dtype=np.uint32)
+    positions = np.arange(width)
+
+    indexes = np.asarray(residuals).ravel().astype(np.intp) + 255
+    chunks = []
+    leftover_bits = np.zeros(0, dtype=np.uint8)
+    num_of_bits = 0
+
+    for start in range(0, len(indexes), PACK_CHUNK_SIZE):
+        chunk_indexes = indexes[start:start + PACK_CHUNK_SIZE]
+        chunk_values = values[chunk_indexes].ravel()
+        chunk_lengths = lengths[chunk_indexes].ravel()
+
+        # Expand every piece to width bits and keep only its last length bits
+        bits = ((chunk_values[:, None] >> shifts) & 1).astype(np.uint8)
+        bits = bits[positions >= (width - chunk_lengths)[:, None]]
+        num_of_bits += len(bits)
+
+        bits = np.concatenate((leftover_bits, bits))
+        whole_bytes_bits = len(bits) & ~7
+        chunks.append(np.packbits(bits[:whole_bytes_bits]).tobytes())
+        leftover_bits = bits[whole_bytes_bits:]
+
+    chunks.append(np.packbits(leftover_bits).tobytes())
+
+    return b''.join(chunks), num_of_bits
+
+
+def encode_array(residuals, m):
+    """
+        Golomb-encodes a whole array of residuals. See pack_array.
+    :param residuals: integer array with values in [-255, 255]
+    :param m: Golomb parameter
+    :return: bytes, with the last byte padded with zeros
+    """
+    return pack_array(residuals, m)[0]
+
+
 def decode(m, num_of_values_to_return, input_bit_stream):
     counter = 0
     rtn_list = []
@@ -32,8 +118,6 @@ def decode(m, num_of_values_to_return, input_bit_stream):
     decode = int(math.pow(2, b) - m)
 
     while int(num_of_values_to_return - counter) != 0:
-        num_of_ones = 0
-
         # if report_progress_callback:
         #     report_progress_callback(counter/self.__input_file_size*100.0)
 
@@ -44,25 +128,19 @@ def decode(m, num_of_values_to_return, input_bit_stream):
             # self.__logger.warning('Got -1 on reading signal bit. SHOULD NOT HAPPEN.')
             break
 
-        bit = input_bit_stream.read_bit()
-
-        while bit == 1:
-            num_of_ones = num_of_ones + 1
-            bit = input_bit_stream.read_bit()
+        num_of_ones = input_bit_stream.count_leading_ones()
 
         # If this happened, we have reached the end of the stream without a unary terminating 0
-        if bit == -1:
+        if input_bit_stream.read_bit() == -1:
             break
 
         num_of_bits_to_read = b - 1
 
-        x = input_bit_stream.read_n_bits(num_of_bits_to_read)
+        int_x = input_bit_stream.read_bits(num_of_bits_to_read)
 
-        if x == None or x == '':
+        if int_x == -1:
             break
 
-        int_x = int(x, 2)
-
         result = -1
         if int_x < decode:
             result = num_of_ones * m + int_x
@@ -78,4 +156,106 @@ def decode(m, num_of_values_to_return, input_bit_stream):
 
         counter += 1
 
-    return rtn_list
\ No newline at end of file
+    return rtn_list
+
+# Codes of up to this many bits are decoded with a single table lookup by decode_array
+DECODE_TABLE_BITS = 16
+
+
+@functools.lru_cache(maxsize=None)
+def decode_table(m):
+    """
+        Builds (once per m) a lookup table indexed by the next DECODE_TABLE_BITS bits of the stream. For every
+    code produced by encode() that fits in DECODE_TABLE_BITS, all the entries starting with that code hold its
+    value and length. Entries with length 0 mean the code is longer and must be decoded bit by bit.
+    :param m: Golomb parameter
+    :return: (values, lengths) lists of 2 ** DECODE_TABLE_BITS entries
+    """
+    values = [0] * (1 << DECODE_TABLE_BITS)
+    lengths = [0] * (1 << DECODE_TABLE_BITS)
+
+    magnitude = 0
+    while True:
+        code = encode(magnitude, m)[1:]
+
+        if len(code) >= DECODE_TABLE_BITS:
+            break
+
+        for signal_bit, value in (('0', magnitude), ('1', -magnitude)):
+            free_bits = DECODE_TABLE_BITS - len(code) - 1
+            first = int(signal_bit + code, 2) << free_bits
+
+            values[first:first + (1 << free_bits)] = [value] * (1 << free_bits)
+            lengths[first:first + (1 << free_bits)] = [len(code) + 1] * (1 << free_bits)
+
+        magnitude += 1
+
+    return values, lengths
+
+
+def decode_array(m, num_of_values_to_return, input_bit_stream):
+    """
+        Decodes num_of_values_to_return Golomb codes (as written by encode(), m >= 2) into a numpy array. Short
+    codes are decoded with one table lookup. Longer ones read the unary part with count_leading_ones() and the
+    truncated binary part as whole integers.
+    :param m: Golomb parameter
+    :param num_of_values_to_return:
+    :param input_bit_stream: BitStream opened in OpenMode.READ
+    :return: int16 array. Shorter than num_of_values_to_return if the stream ended first.
+    """
+    table_values, table_lengths = decode_table(m)
+    b = math.ceil(math.log(m, 2))  # ceil ( log2 (m) )
+    decode = (1 << b) - m
+
+    peek_bits = input_bit_stream.peek_bits
+    skip_bits = input_bit_stream.skip_bits
+    read_bits = input_bit_stream.read_bits
+
+    values = np.zeros(num_of_values_to_return, dtype=np.int16)
+    i = 0
+
+    while i < num_of_values_to_return:
+        # Table codes take at most DECODE_TABLE_BITS bits, so this many of them cannot run past the end of the stream
+        bits_remaining = input_bit_stream.bits_remaining()
+
+        if bits_remaining <= 0:
+            return values[:i]
+
+        batch_end = min(num_of_values_to_return, i + max(1, bits_remaining // DECODE_TABLE_BITS))
+
+        while i < batch_end:
+            window = peek_bits(DECODE_TABLE_BITS)
+            length = table_lengths[window]
+
+            if not length or length > bits_remaining:
+                break
+
+            skip_bits(length)
+            values[i] = table_values[window]
+            i += 1
+
+        else:
+            continue
+
+        signal_bit = read_bits(1)
+        num_of_ones = input_bit_stream.count_leading_ones()
+
+        # Unary terminating 0 and the first b - 1 bits of the remainder
+        int_x = read_bits(b)
+
+        if int_x == -1:
+            return values[:i]
+
+        int_x &= (1 << (b - 1)) - 1
+
+        if int_x < decode:
+            result = num_of_ones * m + int_x
+
+        else:
+            int_x = int_x * 2 + read_bits(1)
+            result = num_of_ones * m + int_x - decode
+
+        values[i] = -result if signal_bit == 1 else result
+        i += 1
+
+    return values
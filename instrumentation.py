@@ -0,0 +1,349 @@
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+import prediction
+
+# Stages the codec reports times for
+STAGES = ('read', 'predict', 'entropy', 'write')
+
+# Residuals are counted modulo 256, as the fixed-m bitstream stores them, in [-128, 127]. Adaptive planes count the
+# errors LOCO-I codes instead (see loco_i.encode_plane()), which already are in that range.
+HISTOGRAM_MIN = -128
+HISTOGRAM_BINS = 256
+
+# Upper bounds of the Prometheus histogram buckets of the absolute residuals
+PROMETHEUS_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def escape_label_value(value):
+    """
+        Escapes a Prometheus label value: backslashes, double quotes and line feeds, as the text format requires
+    :param value:
+    :return: str
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class NullRecorder(object):
+    """
+        Recorder used while instrumentation is disabled: every call does nothing, so the codec can report its
+    metrics unconditionally at (almost) no cost
+    """
+    enabled = False
+    histograms = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def timer(self, stage, plane_name=None):
+        return self
+
+    def add_time(self, stage, seconds, plane_name=None):
+        pass
+
+    def count_plane(self, plane_name, plane, num_of_bits, residuals=None):
+        pass
+
+    def end_frame(self, frame_number):
+        pass
+
+    def close(self):
+        pass
+
+
+class StageTimer(object):
+    """
+        Context manager adding the time spent in its block to a stage of a Recorder
+    """
+    __slots__ = ('recorder', 'stage', 'plane_name', 'start')
+
+    def __init__(self, recorder, stage, plane_name):
+        self.recorder = recorder
+        self.stage = stage
+        self.plane_name = plane_name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.recorder.add_time(self.stage, time.perf_counter() - self.start, self.plane_name)
+        return False
+
+
+class Recorder(object):
+    """
+        Collects the metrics of a coding run: time spent per stage (see STAGES), per frame and per plane, bits per
+    sample and residual histograms per plane, and peak memory. Every frame is written as a JSON line when it ends;
+    totals are written (JSON line and/or Prometheus text file) on close().
+
+        Planes coded in worker processes (--workers) are not seen by the recorder, only the read and write stages
+    of the parent process are.
+    """
+
+    def __init__(self, json_lines_path=None, prometheus_path=None, histograms=True, memory=False, labels=None):
+        """
+        :param json_lines_path: file to write a JSON line per frame (and the totals) to
+        :param prometheus_path: file to write the totals to, in the Prometheus text format
+        :param histograms: count the coded residuals of every plane: the MED residuals of fixed-m planes, the
+        prediction errors after context modeling of adaptive ones
+        :param memory: trace the peak memory use with tracemalloc, which slows the whole process down
+        :param labels: dict of labels (e.g. clip name, content class) added to every output
+        """
+        self.enabled = True
+        self.__json_lines_file = open(json_lines_path, 'w') if json_lines_path else None
+        self.__prometheus_path = prometheus_path
+        self.histograms = histograms
+        self.__labels = dict(labels or {})
+        self.__trace_memory = memory and not tracemalloc.is_tracing()
+
+        if self.__trace_memory:
+            tracemalloc.start()
+
+        self.frame_count = 0
+        self.peak_memory = 0
+        self.totals = self.__new_record()
+        self.__frame = self.__new_record()
+        self.__residual_counts = {}
+
+    @staticmethod
+    def __new_record():
+        return {'seconds': dict.fromkeys(STAGES, 0.0), 'planes': {}}
+
+    @staticmethod
+    def __plane_record(record, plane_name):
+        if plane_name not in record['planes']:
+            record['planes'][plane_name] = {'seconds': dict.fromkeys(STAGES, 0.0), 'bits': 0, 'samples': 0}
+
+        return record['planes'][plane_name]
+
+    def timer(self, stage, plane_name=None):
+        """
+            Times a block of code: `with recorder.timer('predict', 'y'): ...`
+        :param stage: one of STAGES
+        :param plane_name: 'y', 'u' or 'v', None for work on the whole frame
+        :return: context manager
+        """
+        return StageTimer(self, stage, plane_name)
+
+    def add_time(self, stage, seconds, plane_name=None):
+        for record in (self.__frame, self.totals):
+            record['seconds'][stage] += seconds
+
+            if plane_name is not None:
+                self.__plane_record(record, plane_name)['seconds'][stage] += seconds
+
+    def count_plane(self, plane_name, plane, num_of_bits, residuals=None):
+        """
+            Counts a coded plane (or segment of a plane)
+        :param plane_name:
+        :param plane: the samples (2D uint8 array)
+        :param num_of_bits: size of the coded plane
+        :param residuals: the residuals coded for it (any shape). Its MED residuals are computed when not given.
+        :return:
+        """
+        for record in (self.__frame, self.totals):
+            plane_record = self.__plane_record(record, plane_name)
+            plane_record['bits'] += num_of_bits
+            plane_record['samples'] += plane.size
+
+        if self.histograms and plane.size:
+            if residuals is None:
+                residuals = prediction.residuals(plane)
+
+            counts = np.bincount(((residuals.ravel() - HISTOGRAM_MIN) & 0xFF), minlength=HISTOGRAM_BINS)
+
+            if plane_name in self.__residual_counts:
+                self.__residual_counts[plane_name] += counts
+
+            else:
+                self.__residual_counts[plane_name] = counts
+
+    def end_frame(self, frame_number):
+        """
+            Closes the record of the current frame and writes it out
+        :param frame_number: 0-based
+        :return:
+        """
+        frame_record = self.__frame
+        frame_record['frame'] = frame_number
+        self.__frame = self.__new_record()
+        self.frame_count += 1
+
+        if tracemalloc.is_tracing():
+            frame_record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+            self.peak_memory = max(self.peak_memory, frame_record['peak_memory_bytes'])
+
+            # Peak of every frame on its own (Python 3.9+); otherwise the peak so far
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+
+        if self.__json_lines_file is not None:
+            self.__write_json_line('frame', frame_record)
+
+    def summary(self):
+        """
+            Totals of the run
+        :return: dict
+        """
+        summary = {'frames': self.frame_count, 'seconds': dict(self.totals['seconds']), 'planes': {}}
+
+        for plane_name, plane_record in self.totals['planes'].items():
+            summary['planes'][plane_name] = self.__with_bits_per_sample(plane_record)
+
+            if plane_name in self.__residual_counts:
+                summary['planes'][plane_name]['residual_histogram'] = {
+                    'min': HISTOGRAM_MIN, 'counts': self.__residual_counts[plane_name].tolist()}
+
+        if tracemalloc.is_tracing():
+            summary['peak_memory_bytes'] = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+
+        return summary
+
+    def close(self):
+        """
+            Writes the totals and releases the outputs
+        :return:
+        """
+        summary = self.summary()
+
+        if self.__json_lines_file is not None:
+            self.__write_json_line('summary', summary)
+            self.__json_lines_file.close()
+            self.__json_lines_file = None
+
+        if self.__prometheus_path:
+            with open(self.__prometheus_path, 'w') as prometheus_file:
+                prometheus_file.write(self.prometheus_text(summary))
+
+        if self.__trace_memory:
+            tracemalloc.stop()
+            self.__trace_memory = False
+
+    def prometheus_text(self, summary=None):
+        """
+            Totals in the Prometheus text exposition format
+        :param summary: as returned by summary()
+        :return: str
+        """
+        summary = summary or self.summary()
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f'# HELP jpeg_ls_{name} {help_text}')
+            lines.append(f'# TYPE jpeg_ls_{name} {metric_type}')
+
+            for labels, value in samples:
+                lines.append(f'jpeg_ls_{name}{self.__format_labels(labels)} {value}')
+
+        planes = summary['planes']
+
+        metric('frames_total', 'counter', 'Frames coded', [({}, summary['frames'])])
+        metric('stage_seconds_total', 'counter', 'Time spent per stage',
+               [({'stage': stage}, seconds) for stage, seconds in summary['seconds'].items()])
+        metric('plane_stage_seconds_total', 'counter', 'Time spent per stage and plane',
+               [({'plane': plane_name, 'stage': stage}, seconds)
+                for plane_name, plane_summary in planes.items() for stage, seconds in plane_summary['seconds'].items()])
+        metric('plane_bits_total', 'counter', 'Coded bits per plane',
+               [({'plane': plane_name}, plane_summary['bits']) for plane_name, plane_summary in planes.items()])
+        metric('plane_samples_total', 'counter', 'Coded samples per plane',
+               [({'plane': plane_name}, plane_summary['samples']) for plane_name, plane_summary in planes.items()])
+        metric('plane_bits_per_sample', 'gauge', 'Average coded bits per sample',
+               [({'plane': plane_name}, plane_summary['bits_per_sample']) for plane_name, plane_summary in planes.items()])
+
+        # Cumulative buckets of the absolute residuals
+        absolute_residuals = np.abs(np.arange(HISTOGRAM_MIN, HISTOGRAM_MIN + HISTOGRAM_BINS))
+        histogram_samples = []
+        histogram_totals = {}
+
+        for plane_name, plane_summary in planes.items():
+            if 'residual_histogram' not in plane_summary:
+                continue
+
+            counts = np.asarray(plane_summary['residual_histogram']['counts'])
+
+            for bucket in PROMETHEUS_BUCKETS:
+                histogram_samples.append(({'plane': plane_name, 'le': bucket}, int(counts[absolute_residuals <= bucket].sum())))
+
+            histogram_samples.append(({'plane': plane_name, 'le': '+Inf'}, int(counts.sum())))
+            histogram_totals[plane_name] = (int((counts * absolute_residuals).sum()), int(counts.sum()))
+
+        if histogram_samples:
+            lines.append('# HELP jpeg_ls_residual_abs Absolute coded residuals (modulo 256) per plane')
+            lines.append('# TYPE jpeg_ls_residual_abs histogram')
+
+            for labels, value in histogram_samples:
+                lines.append(f'jpeg_ls_residual_abs_bucket{self.__format_labels(labels)} {value}')
+
+            for plane_name, (absolute_sum, count) in histogram_totals.items():
+                lines.append(f'jpeg_ls_residual_abs_sum{self.__format_labels({"plane": plane_name})} {absolute_sum}')
+                lines.append(f'jpeg_ls_residual_abs_count{self.__format_labels({"plane": plane_name})} {count}')
+
+        if 'peak_memory_bytes' in summary:
+            metric('peak_memory_bytes', 'gauge', 'Peak memory traced by tracemalloc', [({}, summary['peak_memory_bytes'])])
+
+        return '\n'.join(lines) + '\n'
+
+    def __format_labels(self, labels):
+        labels = {**self.__labels, **labels}
+        if not labels:
+            return ''
+
+        return '{' + ','.join(f'{key}="{escape_label_value(value)}"' for key, value in labels.items()) + '}'
+
+    @staticmethod
+    def __with_bits_per_sample(plane_record):
+        plane_record = dict(plane_record, seconds=dict(plane_record['seconds']))
+        plane_record['bits_per_sample'] = round(plane_record['bits'] / plane_record['samples'], 4) if plane_record['samples'] else 0
+
+        return plane_record
+
+    def __write_json_line(self, event, record):
+        if event == 'frame':
+            record = dict(record, planes={plane_name: self.__with_bits_per_sample(plane_record)
+                                          for plane_name, plane_record in record['planes'].items()})
+
+        self.__json_lines_file.write(json.dumps({'event': event, **self.__labels, **record}) + '\n')
+        self.__json_lines_file.flush()
+
+
+__null_recorder = NullRecorder()
+__active_recorder = __null_recorder
+
+
+def recorder():
+    """
+        The recorder the codec reports to: a NullRecorder unless enable() was called
+    :return:
+    """
+    return __active_recorder
+
+
+def enable(**options):
+    """
+        Starts collecting metrics (see Recorder for the options). A recorder already active is closed first.
+    :return: the new Recorder
+    """
+    global __active_recorder
+
+    disable()
+    __active_recorder = Recorder(**options)
+
+    return __active_recorder
+
+
+def disable():
+    """
+        Stops collecting metrics and writes the totals of the active recorder
+    :return:
+    """
+    global __active_recorder
+
+    __active_recorder.close()
+    __active_recorder = __null_recorder
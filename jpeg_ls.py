@@ -1,298 +1,1167 @@
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import io
 import math
 import os
-import time
+import struct
+import sys
 import numpy as np
+import yuv_player
 from yuv_player import YuvDecoder
-import argparse
 import golomb 
-import cv2 as cv
+import instrumentation
+import loco_i
+import prediction
+import shared_frames
 from bit_stream import BitStream, OpenMode
 import logging
-from colorama import Fore
-from time_perf import set_ref_time, get_delta
 
-parser = argparse.ArgumentParser()
-parser.add_argument("action", choices=[
-					'enc', 'dec'], help="set the input file")
-parser.add_argument("input_file", help="set the input file")
 
-args = parser.parse_args()
+# Value of the m_param header field for files encoded with LOCO-I context modeling (adaptive Golomb parameter)
+ADAPTIVE_M_PARAM = 0
 
-def get_pixel_value(plane, x, y):
+COLOR_SPACES = {'4:4:4': 0, '4:2:2': 1, '4:2:0': 2, 'mono': 3}
+
+# Value of the frame count header field when the input was a stream (pipe) whose length was not known up front. Such
+# files are always FLAG_FRAMED, so the decoder reads frames until the end of the file.
+UNKNOWN_FRAME_COUNT = 0xFFFFFFFF
+
+# File path standing for the standard input (reading) or output (writing)
+STANDARD_STREAM_PATH = '-'
+
+# Names of the planes of a frame, as reported to the instrumentation
+PLANE_NAMES = ('y', 'u', 'v')
+
+# The color space header field only uses its lowest byte. The bits above it flag optional layout features, so files
+# written without any of them keep the original layout.
+COLOR_SPACE_MASK = 0xFF
+
+# Every frame starts on a byte boundary and is preceded by the size of its payload (4 bytes), so frames can be
+# coded independently of each other
+FLAG_FRAMED = 1 << 8
+
+# Every frame starts on a byte boundary and the file ends with a frame offset table: for each frame, the byte offset
+# of its coded data and its length in bits (8 bytes each), followed by the byte offset of the table itself (8 bytes)
+FLAG_FRAME_INDEX = 1 << 9
+
+# Frames are split into segments coded independently of each other (see frame_segments()): one per plane, or
+# horizontal stripes whose first row is coded as the top row of a plane. The frame payload starts with the sizes of
+# its segments (4 bytes each), followed by the byte-aligned segments. Implies FLAG_FRAMED. The header carries the
+# stripe height (4 bytes, 0 for whole planes) right before the raw Y4M header.
+FLAG_SEGMENTS = 1 << 10
+
+# Near-lossless coding: every decoded sample is within NEAR of the original one (LOCO-I only, see
+# loco_i.encode_plane()). The header carries NEAR (4 bytes) right before the raw Y4M header, after the stripe height.
+FLAG_NEAR_LOSSLESS = 1 << 11
+
+# Temporal prediction: the rows of a frame may be predicted from the previous decoded frame (see
+# loco_i.encode_plane()), except in intra frames, whose frame number is a multiple of the intra period. Decoding a frame
+# needs the frames from the last intra frame on. LOCO-I only. The header carries the intra period (4 bytes) right
+# before the raw Y4M header, after NEAR.
+FLAG_TEMPORAL = 1 << 12
+
+
+def standard_stream(file_path, open_mode):
+	"""
+		Maps STANDARD_STREAM_PATH to the binary standard input (OpenMode.READ) or output (OpenMode.WRITE)
+	:param file_path:
+	:param open_mode:
+	:return: the stream, or file_path unchanged for any other path
+	"""
+	if file_path != STANDARD_STREAM_PATH:
+		return file_path
+
+	return sys.stdin.buffer if open_mode == OpenMode.READ else sys.stdout.buffer
+
+
+def plane_shapes(frame_width, frame_height, color_space_int):
+	"""
+		Shapes of the Y, U and V planes of a frame
+	:param frame_width:
+	:param frame_height:
+	:param color_space_int: value from COLOR_SPACES
+	:return: list of three (rows, cols) tuples
+	"""
+	color_space = {value: name for name, value in COLOR_SPACES.items()}[color_space_int]
+
+	return yuv_player.plane_shapes(frame_width, frame_height, color_space)
+
+
+def write_plane(plane, m_param, output_bit_stream, plane_name='y', near=0, reference=None):
+	"""
+		Predicts the whole plane at once (MED) and writes the Golomb codes of all residuals in one go. In
+	adaptive mode the plane goes through LOCO-I context modeling instead.
+	:param plane: 2D uint8 array
+	:param m_param: Golomb parameter, or ADAPTIVE_M_PARAM
+	:param output_bit_stream:
+	:param plane_name: plane the metrics are reported for (see instrumentation)
+	:param near: maximum absolute error of near-lossless coding (adaptive mode only), 0 for lossless
+	:param reference: same plane of the previous decoded frame to predict from (adaptive mode only), or None
+	:return: the plane as the decoder will rebuild it
+	"""
+	if plane.size == 0:
+		# Chroma of monochrome files
+		return plane
+
+	recorder = instrumentation.recorder()
+	plane_start = output_bit_stream.tell_bits()
+	residuals = None
+
+	if m_param == ADAPTIVE_M_PARAM:
+		coded_errors = [] if recorder.histograms else None
+
+		# Prediction is part of context modeling
+		with recorder.timer('entropy', plane_name):
+			plane = loco_i.encode_plane(plane, output_bit_stream, near, reference, coded_errors)
+
+		if coded_errors is not None:
+			residuals = np.array(coded_errors, dtype=np.int16)
+
+	else:
+		with recorder.timer('predict', plane_name):
+			residuals = prediction.residuals(plane)
+
+		# The bitstream stores residuals modulo 256 (sign bit always 0), which is what the uint8 arithmetic of the
+		# per-pixel predictor produced. The decoder adds them back with the same wraparound.
+		with recorder.timer('entropy', plane_name):
+			encoded_plane, num_of_bits = golomb.pack_array(np.mod(residuals, 256), m_param)
+
+		with recorder.timer('write', plane_name):
+			output_bit_stream.write_packed_bits(encoded_plane, num_of_bits)
+
+	recorder.count_plane(plane_name, plane, output_bit_stream.tell_bits() - plane_start, residuals)
+
+	return plane
+
+
+def read_plane(row_count, col_count, m_param, input_bit_stream, plane_name='y', near=0, reference=None):
 	"""
-		Returns the pixel value at coordinates X, Y from the specified plane
-	Arguments:
-		plane {nparray} -- [description]
-		x {integer} -- [description]
-		y {integer} -- [description]
-	
-	Returns:
-		integer-- pixel value on plane
+		Decodes the next plane of the input stream. Fixed-m planes are rebuilt from their residuals one
+	anti-diagonal per step.
+	:param row_count:
+	:param col_count:
+	:param m_param: Golomb parameter, or ADAPTIVE_M_PARAM
+	:param input_bit_stream:
+	:param plane_name: plane the metrics are reported for (see instrumentation)
+	:param near: see write_plane()
+	:param reference: see write_plane()
+	:return: 2D uint8 array
 	"""
-	if x < 0 or y < 0 or x > plane.shape[0] or y > plane.shape[1] - 1:
-		return 0
+	if row_count * col_count == 0:
+		return np.empty((row_count, col_count), dtype=np.uint8)
+
+	recorder = instrumentation.recorder()
+	plane_start = input_bit_stream.tell_bits()
+	residuals_plane = None
+
+	if m_param == ADAPTIVE_M_PARAM:
+		coded_errors = [] if recorder.histograms else None
+
+		with recorder.timer('entropy', plane_name):
+			plane = loco_i.decode_plane(row_count, col_count, input_bit_stream, near, reference, coded_errors)
+
+		if input_bit_stream.read_past_end():
+			raise EOFError(f'Encoded data ends inside a {plane_name} plane')
+
+		if coded_errors is not None:
+			residuals_plane = np.array(coded_errors, dtype=np.int16)
+
+	else:
+		with recorder.timer('entropy', plane_name):
+			plane_residuals = golomb.decode_array(m_param, row_count * col_count, input_bit_stream)
 
-	return plane[x, y]
+			if len(plane_residuals) < row_count * col_count or input_bit_stream.read_past_end():
+				raise EOFError(f'Encoded data ends inside a {plane_name} plane')
+
+			residuals_plane = np.asarray(plane_residuals, dtype=np.int16)
+			residuals_plane.shape = (row_count, col_count)
+
+		with recorder.timer('predict', plane_name):
+			plane = prediction.reconstruct_plane(residuals_plane)
+
+	recorder.count_plane(plane_name, plane, input_bit_stream.tell_bits() - plane_start, residuals_plane)
+
+	return plane
+
+
+def frame_segments(frame_plane_shapes, stripe_rows):
+	"""
+		Splits the planes of a frame into the segments of a FLAG_SEGMENTS file. Chroma stripes cover the same part
+	of the picture as the luma ones.
+	:param frame_plane_shapes: list of (rows, cols), see plane_shapes()
+	:param stripe_rows: height of the luma stripes, 0 for one segment per plane
+	:return: list of (plane number, first row, stop row) tuples, in bitstream order
+	"""
+	luma_rows = frame_plane_shapes[0][0]
+	segments = []
+
+	for plane_number, (rows, _) in enumerate(frame_plane_shapes):
+		stripe_height = max(1, rows) if stripe_rows <= 0 else max(1, math.ceil(stripe_rows * rows / luma_rows))
+
+		for first_row in range(0, rows, stripe_height):
+			segments.append((plane_number, first_row, min(rows, first_row + stripe_height)))
+
+	return segments
+
+
+def join_segments(encoded_segments):
+	"""
+		Builds a FLAG_SEGMENTS frame payload: the size of every segment (4 bytes each) followed by the segments
+	:param encoded_segments: list of (payload, num_of_bits), see encode_frame_payload()
+	:return: (payload, num_of_bits) tuple
+	"""
+	segment_sizes = b''.join(len(segment).to_bytes(4, byteorder='big') for segment, _ in encoded_segments)
+	payload = segment_sizes + b''.join(segment for segment, _ in encoded_segments)
+
+	last_segment, last_segment_bits = encoded_segments[-1]
+
+	return payload, ((len(payload) - len(last_segment)) << 3) + last_segment_bits
+
+
+def split_segments(payload, segment_count):
+	"""
+		Inverse of join_segments()
+	:param payload: bytes
+	:param segment_count:
+	:return: list of segment payloads
+	"""
+	position = 4 * segment_count
+	segments = []
+
+	for i in range(segment_count):
+		segment_size = int.from_bytes(payload[4 * i:4 * i + 4], byteorder='big')
+		segments.append(payload[position:position + segment_size])
+		position += segment_size
+
+	return segments
+
+
+def encode_frame_payload(planes, m_param, segments=None, plane_names=PLANE_NAMES, near=0, references=None,
+						 decoded_planes=None):
+	"""
+		Encodes the planes of one frame on their own, starting from a byte boundary
+	:param planes: Y, U and V planes
+	:param m_param:
+	:param segments: segments of a FLAG_SEGMENTS frame (see frame_segments()), None to code the planes back to back
+	:param plane_names: names of the planes, for the instrumentation
+	:param near: see write_plane()
+	:param references: planes of the previous decoded frame to predict from (FLAG_TEMPORAL), None for an intra frame
+	:param decoded_planes: list the planes are appended to as the decoder will rebuild them, if given
+	:return: (payload, num_of_bits) tuple. The payload bytes are zero-padded to a whole byte, num_of_bits excludes
+	the padding.
+	"""
+	if segments is not None:
+		encoded_segments = []
+		segment_planes = None if decoded_planes is None else [np.empty_like(plane) for plane in planes]
+
+		for plane_number, first_row, stop_row in segments:
+			decoded_segment = []
+			encoded_segments.append(encode_frame_payload(
+				[planes[plane_number][first_row:stop_row]], m_param, plane_names=[plane_names[plane_number]], near=near,
+				references=None if references is None else [references[plane_number][first_row:stop_row]],
+				decoded_planes=decoded_segment))
+
+			if segment_planes is not None:
+				segment_planes[plane_number][first_row:stop_row] = decoded_segment[0]
+
+		if segment_planes is not None:
+			decoded_planes.extend(segment_planes)
+
+		return join_segments(encoded_segments)
+
+	payload = io.BytesIO()
+	payload_stream = BitStream(payload, OpenMode.WRITE)
+
+	for plane_number, (plane, plane_name) in enumerate(zip(planes, plane_names)):
+		decoded_plane = write_plane(plane, m_param, payload_stream, plane_name, near,
+									None if references is None else references[plane_number])
+
+		if decoded_planes is not None:
+			decoded_planes.append(decoded_plane)
+
+	num_of_bits = payload_stream.tell_bits()
+	payload_stream.close()
+
+	return payload.getvalue(), num_of_bits
+
+
+def decode_frame_payload(payload, frame_plane_shapes, m_param, segments=None, plane_names=PLANE_NAMES, near=0,
+						 references=None):
+	"""
+		Inverse of encode_frame_payload()
+	:param payload: bytes
+	:param frame_plane_shapes: list of (rows, cols), see plane_shapes()
+	:param m_param:
+	:param segments: same as for encode_frame_payload()
+	:param plane_names: same as for encode_frame_payload()
+	:param near: same as for encode_frame_payload()
+	:param references: same as for encode_frame_payload()
+	:return: list of 2D uint8 arrays
+	"""
+	if segments is not None:
+		decoded_planes = [np.empty(shape, dtype=np.uint8) for shape in frame_plane_shapes]
+
+		for segment, segment_payload in zip(segments, split_segments(payload, len(segments))):
+			decode_segment(segment_payload, decoded_planes, segment, m_param, near, references)
+
+		return decoded_planes
+
+	payload_stream = BitStream(io.BytesIO(payload), OpenMode.READ)
+
+	return [read_plane(rows, cols, m_param, payload_stream, plane_name, near,
+					   None if references is None else references[plane_number])
+			for plane_number, ((rows, cols), plane_name) in enumerate(zip(frame_plane_shapes, plane_names))]
+
+
+def decode_segment(segment_payload, planes, segment, m_param, near=0, references=None):
+	"""
+		Decodes one segment of a FLAG_SEGMENTS frame into its rows of the planes
+	:param segment_payload: bytes
+	:param planes: Y, U and V planes (2D uint8 arrays) to write to
+	:param segment: (plane number, first row, stop row)
+	:param m_param:
+	:param near:
+	:param references: planes of the previous decoded frame (FLAG_TEMPORAL), None for an intra frame
+	:return:
+	"""
+	plane_number, first_row, stop_row = segment
+	plane = planes[plane_number]
+
+	plane[first_row:stop_row] = decode_frame_payload(
+		segment_payload, [(stop_row - first_row, plane.shape[1])], m_param, plane_names=[PLANE_NAMES[plane_number]],
+		near=near, references=None if references is None else [references[plane_number][first_row:stop_row]])[0]
+
+
+def frame_references(frame_number, intra_period, previous_planes):
+	"""
+		Planes a frame is predicted from (see FLAG_TEMPORAL)
+	:param frame_number: 0-based
+	:param intra_period: 1 for files without temporal prediction
+	:param previous_planes: decoded planes of the frame before, None for the first one
+	:return: previous_planes, or None for intra frames
+	"""
+	if frame_number % intra_period == 0:
+		return None
+
+	return previous_planes
+
+
+def encode_shared_frame(block_name, frame_plane_shapes, m_param, near=0):
+	"""
+		Worker process entry point: encodes the frame the parent left in a shared memory block
+	:return: see encode_frame_payload()
+	"""
+	return encode_frame_payload(shared_frames.attach_planes(block_name, frame_plane_shapes), m_param, near=near)
+
+
+def decode_shared_frame(payload, block_name, frame_plane_shapes, m_param, near=0):
+	"""
+		Worker process entry point: decodes a frame payload into a shared memory block
+	:return:
+	"""
+	decoded_planes = decode_frame_payload(payload, frame_plane_shapes, m_param, near=near)
+
+	for shared_plane, decoded_plane in zip(shared_frames.attach_planes(block_name, frame_plane_shapes), decoded_planes):
+		shared_plane[...] = decoded_plane
+
+
+def encode_shared_segment(block_name, frame_plane_shapes, segment, m_param, near=0):
+	"""
+		Worker process entry point: encodes one segment of the frame the parent left in a shared memory block
+	:return: see encode_frame_payload()
+	"""
+	plane_number, first_row, stop_row = segment
+	plane = shared_frames.attach_planes(block_name, frame_plane_shapes)[plane_number]
+
+	return encode_frame_payload([plane[first_row:stop_row]], m_param, near=near)
+
+
+def decode_shared_segment(segment_payload, block_name, frame_plane_shapes, segment, m_param, near=0):
+	"""
+		Worker process entry point: decodes one segment into its rows of a shared memory block
+	:return:
+	"""
+	decode_segment(segment_payload, shared_frames.attach_planes(block_name, frame_plane_shapes), segment, m_param,
+				   near)
 
 
 class JpegLs(object):
 	__output_file = None
 	__m_param = 128
-	__pixels_out = open('out_pixels.txt', 'w')
+	__input_file_stream = None
 
+	# (byte offset, number of bits) of every frame, when the encoded file has a frame index
+	__frame_index = None
 
-	def __init__(self, input_file_path):
+
+	def __init__(self, input_file_path, adaptive=False, workers=1, frame_index=False, segments=False, stripe_rows=0,
+				 output_file_path=None, near=0, intra_period=1):
 		"""
 			Initializes a JPEG-LS encoder object
+		:param input_file_path: file path ('-' reads the standard input) or open binary file object
+		:param adaptive: encode with LOCO-I context modeling (per-context Golomb parameter) instead of a fixed m
+		:param workers: number of processes coding frames in parallel (0 = one per CPU). With more than one, the
+		encoder writes every frame as a separate byte-aligned payload (FLAG_FRAMED).
+		:param frame_index: encode with a frame offset table (FLAG_FRAME_INDEX), see decode_frame()
+		:param segments: encode every plane as an independent segment (FLAG_SEGMENTS). The workers then code the
+		segments of a frame concurrently instead of whole frames.
+		:param stripe_rows: also split the planes into independent stripes of this many luma rows. Implies segments.
+		:param output_file_path: file path ('-' writes to the standard output) or open binary file object. Defaults
+		to the input file path with an _enc or _dec suffix (the standard output when reading the standard input).
+		:param near: encode near-lossless (FLAG_NEAR_LOSSLESS): decoded samples may differ from the original ones by
+		up to this much (0 to loco_i.MAX_NEAR). Implies adaptive.
+		:param intra_period: encode with temporal prediction (FLAG_TEMPORAL) when above 1: frames are predicted from
+		the previous one, except for an intra frame every intra_period frames. Frames are then coded in a single
+		process. Implies adaptive.
 		"""
 		self.__input_file_path = input_file_path
-		self.__output_file_path = input_file_path + "_" + args.action
 
-		log_fmt_string = '[%(asctime)s]{}[%(levelname)s]{} (%(module)s): %(message)s'.format(
-			Fore.BLUE,
-			Fore.RESET
-		)
+		if not 0 <= near <= loco_i.MAX_NEAR:
+			raise ValueError(f'near must be between 0 and {loco_i.MAX_NEAR}, got {near}')
+
+		if intra_period < 1:
+			raise ValueError(f'intra_period must be at least 1, got {intra_period}')
+
+		self.__near = near
+		self.__intra_period = intra_period
+
+		if adaptive or near > 0 or intra_period > 1:
+			self.__m_param = ADAPTIVE_M_PARAM
+
+		self.__workers = workers if workers > 0 else os.cpu_count()
+		self.__with_frame_index = frame_index
+		self.__with_segments = segments or stripe_rows > 0
+		self.__stripe_rows = max(0, stripe_rows)
+
+		self.__output_file_path = output_file_path
 
-		logging.basicConfig(format=log_fmt_string, datefmt='%H:%M:%S', level=logging.DEBUG)
 		self.__logger = logging.getLogger(__name__)
-		self.__logger.setLevel(logging.DEBUG)
 		self.__logger.debug('Initialized JPEG-LS codec with {}'.format(self.__input_file_path))
-		np.seterr(over='ignore')
 		return
 
 	def encode_file(self):
 		"""
-
-		:return:
+			Encodes the input Y4M file
+		:return: size of the encoded file in bytes
 		"""
 		# Open yuv file
-		self.__yuv_file = YuvDecoder(self.__input_file_path)
+		self.__yuv_file = YuvDecoder(standard_stream(self.__input_file_path, OpenMode.READ))
+		self.__output_file_stream = None
 
-		# Open output file-object
-		self.__output_file_stream = BitStream(self.__output_file_path, OpenMode.WRITE)
+		try:
+			# Open output file-object
+			self.__output_file_stream = BitStream(standard_stream(self.__output_path('enc'), OpenMode.WRITE), OpenMode.WRITE)
 
-		# We want padding with zeros because of Golomb
-		self.__output_file_stream.set_padding_mode(True)
+			# We want padding with zeros because of Golomb
+			self.__output_file_stream.set_padding_mode(True)
 
-		print('Encoded file:', self.__output_file_path)
+			self.__logger.info(f'Encoded file: {self.__output_path("enc")}')
 
-		# Write some header information
-		self.__output_file_stream.write_int(self.__yuv_file.frame_width, 4)
-		self.__output_file_stream.write_int(self.__yuv_file.frame_height, 4)
-		type_dict = {'4:4:4': 0, '4:2:2': 1, '4:2:0': 2}
-		self.__output_file_stream.write_int(type_dict[self.__yuv_file.color_space], 4)
-		self.__output_file_stream.write_int(self.__yuv_file.number_of_frames, 4)
-		self.__output_file_stream.write_int(len(self.__yuv_file.raw_header), 4)
-		self.__output_file_stream.write_int(self.__m_param, 4)
+			# Write some header information
+			self.__output_file_stream.write_int(self.__yuv_file.frame_width, 4)
+			self.__output_file_stream.write_int(self.__yuv_file.frame_height, 4)
+			color_space_int = COLOR_SPACES[self.__yuv_file.color_space]
+			layout_flags = FLAG_FRAMED if self.__workers > 1 else 0
+			if self.__with_frame_index:
+				layout_flags |= FLAG_FRAME_INDEX
 
-		# Start of actual content. Write unmodified original header to encoded file.
-		self.__output_file_stream.write_bytes(self.__yuv_file.raw_header)
+			if self.__with_segments:
+				layout_flags |= FLAG_SEGMENTS | FLAG_FRAMED
 
-		counter = 1
-		set_ref_time()
+			if self.__near > 0:
+				layout_flags |= FLAG_NEAR_LOSSLESS
 
-		while True:
-			self.__logger.info(f'Processing frame: #{counter} of {self.__yuv_file.number_of_frames}')
-			
-			y, u, v, ret = self.__yuv_file.read_frame()
-			if not ret:
-				break
+			if self.__intra_period > 1:
+				layout_flags |= FLAG_TEMPORAL
+
+			# Streams are encoded as they come in. Framed, so the decoder can tell where the last frame ends.
+			frame_count = self.__yuv_file.number_of_frames
+			if frame_count is None:
+				frame_count = UNKNOWN_FRAME_COUNT
+				layout_flags |= FLAG_FRAMED
+
+			self.__frame_index = []
+			self.__output_file_stream.write_int(color_space_int | layout_flags, 4)
+			self.__output_file_stream.write_int(frame_count, 4)
+			self.__output_file_stream.write_int(len(self.__yuv_file.raw_header), 4)
+			self.__output_file_stream.write_int(self.__m_param, 4)
+
+			if layout_flags & FLAG_SEGMENTS:
+				self.__output_file_stream.write_int(self.__stripe_rows, 4)
+
+			if layout_flags & FLAG_NEAR_LOSSLESS:
+				self.__output_file_stream.write_int(self.__near, 4)
+
+			if layout_flags & FLAG_TEMPORAL:
+				self.__output_file_stream.write_int(self.__intra_period, 4)
+
+			# Start of actual content. Write unmodified original header to encoded file.
+			self.__output_file_stream.write_bytes(self.__yuv_file.raw_header)
+
+			counter = 1
+
+			frame_plane_shapes = plane_shapes(self.__yuv_file.frame_width, self.__yuv_file.frame_height, color_space_int)
+			segments = frame_segments(frame_plane_shapes, self.__stripe_rows) if layout_flags & FLAG_SEGMENTS else None
+
+			if self.__workers > 1 and layout_flags & FLAG_TEMPORAL:
+				self.__logger.info('Temporal prediction codes every frame after the one before it. Encoding in a single process.')
+
+			# Decoded planes of the previous frame, kept as the reference of the next one with FLAG_TEMPORAL
+			previous_planes = None
+
+			if layout_flags & FLAG_FRAMED and self.__workers > 1 and not layout_flags & FLAG_TEMPORAL:
+				self.__encode_frames_in_parallel(frame_plane_shapes, segments)
+
+			elif layout_flags & FLAG_FRAMED:
+				# Frames are read ahead in the background while the current one is encoded
+				with self.__yuv_file.prefetch_frames() as frames:
+					for y, u, v in self.__timed_reads(frames):
+						self.__logger.info(f'Processing frame: #{counter} of {self.__yuv_file.number_of_frames}')
+
+						decoded_planes = []
+						self.__write_frame_payload(*encode_frame_payload(
+							[y, u, v], self.__m_param, segments, near=self.__near,
+							references=frame_references(counter - 1, self.__intra_period, previous_planes),
+							decoded_planes=decoded_planes))
+
+						if layout_flags & FLAG_TEMPORAL:
+							# The read buffers get reused
+							previous_planes = [plane.copy() for plane in decoded_planes]
+
+						counter += 1
+
+			else:
+				with self.__yuv_file.prefetch_frames() as frames:
+					for y, u, v in self.__timed_reads(frames):
+						self.__logger.info(f'Processing frame: #{counter} of {self.__yuv_file.number_of_frames}')
 
-			get_delta()
-			self.encode_frame(y, u, v)
-			counter += 1
+						frame_start = self.__output_file_stream.tell_bits()
+						decoded_planes = self.encode_frame(y, u, v, frame_references(counter - 1, self.__intra_period, previous_planes))
 
-		original_file_size = os.stat(self.__input_file_path).st_size
-		encoded_file_size = os.stat(self.__output_file_path).st_size
+						if layout_flags & FLAG_TEMPORAL:
+							previous_planes = [plane.copy() for plane in decoded_planes]
 
-		print('Compression ratio: ', round(
+						if layout_flags & FLAG_FRAME_INDEX:
+							self.__frame_index.append((frame_start >> 3, self.__output_file_stream.tell_bits() - frame_start))
+							self.__output_file_stream.align_to_byte()
 
-			encoded_file_size / original_file_size * 100.0, 2))
+						instrumentation.recorder().end_frame(counter - 1)
+						counter += 1
 
-		# DO NOT FORGET TO CLOSE. Otherwise the last byte might not get written.
-		self.__output_file_stream.close()
+			if layout_flags & FLAG_FRAME_INDEX:
+				self.__write_frame_index()
 
-	def encode_frame(self, y_plane, u_plane, v_plane):
+			# DO NOT FORGET TO CLOSE. Otherwise the last byte might not get written.
+			self.__output_file_stream.flush()
+			encoded_file_size = self.__output_file_stream.tell_bits() >> 3
+
+		finally:
+			# Also on errors, so the reader thread, the input file and the output are not left behind
+			if self.__output_file_stream is not None:
+				self.__output_file_stream.close()
+
+			self.__yuv_file.close()
+
+		return encoded_file_size
+
+	def encode_frame(self, y_plane, u_plane, v_plane, references=None):
 		"""
 
 		:param y_plane:
 		:param u_plane:
 		:param v_plane:
+		:param references: planes of the previous decoded frame to predict from, see encode_frame_payload()
+		:return: the planes as the decoder will rebuild them
+		"""
+		if references is None:
+			references = [None] * 3
+
+		return [self.encode_plane(y_plane, 'y', references[0]),
+				self.encode_plane(u_plane, 'u', references[1]),
+				self.encode_plane(v_plane, 'v', references[2])]
+
+	def encode_plane(self, plane, plane_name='y', reference=None):
+		"""
+			Writes the plane to the output stream, right after the previous one (see write_plane())
+		:param plane:
+		:param plane_name: see write_plane()
+		:param reference: see write_plane()
+		:return: see write_plane()
+		"""
+		return write_plane(plane, self.__m_param, self.__output_file_stream, plane_name, self.__near, reference)
+
+	def __timed_reads(self, items):
+		"""
+			Yields the items (frames, payloads) of an iterator, reporting the time spent waiting for each of them
+		as the read stage (see instrumentation)
+		:param items: iterable
 		:return:
 		"""
-		avg_y = np.average(y_plane)
-		avg_u = np.average(u_plane)
-		avg_v = np.average(v_plane)
-		# self.__logger.debug('Rel time: ' + str(get_delta()))
-		get_delta()
+		recorder = instrumentation.recorder()
+		items = iter(items)
 
-		# start = time.time()
-		# self.__logger.debug(f'Avg Y: {avg_y} || U: {avg_u} || V {avg_u}')
-		# self.__m_param = math.floor(math.log(avg_y, 2))
-		# self.__output_file.write_int(self.__m_param)
-		self.encode_plane(y_plane)
-		# self.__logger.debug('Y plane processing time: {}'.format(round(time.time() - start, 2)))
-		# self.__m_param = math.floor(math.log(avg_u, 2))
-		# self.__output_file.write_int(self.__m_param)
-		self.encode_plane(u_plane)
+		while True:
+			with recorder.timer('read'):
+				item = next(items, None)
 
-		# self.__m_param = math.floor(math.log(avg_v, 2))
-		# self.__output_file.write_int(self.__m_param)
-		self.encode_plane(v_plane)
+			if item is None:
+				return
 
-	def encode_plane(self, plane):
+			yield item
+
+	def __encode_frames_in_parallel(self, frame_plane_shapes, segments=None):
 		"""
+			Fans the frames (or their segments, with FLAG_SEGMENTS) out to a pool of worker processes and writes
+		their payloads in frame order. Frames reach the workers through shared memory blocks; only the encoded
+		payloads are sent back. At most two frames per worker are in flight.
+		:param frame_plane_shapes:
+		:param segments: see frame_segments()
+		:return:
+		"""
+		frame_pool = shared_frames.SharedFramePool(2 * self.__workers, shared_frames.planes_size(frame_plane_shapes))
+		pending_frames = collections.deque()
+		counter = 1
 
-		:param plane:
+		try:
+			with ProcessPoolExecutor(max_workers=self.__workers) as executor:
+				while True:
+					if not frame_pool.has_free_slot():
+						self.__write_encoded_frame(frame_pool, *pending_frames.popleft())
+
+					with instrumentation.recorder().timer('read'):
+						y, u, v, ret = self.__yuv_file.read_frame()
+
+					if not ret:
+						break
+
+					self.__logger.info(f'Processing frame: #{counter} of {self.__yuv_file.number_of_frames}')
+
+					slot = frame_pool.acquire()
+					frame_pool.write_planes(slot, [y, u, v])
+
+					if segments is None:
+						encoded_parts = [executor.submit(
+							encode_shared_frame, frame_pool.name(slot), frame_plane_shapes, self.__m_param, self.__near)]
+
+					else:
+						encoded_parts = [executor.submit(
+							encode_shared_segment, frame_pool.name(slot), frame_plane_shapes, segment, self.__m_param,
+							self.__near)
+							for segment in segments]
+
+					pending_frames.append((slot, encoded_parts))
+					counter += 1
+
+				while pending_frames:
+					self.__write_encoded_frame(frame_pool, *pending_frames.popleft())
+
+		finally:
+			frame_pool.close()
+
+	def __write_encoded_frame(self, frame_pool, slot, encoded_parts):
+		"""
+			Waits for the workers coding a frame and writes its payload
+		:param frame_pool:
+		:param slot: slot of frame_pool holding the frame
+		:param encoded_parts: futures of the whole frame or of each of its segments
 		:return:
 		"""
-		row_times = []
-		# A - left pixel, B - top pixel, C - top left pixel, D - top right
-		for row in range(0, plane.shape[0]):
-			for col in range(0, plane.shape[1]):
-				x = get_pixel_value(plane, row, col)
-				A = get_pixel_value(plane, row, col - 1)
-				B = get_pixel_value(plane, row - 1, col)
-				C = get_pixel_value(plane, row - 1, col - 1)
-				D = get_pixel_value(plane, row - 1, col + 1)
-
-				pred_x = -1
-
-				if C >= max(A, B):
-					pred_x = min(A, B)
-
-				elif C <= min(A, B):
-					pred_x = max(A, B)
-
-				else:
-					pred_x = A + B - C
-
-				residual = x - pred_x
-				
-				# self.__residual_txt_file.write(str(residual) + ' ')
-				# self.__output_golomb_obj.encode_value(residual, self.__m_param)
-				encoded_val = golomb.encode(residual, self.__m_param)
-				self.__output_file_stream.write_n_bits(encoded_val)
-
-			# self.__residual_txt_file.write('\n')
-			
-		# self.__logger.debug('Average row processing time:{}'.format(round(sum(row_times) / len(row_times) * 100, 2), " Len:", len(row_times)))
-
-	def decode_file(self):
-		# width = 352
-		# height = 288
-		# color_space = '4:2:0'
-		self.__input_file_stream = BitStream(self.__input_file_path, OpenMode.READ)
-		self.__output_file_stream = BitStream(self.__output_file_path, OpenMode.WRITE)
-
-		# golomb_obj = GolombEncoder(self.__input_file_stream,
-		# 				  self.__output_file_stream)
-
-		self.frame_width = self.__input_file_stream.read_int(4)
-		self.frame_height = self.__input_file_stream.read_int(4)
-		self.color_space_int = self.__input_file_stream.read_int(4)
-		self.frame_count = self.__input_file_stream.read_int(4)
-		
-		# This header is the unprocessed, raw YUV header
-		self.size_of_header = self.__input_file_stream.read_int(4)
-		self.m_param = self.__input_file_stream.read_int(4)
+		encoded_parts = [encoded_part.result() for encoded_part in encoded_parts]
+		frame_pool.release(slot)
 
-		self.header = self.__input_file_stream.read_bytes(self.size_of_header)
+		if self.__with_segments:
+			self.__write_frame_payload(*join_segments(encoded_parts))
 
-		# WRite header to output file
-		self.__output_file_stream.write_bytes(bytes(self.header))
-		# print('HEADER: ', bytes(header).decode('utf-8'))
-		type_dict = {0: '4:4:4', 1: '4:2:2', 2: '4:2:0'}
+		else:
+			self.__write_frame_payload(*encoded_parts[0])
 
-		self.color_space = type_dict[self.color_space_int]
-		self.__logger.info(f'Frame Width:\t{self.frame_width}')
-		self.__logger.info(f'Frame Height:\t{self.frame_height}')
-		self.__logger.info(f'Color Space:\t{self.color_space}')
-		self.__logger.info(f'# of Frames:\t{self.frame_count}')
-		self.__logger.info(f'Decoding. Output file:\t{self.__output_file_path}')
-
-		# Calculate expected number of golomb values
-		expected_values_per_frame = 0
-		uv_planes_rows = self.frame_height
-		uv_planes_cols = self.frame_width 
-
-		if self.color_space_int == 0:
-			expected_values_per_frame = self.frame_width * self.frame_height * 3
-			# Do not change uv_planes_rows and counts since there is no downsampling
-
-		elif self.color_space_int == 1:
-			expected_values_per_frame = self.frame_width * self.frame_height * 2
-			uv_planes_cols = int(uv_planes_cols / 2)
-
-		elif self.color_space_int == 2:
-			expected_values_per_frame = self.frame_width * self.frame_height * 3 / 2
-			uv_planes_cols = int(uv_planes_cols / 2)
-			uv_planes_rows = int(uv_planes_rows / 2)
-
-		self.__logger.debug('Values per frame: {}'.format(expected_values_per_frame))
-		self.__logger.debug(f'UV components size: {uv_planes_rows}x{uv_planes_cols}: {uv_planes_cols * uv_planes_rows} samples')
+	def __write_frame_payload(self, payload, num_of_bits):
+		recorder = instrumentation.recorder()
+
+		with recorder.timer('write'):
+			self.__output_file_stream.write_int(len(payload), 4)
+			self.__frame_index.append((self.__output_file_stream.tell_bits() >> 3, num_of_bits))
+			self.__output_file_stream.write_bytes(payload)
+
+		recorder.end_frame(len(self.__frame_index) - 1)
+
+	def __write_frame_index(self):
+		"""
+			Appends the frame offset table (FLAG_FRAME_INDEX) and its position to the output stream
+		:return:
+		"""
+		index_position = self.__output_file_stream.tell_bits() >> 3
 
+		for frame_position, num_of_bits in self.__frame_index:
+			self.__output_file_stream.write_int(frame_position, 8)
+			self.__output_file_stream.write_int(num_of_bits, 8)
 
-		for i in range(1, self.frame_count+1):
-			self.__logger.info(f'Processing frame number {i} of {self.frame_count} ')
+		self.__output_file_stream.write_int(index_position, 8)
 
-			self.__output_file_stream.write_str('FRAME\n')
+	def decode_file(self, start_frame=None, stop_frame=None):
+		"""
+			Decodes the input file to a Y4M file
+		:param start_frame: first frame to decode (0-based). Defaults to the first one.
+		:param stop_frame: frame to stop at (excluded). Defaults to the end of the file.
+		:return:
+		"""
+		decoded_frames = self.iter_decoded_frames(start_frame, stop_frame)
+		self.__output_file_stream = None
+
+		try:
+			self.__output_file_stream = BitStream(standard_stream(self.__output_path('dec'), OpenMode.WRITE), OpenMode.WRITE)
+
+			# WRite header to output file
+			self.__output_file_stream.write_bytes(self.header)
+			self.__logger.info(f'Frame Width:\t{self.frame_width}')
+			self.__logger.info(f'Frame Height:\t{self.frame_height}')
+			self.__logger.info(f'Color Space:\t{self.color_space}')
+			self.__logger.info(f'# of Frames:\t{self.frame_count}')
+			self.__logger.info(f'Decoding. Output file:\t{self.__output_path("dec")}')
 
-			golomb_values = golomb.decode(self.m_param, self.frame_width * self.frame_height, self.__input_file_stream)
-			# Y plane
-			self.decode_plane(self.frame_height, self.frame_width, golomb_values)
+			recorder = instrumentation.recorder()
 
-			# U plane
-			golomb_values = golomb.decode(self.m_param, uv_planes_cols * uv_planes_rows, self.__input_file_stream)
-			self.decode_plane(uv_planes_rows, uv_planes_cols, golomb_values)
+			for decoded_planes in decoded_frames:
+				self.__output_file_stream.write_str('FRAME\n')
 
-			# V plane
-			golomb_values = golomb.decode(self.m_param, uv_planes_cols * uv_planes_rows, self.__input_file_stream)
-			self.decode_plane(uv_planes_rows, uv_planes_cols, golomb_values)
+				for decoded_plane, plane_name in zip(decoded_planes, PLANE_NAMES):
+					with recorder.timer('write', plane_name):
+						self.__write_decoded_plane(decoded_plane)
+
+			self.__logger.info('Processed all frames.')
+
+		finally:
+			# Also on errors, so the input and the output are not left open until garbage collection. The input
+			# is closed here too in case the generator never started.
+			decoded_frames.close()
+			self.close()
+
+			if self.__output_file_stream is not None:
+				self.__output_file_stream.close()
 
-		self.__logger.info('Processed all frames.')
 		# with open('check_residuals.txt', 'w') as f:
 		# 	for t in golomb_values:
 		# 		f.write(str(t) + ' ')
 
-		self.__pixels_out.close()
+	def __output_path(self, action):
+		"""
+			The output file given to the constructor, or the default one for the action
+		:param action: 'enc' or 'dec'
+		:return:
+		"""
+		if self.__output_file_path is not None:
+			return self.__output_file_path
+
+		if self.__input_file_path == STANDARD_STREAM_PATH:
+			return STANDARD_STREAM_PATH
+
+		if not isinstance(self.__input_file_path, str):
+			raise ValueError('An output file is needed when the input is a file object')
 
-	def decode_plane(self, row_count, col_count, plane_residuals):			
-		residuals_plane = np.asarray(plane_residuals, dtype=np.uint8)
-		residuals_plane.shape = (row_count, col_count)
+		return self.__input_file_path + "_" + action
+
+	def iter_decoded_frames(self, start_frame=None, stop_frame=None):
+		"""
+			Decodes the frames of the input file in memory. The header is read right away (frame_width, color_space,
+		frame_count, ... are set when this returns); the frames are decoded as they are requested. The input file is
+		closed once the generator is exhausted or closed.
+		:param start_frame: first frame to decode (0-based). Defaults to the first one.
+		:param stop_frame: frame to stop at (excluded). Defaults to the end of the file.
+		:return: generator of (y, u, v) tuples of 2D uint8 arrays
+		"""
+		self.__open_encoded_file()
 
-		decoded_frame = np.zeros((row_count, col_count), dtype=np.uint8)
+		if self.frame_count is None and any(bound is not None and bound < 0 for bound in (start_frame, stop_frame)):
+			self.close()
+			raise ValueError('Frames cannot be counted from the end: the length of this file is unknown')
 
+		frames = range(sys.maxsize if self.frame_count is None else self.frame_count)[start_frame:stop_frame]
 
-		for row in range(0, row_count):
-			for col in range(0, col_count):
-				residual = get_pixel_value(residuals_plane, row, col)
-				A = get_pixel_value(decoded_frame, row, col - 1)
-				B = get_pixel_value(decoded_frame, row - 1, col)
-				C = get_pixel_value(decoded_frame, row - 1, col - 1)
-				D = get_pixel_value(decoded_frame, row - 1, col + 1)
+		return self.__decoded_frames(frames)
 
-				pred_x = -1
+	def __decoded_frames(self, frames):
+		"""
+			Generator behind iter_decoded_frames()
+		:param frames: range of frame numbers to decode
+		:return:
+		"""
+		frame_plane_shapes = plane_shapes(self.frame_width, self.frame_height, self.color_space_int)
+		(uv_planes_rows, uv_planes_cols) = frame_plane_shapes[1]
 
-				if C >= max(A, B):
-					pred_x = min(A, B)
+		self.__logger.debug('Values per frame: {}'.format(shared_frames.planes_size(frame_plane_shapes)))
+		self.__logger.debug(f'UV components size: {uv_planes_rows}x{uv_planes_cols}: {uv_planes_cols * uv_planes_rows} samples')
 
-				elif C <= min(A, B):
-					pred_x = max(A, B)
+		recorder = instrumentation.recorder()
+		previous_planes = None
 
-				else:
-					pred_x = A + B - C
+		try:
+			if self.layout_flags & (FLAG_FRAMED | FLAG_FRAME_INDEX) and self.__workers > 1 and \
+					not self.layout_flags & FLAG_TEMPORAL:
+				# Frames come out in order, without gaps
+				for i, decoded_planes in zip(frames, self.__decode_frames_in_parallel(frame_plane_shapes, frames)):
+					yield decoded_planes
+					recorder.end_frame(i)
 
-				pixel_value = residual + pred_x
-				decoded_frame[row, col] = pixel_value
+			elif self.layout_flags & (FLAG_FRAMED | FLAG_FRAME_INDEX):
+				if self.__workers > 1:
+					self.__logger.info('Frames of this file are predicted from each other. Decoding in a single process.')
 
-				self.__output_file_stream.write_int(pixel_value.item(), 1)
-		
+				# With temporal prediction, decoding starts from the last intra frame before the range
+				first_frame = frames.start - frames.start % self.intra_period if frames else frames.start
+
+				for i, payload in self.__timed_reads(self.__frame_payloads(range(first_frame, frames.stop))):
+					self.__logger.info(f'{"Processing" if i in frames else "Skipping"} frame number {i + 1} of {self.frame_count} ')
+
+					previous_planes = tuple(decode_frame_payload(
+						payload, frame_plane_shapes, self.m_param, self.__segments, near=self.near,
+						references=frame_references(i, self.intra_period, previous_planes)))
+
+					if i in frames:
+						yield previous_planes
+
+					recorder.end_frame(i)
+
+			else:
+				if self.__workers > 1:
+					self.__logger.info('Frames of this file were not coded independently. Decoding in a single process.')
+
+				# Frames before the range still have to be decoded to find where the next one starts
+				for i in range(0, frames.stop):
+					self.__logger.info(f'{"Processing" if i in frames else "Skipping"} frame number {i + 1} of {self.frame_count} ')
+
+					previous_planes = tuple(self.__read_frame(i, frame_plane_shapes, previous_planes))
+
+					if i in frames:
+						yield previous_planes
+
+					recorder.end_frame(i)
+
+		finally:
+			self.close()
+
+	def decode_frame(self, index):
+		"""
+			Decodes a single frame of the input file. Files with a frame index (FLAG_FRAME_INDEX) seek straight to
+		it; otherwise the frames before it are skipped (FLAG_FRAMED) or decoded. The input file stays open for the
+		next calls until close().
+		:param index: frame number, 0-based
+		:return: list with the Y, U and V planes (2D uint8 arrays)
+		"""
+		if self.__input_file_stream is None:
+			self.__open_encoded_file()
+
+		if index < 0 or self.frame_count is not None and index >= self.frame_count:
+			raise IndexError(f'Frame {index} out of range: the file has {self.frame_count} frames')
+
+		frame_plane_shapes = plane_shapes(self.frame_width, self.frame_height, self.color_space_int)
+
+		decoded_planes = None
+
+		if self.layout_flags & (FLAG_FRAMED | FLAG_FRAME_INDEX):
+			# With temporal prediction, the frames from the last intra frame on
+			for i, payload in self.__frame_payloads(range(index - index % self.intra_period, index + 1)):
+				decoded_planes = decode_frame_payload(payload, frame_plane_shapes, self.m_param, self.__segments,
+													  near=self.near,
+													  references=frame_references(i, self.intra_period, decoded_planes))
+
+				if i == index:
+					return decoded_planes
+
+			raise EOFError(f'Encoded file ends before frame {index}')
+
+		self.__input_file_stream.seek(self.__first_frame_position)
+
+		for i in range(index + 1):
+			decoded_planes = self.__read_frame(i, frame_plane_shapes, decoded_planes)
+
+		return decoded_planes
+
+	def close(self):
+		"""
+			Closes the input file left open by decode_frame()
+		:return:
+		"""
+		if self.__input_file_stream is not None:
+			self.__input_file_stream.close()
+			self.__input_file_stream = None
+
+	def __open_encoded_file(self):
+		"""
+			Opens the input file and reads its header (and frame index, if any)
+		:return:
+		"""
+		self.close()
+		self.__input_file_stream = BitStream(standard_stream(self.__input_file_path, OpenMode.READ), OpenMode.READ)
+
+		try:
+			self.__read_encoded_header()
+
+		except BaseException:
+			self.close()
+			raise
+
+	def __read_encoded_header(self):
+		"""
+			Reads the header of the input file (and its frame index, if any) and leaves the stream at the first frame
+		:return:
+		"""
+		self.frame_width = self.__read_header_field(4)
+		self.frame_height = self.__read_header_field(4)
+		color_space_field = self.__read_header_field(4)
+		self.color_space_int = color_space_field & COLOR_SPACE_MASK
+		self.layout_flags = color_space_field & ~COLOR_SPACE_MASK
+		self.frame_count = self.__read_header_field(4)
+
+		# Left to None until known (frame index) for files encoded from a stream
+		if self.frame_count == UNKNOWN_FRAME_COUNT:
+			self.frame_count = None
+
+		# This header is the unprocessed, raw YUV header
+		self.size_of_header = self.__read_header_field(4)
+		self.m_param = self.__read_header_field(4)
+
+		self.stripe_rows = self.__read_header_field(4) if self.layout_flags & FLAG_SEGMENTS else 0
+		self.near = self.__read_header_field(4) if self.layout_flags & FLAG_NEAR_LOSSLESS else 0
+		self.intra_period = self.__read_header_field(4) if self.layout_flags & FLAG_TEMPORAL else 1
+
+		self.header = self.__input_file_stream.read_bytes(self.size_of_header)
+
+		if self.header is None:
+			raise EOFError('Encoded file ends inside its header')
+
+		type_dict = {value: name for name, value in COLOR_SPACES.items()}
+		self.color_space = type_dict[self.color_space_int]
+
+		self.__segments = None
+		if self.layout_flags & FLAG_SEGMENTS:
+			self.__segments = frame_segments(plane_shapes(self.frame_width, self.frame_height, self.color_space_int),
+											 self.stripe_rows)
+
+		self.__first_frame_position = self.__input_file_stream.tell_bits() >> 3
+		self.__frame_index = None
+
+		if self.layout_flags & FLAG_FRAME_INDEX:
+			index_end = self.__input_file_stream.seek(-8, os.SEEK_END)
+			index_position = self.__input_file_stream.read_int(8)
+
+			if index_position is None or not self.__first_frame_position <= index_position <= index_end or \
+					(index_end - index_position) % 16:
+				raise ValueError(f'Invalid frame index position: {index_position}')
+
+			self.__input_file_stream.seek(index_position)
+			index_table = self.__input_file_stream.read_bytes(index_end - index_position)
+			self.__frame_index = list(struct.iter_unpack('>QQ', index_table))
+			self.frame_count = len(self.__frame_index)
+
+			for i, (frame_position, num_of_bits) in enumerate(self.__frame_index):
+				# Payloads lie between the header and the index
+				if frame_position < self.__first_frame_position or \
+						frame_position + ((num_of_bits + 7) >> 3) > index_position:
+					raise ValueError(f'Invalid frame index entry for frame {i}: {num_of_bits} bits at {frame_position}')
+
+			self.__input_file_stream.seek(self.__first_frame_position)
+
+	def __read_header_field(self, n_bytes):
+		"""
+			Reads an integer field of the header of the input file
+		:param n_bytes:
+		:return:
+		"""
+		value = self.__input_file_stream.read_int(n_bytes)
+
+		if value is None:
+			raise EOFError('Encoded file ends inside its header')
+
+		return value
+
+	def decode_plane(self, row_count, col_count):
+		"""
+			Decodes the next plane from the input stream (see read_plane()) and writes it to the output file
+		:param row_count:
+		:param col_count:
+		:return:
+		"""
+		self.__write_decoded_plane(read_plane(row_count, col_count, self.m_param, self.__input_file_stream,
+											  near=self.near))
+
+	def __write_decoded_plane(self, decoded_plane):
+		# One write per plane: samples are single bytes, in row order
+		self.__output_file_stream.write_bytes(decoded_plane.tobytes())
+
+	def __frame_payloads(self, frames):
+		"""
+			Yields the payloads of the requested frames of a FLAG_FRAMED or FLAG_FRAME_INDEX file. With an index
+		every frame is read straight from its offset; otherwise the size prefixes are followed from the first frame.
+		:param frames: range of frame numbers (0-based, step 1)
+		:return: (frame number, payload) tuples
+		"""
+		if self.__frame_index is not None:
+			for i in frames:
+				frame_position, num_of_bits = self.__frame_index[i]
+
+				self.__input_file_stream.seek(frame_position)
+				yield i, self.__read_frame_bytes(i, (num_of_bits + 7) >> 3)
+
+			return
+
+		self.__input_file_stream.seek(self.__first_frame_position)
+
+		for i in range(0, frames.stop):
+			if self.frame_count is None and self.__input_file_stream.has_reached_eof():
+				# The number of frames is unknown (UNKNOWN_FRAME_COUNT): the file ends after the last one
+				return
+
+			payload_size = self.__input_file_stream.read_int(4)
+			if payload_size is None:
+				raise EOFError(f'Encoded file ends inside frame {i}')
+
+			if i in frames:
+				yield i, self.__read_frame_bytes(i, payload_size)
+
+			else:
+				frame_end = (self.__input_file_stream.tell_bits() >> 3) + payload_size
+
+				if self.__input_file_stream.seek(frame_end) < frame_end:
+					raise EOFError(f'Encoded file ends inside frame {i}')
+
+	def __read_frame_bytes(self, i, num_of_bytes):
+		"""
+			Reads the payload of frame i from the input stream
+		:param i: frame number, for the error
+		:param num_of_bytes:
+		:return: bytes
+		"""
+		payload = self.__input_file_stream.read_bytes(num_of_bytes)
+
+		if payload is None:
+			raise EOFError(f'Encoded file ends inside frame {i}')
+
+		return payload
+
+	def __read_frame(self, i, frame_plane_shapes, previous_planes):
+		"""
+			Decodes frame i from the input stream of a file whose frames are coded back to back (no FLAG_FRAMED)
+		:param i: frame number (0-based)
+		:param frame_plane_shapes: list of (rows, cols), see plane_shapes()
+		:param previous_planes: planes of frame i - 1, for FLAG_TEMPORAL
+		:return: list with the Y, U and V planes (2D uint8 arrays)
+		"""
+		references = frame_references(i, self.intra_period, previous_planes)
+
+		try:
+			return [read_plane(rows, cols, self.m_param, self.__input_file_stream, plane_name, self.near,
+							   None if references is None else references[plane_number])
+					for plane_number, ((rows, cols), plane_name) in enumerate(zip(frame_plane_shapes, PLANE_NAMES))]
+
+		except EOFError as error:
+			raise EOFError(f'Encoded file ends inside frame {i}') from error
+
+	def __decode_frames_in_parallel(self, frame_plane_shapes, frames):
+		"""
+			Decodes the frame payloads (or their segments, with FLAG_SEGMENTS) in a pool of worker processes. Workers
+		write the decoded planes straight to shared memory blocks, which are copied out in frame order.
+		:param frame_plane_shapes:
+		:param frames: range of frame numbers to decode
+		:return: generator of (y, u, v) tuples
+		"""
+		frame_pool = shared_frames.SharedFramePool(2 * self.__workers, shared_frames.planes_size(frame_plane_shapes))
+		pending_frames = collections.deque()
+
+		try:
+			with ProcessPoolExecutor(max_workers=self.__workers) as executor:
+				for i, payload in self.__timed_reads(self.__frame_payloads(frames)):
+					if not frame_pool.has_free_slot():
+						yield self.__collect_decoded_frame(frame_pool, frame_plane_shapes, *pending_frames.popleft())
+
+					self.__logger.info(f'Processing frame number {i + 1} of {self.frame_count} ')
+
+					slot = frame_pool.acquire()
+
+					if self.__segments is None:
+						decoded_parts = [executor.submit(
+							decode_shared_frame, payload, frame_pool.name(slot), frame_plane_shapes, self.m_param,
+							self.near)]
+
+					else:
+						decoded_parts = [executor.submit(
+							decode_shared_segment, segment_payload, frame_pool.name(slot), frame_plane_shapes, segment,
+							self.m_param, self.near)
+							for segment, segment_payload in zip(self.__segments, split_segments(payload, len(self.__segments)))]
+
+					pending_frames.append((slot, decoded_parts))
+
+				while pending_frames:
+					yield self.__collect_decoded_frame(frame_pool, frame_plane_shapes, *pending_frames.popleft())
+
+		finally:
+			frame_pool.close()
+
+	def __collect_decoded_frame(self, frame_pool, frame_plane_shapes, slot, decoded_parts):
+		"""
+			Waits for the workers decoding a frame and copies it out of its slot
+		:return: (y, u, v) tuple
+		"""
+		for decoded_part in decoded_parts:
+			decoded_part.result()
+
+		decoded_planes = tuple(frame_pool.read_planes(slot, frame_plane_shapes))
+		frame_pool.release(slot)
+
+		return decoded_planes
+
+
+def encode(input_file, output_file, **options):
+	"""
+		Encodes a Y4M file
+	:param input_file: file path ('-' for the standard input) or open binary file object
+	:param output_file: file path ('-' for the standard output) or open binary file object
+	:param options: JpegLs options (adaptive, workers, frame_index, segments, stripe_rows, near, intra_period)
+	:return: size of the encoded file in bytes
+	"""
+	return JpegLs(input_file, output_file_path=output_file, **options).encode_file()
+
+
+def decode(input_file, output_file, start_frame=None, stop_frame=None, workers=1):
+	"""
+		Decodes an encoded file to a Y4M file
+	:param input_file: file path ('-' for the standard input) or open binary file object
+	:param output_file: file path ('-' for the standard output) or open binary file object
+	:param start_frame: first frame to decode (0-based). Defaults to the first one.
+	:param stop_frame: frame to stop at (excluded). Defaults to the end of the file.
+	:param workers: number of decoding processes, see JpegLs
+	:return:
+	"""
+	JpegLs(input_file, workers=workers, output_file_path=output_file).decode_file(start_frame, stop_frame)
+
+
+def encode_bytes(y4m_data, **options):
+	"""
+		encode() in memory. The frame count of the input is not known up front, so the frames are always written as
+	separate payloads (FLAG_FRAMED).
+	:param y4m_data: contents of a Y4M file
+	:param options: see encode()
+	:return: encoded file contents
+	"""
+	output_file = io.BytesIO()
+	encode(io.BytesIO(y4m_data), output_file, **options)
+
+	return output_file.getvalue()
+
+
+def decode_bytes(encoded_data, start_frame=None, stop_frame=None, workers=1):
+	"""
+		decode() in memory
+	:param encoded_data: contents of an encoded file
+	:return: Y4M file contents
+	"""
+	output_file = io.BytesIO()
+	decode(io.BytesIO(encoded_data), output_file, start_frame, stop_frame, workers)
 
-j = JpegLs(args.input_file)
+	return output_file.getvalue()
 
-if args.action == 'enc':
-	j.encode_file()
 
-elif args.action == 'dec':
-	j.decode_file()
+# The command line lives in jpeg_ls_cli.py. Still runnable as a script for existing pipelines; worker processes import
+# this module too, hence the guard.
+if __name__ == '__main__':
+	import jpeg_ls_cli
+	jpeg_ls_cli.main()
@@ -0,0 +1,113 @@
+import argparse
+import logging
+import os
+import re
+
+import instrumentation
+import jpeg_ls
+
+
+def frame_range(text):
+	"""
+		Parses a START:STOP frame range (0-based, STOP excluded, both optional) as used by slices
+	:param text:
+	:return: (start, stop) tuple, None for omitted bounds
+	"""
+	bounds = text.split(':')
+	if len(bounds) != 2:
+		raise argparse.ArgumentTypeError(f'expected START:STOP, got {text!r}')
+
+	try:
+		return tuple(int(bound) if bound.strip() else None for bound in bounds)
+
+	except ValueError:
+		raise argparse.ArgumentTypeError(f'expected START:STOP, got {text!r}')
+
+
+def metrics_label(text):
+	"""
+		Parses a NAME=VALUE metrics label. NAME must be a valid Prometheus label name.
+	:param text:
+	:return: (name, value) tuple
+	"""
+	name, separator, value = text.partition('=')
+	if not separator or not re.fullmatch('[a-zA-Z_][a-zA-Z0-9_]*', name):
+		raise argparse.ArgumentTypeError(f'expected NAME=VALUE, got {text!r}')
+
+	return name, value
+
+
+def main(argv=None):
+	"""
+		Command line entry point
+	:param argv: arguments (defaults to sys.argv[1:])
+	:return:
+	"""
+	parser = argparse.ArgumentParser()
+	parser.add_argument("action", choices=[
+						'enc', 'dec'], help="set the input file")
+	parser.add_argument("input_file", help="set the input file ('-' for the standard input)")
+	parser.add_argument("output_file", nargs='?',
+						help="set the output file ('-' for the standard output). Defaults to INPUT_FILE_enc / INPUT_FILE_dec")
+	parser.add_argument("--adaptive", action="store_true",
+						help="encode with LOCO-I context modeling instead of a fixed Golomb parameter")
+	parser.add_argument("--near", type=int, default=0, metavar='N',
+						help="(enc) near-lossless: decoded samples may be off by up to N (1-2 roughly halves the output). Implies --adaptive")
+	parser.add_argument("--intra-period", type=int, default=1, metavar='N',
+						help="(enc) temporal prediction: predict frames from the previous one, with an intra frame every N frames (1 = off). Implies --adaptive")
+	parser.add_argument("--workers", type=int, default=1,
+						help="number of processes coding frames in parallel (0 = one per CPU)")
+	parser.add_argument("--segments", action="store_true",
+						help="(enc) code the Y, U and V planes of every frame as independent segments, so --workers can split frames")
+	parser.add_argument("--stripe-rows", type=int, default=0,
+						help="(enc) also cut the planes into independent horizontal stripes of this many (luma) rows")
+	parser.add_argument("--index", action="store_true",
+						help="(enc) append a frame offset table, so single frames can be decoded without the ones before them")
+	parser.add_argument("--frames", type=frame_range, default=(None, None), metavar='START:STOP',
+						help="(dec) only decode frames START to STOP - 1 (0-based)")
+	parser.add_argument("--metrics", metavar='FILE',
+						help="write per-frame and per-plane metrics (stage times, bits per sample) as JSON lines")
+	parser.add_argument("--prometheus", metavar='FILE',
+						help="write the metrics totals to a Prometheus text file")
+	parser.add_argument("--no-histograms", action="store_true",
+						help="do not count the residuals of every plane in the metrics")
+	parser.add_argument("--trace-memory", action="store_true",
+						help="add the peak memory use (tracemalloc, slow) to the metrics")
+	parser.add_argument("--metrics-label", type=metrics_label, action="append", default=[], metavar='NAME=VALUE',
+						help="label added to every metric, e.g. --metrics-label content=sports (repeatable)")
+
+	args = parser.parse_args(argv)
+
+	from colorama import Fore
+
+	log_fmt_string = '[%(asctime)s]{}[%(levelname)s]{} (%(module)s): %(message)s'.format(
+		Fore.BLUE,
+		Fore.RESET
+	)
+
+	logging.basicConfig(format=log_fmt_string, datefmt='%H:%M:%S', level=logging.DEBUG)
+
+	if args.metrics or args.prometheus:
+		instrumentation.enable(
+			json_lines_path=args.metrics, prometheus_path=args.prometheus, histograms=not args.no_histograms,
+			memory=args.trace_memory, labels=dict([('action', args.action)] + args.metrics_label))
+
+	j = jpeg_ls.JpegLs(args.input_file, adaptive=args.adaptive, workers=args.workers, frame_index=args.index,
+			   segments=args.segments, stripe_rows=args.stripe_rows, output_file_path=args.output_file, near=args.near,
+			   intra_period=args.intra_period)
+
+	if args.action == 'enc':
+		encoded_file_size = j.encode_file()
+
+		# Only for files: the standard output carries the encoded file
+		if jpeg_ls.STANDARD_STREAM_PATH not in (args.input_file, args.output_file):
+			print('Compression ratio: ', round(encoded_file_size / os.stat(args.input_file).st_size * 100.0, 2))
+
+	elif args.action == 'dec':
+		j.decode_file(*args.frames)
+
+	instrumentation.disable()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,754 @@
+import bisect
+
+import numpy as np
+
+import prediction
+
+# JPEG-LS (ITU-T T.87) coding parameters for 8 bit samples, lossless. Near-lossless coding (NEAR > 0) shrinks
+# RANGE and QBPP, see coding_range().
+MAXVAL = 255
+RANGE = 256
+QBPP = 8
+LIMIT = 32
+RESET = 64
+
+# Largest NEAR (maximum absolute error of near-lossless coding) allowed by the standard for 8 bit samples
+MAX_NEAR = MAXVAL // 2
+
+# Gradient quantization thresholds, lossless. They grow with NEAR, see gradient_thresholds().
+T1 = 3
+T2 = 7
+T3 = 21
+
+# Bias correction limits
+MIN_C = -128
+MAX_C = 127
+
+# 9 quantized values per gradient, merged with their negatives: (9 ** 3 - 1) / 2 + 1
+NUM_OF_CONTEXTS = 365
+A_INIT = max(2, (RANGE + 32) >> 6)
+
+# Contexts of the run interruption samples, after the regular ones: Ra != Rb (type 0) and Ra == Rb (type 1)
+RUN_INTERRUPTION_CONTEXT = NUM_OF_CONTEXTS
+
+# Run length order of every run index: a '1' in run mode stands for 2 ** J[run_index] samples of the run
+J = [0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 9, 10, 11, 12, 13, 14, 15]
+
+
+def coding_range(near):
+    """
+        Number of quantized prediction errors (RANGE) and bits needed to write one of them (QBPP)
+    :param near: maximum absolute error, 0 for lossless coding
+    :return: (RANGE, QBPP) tuple
+    """
+    coded_range = (MAXVAL + 2 * near) // (2 * near + 1) + 1
+
+    return coded_range, (coded_range - 1).bit_length()
+
+
+def gradient_thresholds(near):
+    """
+        Default T1, T2 and T3 of the standard for 8 bit samples
+    :param near:
+    :return: (T1, T2, T3) tuple
+    """
+    t1 = min(max(T1 + 3 * near, near + 1), MAXVAL)
+    t2 = min(max(T2 + 5 * near, t1), MAXVAL)
+    t3 = min(max(T3 + 7 * near, t2), MAXVAL)
+
+    return t1, t2, t3
+
+
+def quantize_gradient(d, near=0):
+    """
+        Quantizes a local gradient into one of 9 regions (-4 to 4). Gradients within +-near are flat (0).
+    :param d:
+    :param near:
+    :return:
+    """
+    t1, t2, t3 = gradient_thresholds(near)
+
+    if d <= -t3:
+        return -4
+    if d <= -t2:
+        return -3
+    if d <= -t1:
+        return -2
+    if d < -near:
+        return -1
+    if d <= near:
+        return 0
+    if d < t1:
+        return 1
+    if d < t2:
+        return 2
+    if d < t3:
+        return 3
+
+    return 4
+
+
+def __gradient_table(weight, near=0):
+    """
+        weight * quantize_gradient(d) for every d in [-510, 510], the gradients of differences between samples and
+    their reference (see encode_plane()). Laid out so that it can be indexed with d directly: non-negative d from the
+    start, negative d from the end of the list.
+    :param weight:
+    :param near:
+    :return:
+    """
+    return [weight * quantize_gradient(d, near) for d in range(0, 2 * MAXVAL + 1)] + \
+           [weight * quantize_gradient(d, near) for d in range(-2 * MAXVAL, 0)]
+
+
+# Context of a pixel: 81 * Q1 + 9 * Q2 + Q3, where Q1..Q3 are the quantized D - B, B - C and C - A gradients. Its
+# sign is the sign of the first non-zero Qi, so contexts with opposite signs are merged by taking the absolute value.
+Q1_TABLE = __gradient_table(81)
+Q2_TABLE = __gradient_table(9)
+Q3_TABLE = __gradient_table(1)
+
+# Q1, Q2 and Q3 tables of every NEAR used so far
+__near_gradient_tables = {0: (Q1_TABLE, Q2_TABLE, Q3_TABLE)}
+
+
+def gradient_tables(near):
+    """
+        Q1_TABLE, Q2_TABLE and Q3_TABLE for the given NEAR
+    :param near:
+    :return: tuple of three lists
+    """
+    if near not in __near_gradient_tables:
+        __near_gradient_tables[near] = (__gradient_table(81, near), __gradient_table(9, near), __gradient_table(1, near))
+
+    return __near_gradient_tables[near]
+
+
+class ContextModel(object):
+    """
+        Per-context statistics: A (accumulated error magnitudes), B (accumulated errors), C (bias correction) and N
+    (occurrences) for the regular contexts, followed by the two run interruption contexts, which use A, N and Nn
+    (occurrences of negative errors) instead
+    """
+
+    def __init__(self, near=0):
+        """
+        :param near: maximum absolute error, 0 for lossless coding
+        """
+        a_init = max(2, (coding_range(near)[0] + 32) >> 6)
+
+        self.a = [a_init] * (NUM_OF_CONTEXTS + 2)
+        self.b = [0] * (NUM_OF_CONTEXTS + 2)
+        self.c = [0] * (NUM_OF_CONTEXTS + 2)
+        self.n = [1] * (NUM_OF_CONTEXTS + 2)
+        self.nn = [0] * (NUM_OF_CONTEXTS + 2)
+
+        # B accumulates the errors at the sample scale: quantized errors stand for 2 * NEAR + 1 sample values
+        self.__error_step = 2 * near + 1
+
+    def update(self, q, error):
+        """
+            Updates the statistics of context q with a (quantized and modulo reduced) prediction error
+        :param q:
+        :param error:
+        :return:
+        """
+        a = self.a[q] + abs(error)
+        b = self.b[q] + error * self.__error_step
+        n = self.n[q]
+
+        if n == RESET:
+            a >>= 1
+            b = b >> 1 if b >= 0 else -((1 - b) >> 1)
+            n >>= 1
+
+        n += 1
+
+        # Bias correction. Keeps B in (-N, 0] by moving C one step at a time.
+        if b <= -n:
+            b += n
+
+            if self.c[q] > MIN_C:
+                self.c[q] -= 1
+
+            if b <= -n:
+                b = -n + 1
+
+        elif b > 0:
+            b -= n
+
+            if self.c[q] < MAX_C:
+                self.c[q] += 1
+
+            if b > 0:
+                b = 0
+
+        self.a[q] = a
+        self.b[q] = b
+        self.n[q] = n
+
+    def run_interruption_k(self, q, ri_type):
+        """
+            Golomb parameter of a run interruption context
+        :param q:
+        :param ri_type:
+        :return:
+        """
+        temp = self.a[q] if ri_type == 0 else self.a[q] + (self.n[q] >> 1)
+        n = self.n[q]
+        k = 0
+
+        while (n << k) < temp:
+            k += 1
+
+        return k
+
+    def run_interruption_negative_map(self, q, k):
+        """
+            Whether negative errors of a run interruption context take the odd mapped values. Positive errors take
+        them otherwise (only possible with k = 0).
+        :param q:
+        :param k:
+        :return:
+        """
+        return k != 0 or 2 * self.nn[q] >= self.n[q]
+
+    def update_run_interruption(self, q, error, mapped_error, ri_type):
+        """
+            Updates the statistics of a run interruption context
+        :param q:
+        :param error:
+        :param mapped_error:
+        :param ri_type:
+        :return:
+        """
+        if error < 0:
+            self.nn[q] += 1
+
+        self.a[q] += (mapped_error + 1 - ri_type) >> 1
+
+        if self.n[q] == RESET:
+            self.a[q] >>= 1
+            self.n[q] >>= 1
+            self.nn[q] >>= 1
+
+        self.n[q] += 1
+
+
+def __predict(ra, rb, rc):
+    """
+        Median edge detector
+    :return:
+    """
+    if ra > rb:
+        max_ab, min_ab = ra, rb
+
+    else:
+        max_ab, min_ab = rb, ra
+
+    if rc >= max_ab:
+        return min_ab
+
+    if rc <= min_ab:
+        return max_ab
+
+    return ra + rb - rc
+
+
+def __write_limited_golomb(write_bits, mapped_error, k, limit, qbpp=QBPP):
+    """
+        Golomb-Rice code of mapped_error with parameter k. Values whose unary part would reach
+    limit - qbpp - 1 bits are escaped: that many 1 bits, a 0 and mapped_error - 1 in qbpp bits.
+    :return:
+    """
+    high = mapped_error >> k
+
+    if high < limit - qbpp - 1:
+        write_bits((((1 << high) - 1) << (k + 1)) | (mapped_error & ((1 << k) - 1)), high + 1 + k)
+
+    else:
+        write_bits((((1 << (limit - qbpp - 1)) - 1) << (qbpp + 1)) | (mapped_error - 1), limit)
+
+
+def __read_limited_golomb(input_bit_stream, k, limit, qbpp=QBPP):
+    """
+        Inverse of __write_limited_golomb()
+    :return: mapped error
+    """
+    high = input_bit_stream.count_leading_ones()
+
+    if high < limit - qbpp - 1:
+        return (high << k) | (input_bit_stream.read_bits(k + 1) & ((1 << k) - 1))
+
+    return (input_bit_stream.read_bits(qbpp + 1) & ((1 << qbpp) - 1)) + 1
+
+
+def __quantize_error(error, near):
+    """
+        Maps a prediction error to the index of the 2 * near + 1 wide interval it falls in
+    :param error:
+    :param near:
+    :return:
+    """
+    if error > 0:
+        return (error + near) // (2 * near + 1)
+
+    return -((near - error) // (2 * near + 1))
+
+
+def __near_lossless_sample(px, error, near, coded_range):
+    """
+        Sample reconstructed from its prediction and (quantized, sign corrected) error, as the decoder sees it. The
+    error may have gone through modulo reduction, which is undone first.
+    :param px:
+    :param error:
+    :param near:
+    :param coded_range: RANGE for near, see coding_range()
+    :return:
+    """
+    x = px + error * (2 * near + 1)
+
+    if x < -near:
+        x += coded_range * (2 * near + 1)
+
+    elif x > MAXVAL + near:
+        x -= coded_range * (2 * near + 1)
+
+    if x < 0:
+        return 0
+
+    if x > MAXVAL:
+        return MAXVAL
+
+    return x
+
+
+def __run_interruption_type(ra, rb, near, reference):
+    """
+        1 when the sample that ended a run is predicted from Ra, 0 when it is predicted from Rb. Type 1 relies on the
+    error never being 0, which only holds if the prediction did not need clipping to [0, MAXVAL].
+    :return:
+    """
+    return 1 if abs(ra - rb) <= near and 0 <= reference + ra <= MAXVAL else 0
+
+
+def __encode_run_interruption(write_bits, context, x, ra, rb, run_index, near=0, reference=0, errors=None):
+    """
+        Codes the sample that ended a run (|x - Ra| > near). It is predicted from Rb, or from Ra when
+    |Ra - Rb| <= near, and uses one of the two run interruption contexts. In rows predicted from a reference, Ra and
+    Rb are differences with the reference and the prediction is added to the reference sample.
+    :param errors: list the coded error is appended to, or None
+    :return: reconstructed sample
+    """
+    ri_type = __run_interruption_type(ra, rb, near, reference)
+    q = RUN_INTERRUPTION_CONTEXT + ri_type
+    coded_range, qbpp = coding_range(near)
+
+    px = min(max(reference + (ra if ri_type else rb), 0), MAXVAL)
+    error = x - px
+    sign = -1 if ri_type == 0 and ra > rb else 1
+
+    if sign < 0:
+        error = -error
+
+    if near:
+        error = __quantize_error(error, near)
+        x = __near_lossless_sample(px, sign * error, near, coded_range)
+
+    if error < 0:
+        error += coded_range
+
+    if error >= (coded_range + 1) >> 1:
+        error -= coded_range
+
+    if errors is not None:
+        errors.append(error)
+
+    k = context.run_interruption_k(q, ri_type)
+    negative_map = context.run_interruption_negative_map(q, k)
+    mapped_error = 2 * abs(error) - ri_type - ((error < 0) == negative_map and error != 0)
+
+    __write_limited_golomb(write_bits, mapped_error, k, LIMIT - J[run_index] - 1, qbpp)
+    context.update_run_interruption(q, error, mapped_error, ri_type)
+
+    return x
+
+
+def __decode_run_interruption(input_bit_stream, context, ra, rb, run_index, near=0, reference=0, errors=None):
+    """
+        Inverse of __encode_run_interruption()
+    :return: decoded sample
+    """
+    ri_type = __run_interruption_type(ra, rb, near, reference)
+    q = RUN_INTERRUPTION_CONTEXT + ri_type
+    coded_range, qbpp = coding_range(near)
+
+    k = context.run_interruption_k(q, ri_type)
+    mapped_error = __read_limited_golomb(input_bit_stream, k, LIMIT - J[run_index] - 1, qbpp)
+
+    temp = mapped_error + ri_type
+    error = (temp + 1) >> 1
+
+    if (temp & 1) == context.run_interruption_negative_map(q, k):
+        error = -error
+
+    context.update_run_interruption(q, error, mapped_error, ri_type)
+
+    if errors is not None:
+        errors.append(error)
+
+    if ri_type == 0 and ra > rb:
+        error = -error
+
+    px = min(max(reference + (ra if ri_type else rb), 0), MAXVAL)
+
+    if near:
+        return __near_lossless_sample(px, error, near, coded_range)
+
+    return (px + error) % RANGE
+
+
+def __row_with_borders(row, prev):
+    """
+        Row as the row above of the next one: with its C (A of the row above it) and D (last sample) neighbours
+    :param row: list of samples
+    :param prev: the row above, with its borders
+    :return:
+    """
+    return [prev[1]] + row + [row[-1]]
+
+
+def encode_plane(plane, output_bit_stream, near=0, reference=None, errors=None):
+    """
+        Encodes a plane with LOCO-I context modeling: MED prediction with per-context bias correction, modulo
+    reduction of the prediction error and adaptive Golomb-Rice codes (limited length) per context. Where the
+    neighbourhood is flat (A == B == C == D) the coder switches to run mode and codes the length of the run of
+    samples equal to A instead. The statistics start fresh for every plane.
+
+        Neighbours outside the plane follow JPEG-LS: the row above the first one is all zeros, A (left) of the first
+    column is the pixel above it, C of the first column is the A of the row above and D of the last column is B.
+
+        With near > 0 (near-lossless) every sample may end up off by up to near: the prediction errors are quantized
+    to steps of 2 * near + 1, gradients within +-near count as flat and runs go on while samples are within near of
+    A. Prediction works on the reconstructed samples, exactly as in the decoder.
+
+        With a reference (the same plane of the previous frame, as decoded) every row starts with its prediction
+    mode in 2 bits, see prediction.temporal_row_modes(). ROW_DIFFERENCE and ROW_PREVIOUS rows model the difference
+    between the samples and the reference instead of the samples themselves: contexts, runs and MED all work on the
+    differences (the neighbours' ones too) and the prediction is added to the reference sample. Errors are still
+    coded on the samples.
+
+        Unary parts are written as 1 bits terminated by a 0, like the codes of golomb.encode().
+    :param plane: 2D uint8 array
+    :param output_bit_stream: BitStream opened in OpenMode.WRITE
+    :param near: maximum absolute error, 0 for lossless coding (up to MAX_NEAR)
+    :param reference: 2D uint8 array with the same shape as plane, or None to predict from the plane only
+    :param errors: list the coded prediction errors (after bias correction, quantization and modulo reduction) are
+    appended to, in coding order, or None. Samples coded as part of a run have no error of their own.
+    :return: the plane as the decoder will reconstruct it (plane itself when lossless)
+    """
+    rows, cols = plane.shape
+    write_bits = output_bit_stream.write_bits
+    context = ContextModel(near)
+    a_counts, b_counts, c_counts, n_counts = context.a, context.b, context.c, context.n
+    update = context.update
+    q1_table, q2_table, q3_table = gradient_tables(near)
+    coded_range, qbpp = coding_range(near)
+    run_index = 0
+
+    reconstructed_plane = np.empty_like(plane) if near else plane
+
+    if reference is None:
+        row_modes = [prediction.ROW_INTRA] * rows
+
+    else:
+        row_modes = prediction.temporal_row_modes(plane, reference).tolist()
+
+    # Reference of the current row (zeros for intra rows, which then code the samples themselves)
+    zero_row = [0] * cols
+
+    # Row above, and the reference of the row above, with the extra C (index 0) and D (index cols + 1) neighbours
+    prev = [0] * (cols + 2)
+    reference_prev = [0] * (cols + 2)
+
+    for row_idx, row_array in enumerate(plane):
+        row = row_array.tolist()
+        row_mode = row_modes[row_idx]
+
+        if reference is not None:
+            write_bits(row_mode, 2)
+
+        if row_mode == prediction.ROW_INTRA:
+            reference_row = zero_row
+            above = prev
+
+            # Columns where the sample differs from its left neighbour, i.e. where lossless runs end
+            signal = row_array
+
+        else:
+            reference_row = reference[row_idx].tolist()
+            above = [sample - reference_sample for sample, reference_sample in zip(prev, reference_prev)]
+            signal = row_array.astype(np.int16) - reference[row_idx]
+
+        with_med = row_mode != prediction.ROW_PREVIOUS
+        run_ends = None if near else (np.flatnonzero(np.diff(signal)) + 1).tolist() + [cols]
+
+        # From here on, neighbours (ra, rb, rc, above) are differences with the reference
+        ra = above[1]
+        col = 0
+
+        while col < cols:
+            x = row[col]
+            rc = above[col]
+            rb = above[col + 1]
+
+            q = q1_table[above[col + 2] - rb] + q2_table[rb - rc] + q3_table[rc - ra]
+
+            if q == 0:
+                # Run mode. The run goes on while samples equal Ra (are within near of it).
+                if near:
+                    run_end = col
+
+                    while run_end < cols and abs(row[run_end] - reference_row[run_end] - ra) <= near:
+                        run_end += 1
+
+                    row[col:run_end] = [min(max(reference_sample + ra, 0), MAXVAL)
+                                        for reference_sample in reference_row[col:run_end]]
+
+                elif x - reference_row[col] != ra:
+                    run_end = col
+
+                else:
+                    run_end = run_ends[bisect.bisect_left(run_ends, col + 1)]
+
+                run_length = run_end - col
+
+                while run_length >= (1 << J[run_index]):
+                    write_bits(1, 1)
+                    run_length -= 1 << J[run_index]
+
+                    if run_index < 31:
+                        run_index += 1
+
+                if run_end == cols:
+                    if run_length > 0:
+                        write_bits(1, 1)
+
+                    break
+
+                write_bits(run_length, J[run_index] + 1)
+
+                x = __encode_run_interruption(write_bits, context, row[run_end], ra, above[run_end + 1], run_index,
+                                              near, reference_row[run_end], errors)
+                row[run_end] = x
+
+                if run_index > 0:
+                    run_index -= 1
+
+                ra = x - reference_row[run_end]
+                col = run_end + 1
+                continue
+
+            reference_x = reference_row[col]
+            px = reference_x + __predict(ra, rb, rc) if with_med else reference_x
+
+            if q < 0:
+                q = -q
+                px -= c_counts[q]
+                sign = -1
+
+            else:
+                px += c_counts[q]
+                sign = 1
+
+            if px < 0:
+                px = 0
+
+            elif px > MAXVAL:
+                px = MAXVAL
+
+            error = x - px if sign == 1 else px - x
+
+            if near:
+                # Quantized error, and the sample the decoder will rebuild from it
+                error = (error + near) // (2 * near + 1) if error > 0 else -((near - error) // (2 * near + 1))
+                x = px + sign * error * (2 * near + 1)
+                x = 0 if x < 0 else MAXVAL if x > MAXVAL else x
+                row[col] = x
+
+            # Modulo reduction to [-RANGE / 2, RANGE / 2)
+            if error < 0:
+                error += coded_range
+
+            if error >= (coded_range + 1) >> 1:
+                error -= coded_range
+
+            if errors is not None:
+                errors.append(error)
+
+            n = n_counts[q]
+            k = 0
+            while (n << k) < a_counts[q]:
+                k += 1
+
+            # Map the error to a non-negative value. For k = 0 with a negative bias the mapping is inverted (lossless
+            # only).
+            if k == 0 and 2 * b_counts[q] <= -n and not near:
+                mapped_error = 2 * error + 1 if error >= 0 else -2 * (error + 1)
+
+            else:
+                mapped_error = 2 * error if error >= 0 else -2 * error - 1
+
+            __write_limited_golomb(write_bits, mapped_error, k, LIMIT, qbpp)
+            update(q, error)
+            ra = x - reference_x
+            col += 1
+
+        if near:
+            reconstructed_plane[row_idx] = row
+
+        prev = __row_with_borders(row, prev)
+
+        if reference is not None:
+            reference_prev = __row_with_borders(reference[row_idx].tolist(), reference_prev)
+
+    return reconstructed_plane
+
+
+def decode_plane(row_count, col_count, input_bit_stream, near=0, reference=None, errors=None):
+    """
+        Inverse of encode_plane()
+    :param row_count:
+    :param col_count:
+    :param input_bit_stream: BitStream opened in OpenMode.READ
+    :param near: maximum absolute error the plane was encoded with
+    :param reference: reference the plane was encoded with, None if none
+    :param errors: see encode_plane()
+    :return: uint8 array of shape (row_count, col_count)
+    """
+    read_bits = input_bit_stream.read_bits
+    context = ContextModel(near)
+    a_counts, b_counts, c_counts, n_counts = context.a, context.b, context.c, context.n
+    update = context.update
+    q1_table, q2_table, q3_table = gradient_tables(near)
+    coded_range, qbpp = coding_range(near)
+    run_index = 0
+
+    decoded_plane = np.zeros((row_count, col_count), dtype=np.uint8)
+    zero_row = [0] * col_count
+    prev = [0] * (col_count + 2)
+    reference_prev = [0] * (col_count + 2)
+
+    for row_idx in range(0, row_count):
+        row = [0] * col_count
+        row_mode = prediction.ROW_INTRA if reference is None else read_bits(2)
+
+        if row_mode == prediction.ROW_INTRA:
+            reference_row = zero_row
+            above = prev
+
+        else:
+            reference_row = reference[row_idx].tolist()
+            above = [sample - reference_sample for sample, reference_sample in zip(prev, reference_prev)]
+
+        with_med = row_mode != prediction.ROW_PREVIOUS
+        ra = above[1]
+        col = 0
+
+        while col < col_count:
+            rc = above[col]
+            rb = above[col + 1]
+
+            q = q1_table[above[col + 2] - rb] + q2_table[rb - rc] + q3_table[rc - ra]
+
+            if q == 0:
+                # Run mode. Every 1 bit stands for 2 ** J[run_index] samples equal to Ra, or for the rest of the row.
+                run_end = col
+
+                while read_bits(1) == 1:
+                    run_length = min(1 << J[run_index], col_count - run_end)
+                    run_end += run_length
+
+                    if run_length == 1 << J[run_index] and run_index < 31:
+                        run_index += 1
+
+                    if run_end == col_count:
+                        break
+
+                else:
+                    # The run was interrupted. J[run_index] bits hold the rest of its length.
+                    run_end += read_bits(J[run_index])
+
+                if reference_row is zero_row:
+                    row[col:run_end] = [ra] * (run_end - col)
+
+                else:
+                    row[col:run_end] = [min(max(reference_sample + ra, 0), MAXVAL)
+                                        for reference_sample in reference_row[col:run_end]]
+
+                if run_end == col_count:
+                    break
+
+                x = __decode_run_interruption(input_bit_stream, context, ra, above[run_end + 1], run_index, near,
+                                              reference_row[run_end], errors)
+
+                if run_index > 0:
+                    run_index -= 1
+
+                row[run_end] = x
+                ra = x - reference_row[run_end]
+                col = run_end + 1
+                continue
+
+            reference_x = reference_row[col]
+            px = reference_x + __predict(ra, rb, rc) if with_med else reference_x
+
+            if q < 0:
+                q = -q
+                px -= c_counts[q]
+                sign = -1
+
+            else:
+                px += c_counts[q]
+                sign = 1
+
+            if px < 0:
+                px = 0
+
+            elif px > MAXVAL:
+                px = MAXVAL
+
+            n = n_counts[q]
+            k = 0
+            while (n << k) < a_counts[q]:
+                k += 1
+
+            mapped_error = __read_limited_golomb(input_bit_stream, k, LIMIT, qbpp)
+
+            if k == 0 and 2 * b_counts[q] <= -n and not near:
+                error = mapped_error >> 1 if mapped_error & 1 else -(mapped_error >> 1) - 1
+
+            else:
+                error = -((mapped_error + 1) >> 1) if mapped_error & 1 else mapped_error >> 1
+
+            update(q, error)
+
+            if errors is not None:
+                errors.append(error)
+
+            if near:
+                x = __near_lossless_sample(px, sign * error, near, coded_range)
+
+            else:
+                x = (px + sign * error) % RANGE
+
+            row[col] = x
+            ra = x - reference_x
+            col += 1
+
+        decoded_plane[row_idx] = row
+        prev = __row_with_borders(row, prev)
+
+        if reference is not None:
+            reference_prev = __row_with_borders(reference[row_idx].tolist(), reference_prev)
+
+    return decoded_plane
@@ -0,0 +1,113 @@
+import numpy as np
+
+
+def pad_plane(plane):
+    """
+        Returns an int16 copy of the plane with a row of zeros on top and a column of zeros on the left, so the
+    A (left), B (top) and C (top-left) neighbours of every pixel can be sliced without bounds checks
+    :param plane: 2D array of samples
+    :return: int16 array of shape (rows + 1, cols + 1)
+    """
+    padded = np.zeros((plane.shape[0] + 1, plane.shape[1] + 1), dtype=np.int16)
+    padded[1:, 1:] = plane
+
+    return padded
+
+
+def med_predict(a, b, c):
+    """
+        Median edge detector (LOCO-I) prediction, element-wise. Equivalent to:
+            C >= max(A, B) -> min(A, B)
+            C <= min(A, B) -> max(A, B)
+            otherwise      -> A + B - C
+        which is the median of A, B and A + B - C.
+    :param a: left neighbours (signed integer array)
+    :param b: top neighbours (signed integer array)
+    :param c: top-left neighbours (signed integer array)
+    :return: predicted values
+    """
+    return np.clip(a + b - c, np.minimum(a, b), np.maximum(a, b))
+
+
+def predict_plane(plane):
+    """
+        Computes the MED prediction of every pixel of the plane. Pixels outside the plane are taken as 0.
+    :param plane: 2D array of samples
+    :return: int16 array with the same shape as plane
+    """
+    padded = pad_plane(plane)
+
+    return med_predict(padded[1:, :-1], padded[:-1, 1:], padded[:-1, :-1])
+
+
+def residuals(plane):
+    """
+        Computes the prediction residuals (x - predicted x) of a whole plane
+    :param plane: 2D array of samples
+    :return: int16 array in the range [-255, 255] with the same shape as plane
+    """
+    return plane.astype(np.int16) - predict_plane(plane)
+
+
+def reconstruct_plane(plane_residuals):
+    """
+        Inverse of residuals(): rebuilds a plane from its residuals. Each pixel depends on its decoded A, B and C
+    neighbours, but pixels on the same anti-diagonal (row + col constant) do not depend on each other, so the plane
+    is rebuilt one anti-diagonal per step (rows + cols - 1 steps).
+
+        The work is done on a skewed layout where skewed[d + 2, r + 1] holds pixel (r, d - r). The neighbours of a
+    whole diagonal are then plain slices of the two previous skewed rows:
+        A = (r, c - 1)     -> skewed[d + 1, r + 1]
+        B = (r - 1, c)     -> skewed[d + 1, r]
+        C = (r - 1, c - 1) -> skewed[d, r]
+    Cells that are never written stay 0, which gives the same zero border as pad_plane().
+
+        Samples are rebuilt modulo 256, so residuals stored modulo 256 decode the same as signed ones.
+    :param plane_residuals: 2D integer array of residuals
+    :return: uint8 array with the same shape as plane_residuals
+    """
+    rows, cols = plane_residuals.shape
+    row_idx, col_idx = np.indices((rows, cols))
+
+    skewed_residuals = np.zeros((rows + cols + 1, rows + 1), dtype=np.int16)
+    skewed_residuals[row_idx + col_idx + 2, row_idx + 1] = plane_residuals
+    skewed = np.zeros_like(skewed_residuals)
+
+    for d in range(0, rows + cols - 1):
+        # Rows of the plane crossed by this anti-diagonal
+        first = max(0, d - cols + 1) + 1
+        last = min(d, rows - 1) + 2
+
+        a = skewed[d + 1, first:last]
+        b = skewed[d + 1, first - 1:last - 1]
+        c = skewed[d, first - 1:last - 1]
+
+        skewed[d + 2, first:last] = (med_predict(a, b, c) + skewed_residuals[d + 2, first:last]) & 0xFF
+
+    return skewed[row_idx + col_idx + 2, row_idx + 1].astype(np.uint8)
+
+
+# Prediction modes of a row of a temporally predicted plane (see temporal_row_modes())
+ROW_INTRA = 0
+ROW_DIFFERENCE = 1
+ROW_PREVIOUS = 2
+
+
+def temporal_row_modes(plane, reference):
+    """
+        Picks the prediction of every row of a plane that has a reference (the same plane of the previous frame):
+        ROW_INTRA      - MED on the samples, as without a reference
+        ROW_DIFFERENCE - MED on the difference with the reference, added to the co-located reference sample
+        ROW_PREVIOUS   - the co-located reference sample
+    Rows take the mode with the smallest sum of absolute residuals, the earlier mode on ties.
+    :param plane: 2D uint8 array
+    :param reference: 2D uint8 array with the same shape
+    :return: int array with one mode per row
+    """
+    difference = plane.astype(np.int16) - reference
+
+    costs = np.stack([np.abs(residuals(plane)).sum(axis=1),
+                      np.abs(residuals(difference)).sum(axis=1),
+                      np.abs(difference).sum(axis=1)])
+
+    return costs.argmin(axis=0)
@@ -0,0 +1,113 @@
+import numpy as np
+
+# Shared memory blocks attached by this (worker) process, by name. They stay mapped for the lifetime of the process
+# so each block is attached only once no matter how many frames go through it.
+__attached_blocks = {}
+
+
+def planes_size(plane_shapes):
+    """
+        Number of bytes taken by a frame made of uint8 planes with the given shapes
+    :param plane_shapes: list of (rows, cols)
+    :return:
+    """
+    return sum(rows * cols for rows, cols in plane_shapes)
+
+
+def plane_views(buffer, plane_shapes):
+    """
+        Splits a flat frame buffer into uint8 plane views (no copies), one after the other in buffer order
+    :param buffer: object exposing the buffer protocol (e.g. SharedMemory.buf)
+    :param plane_shapes: list of (rows, cols)
+    :return: list of 2D uint8 arrays sharing memory with buffer
+    """
+    planes = []
+    offset = 0
+
+    for rows, cols in plane_shapes:
+        planes.append(np.ndarray((rows, cols), dtype=np.uint8, buffer=buffer, offset=offset))
+        offset += rows * cols
+
+    return planes
+
+
+def attach_planes(block_name, plane_shapes):
+    """
+        Worker side: plane views over the shared memory block created by the parent process
+    :param block_name: name of the shared memory block
+    :param plane_shapes: list of (rows, cols)
+    :return: list of 2D uint8 arrays
+    """
+    block = __attached_blocks.get(block_name)
+
+    if block is None:
+        from multiprocessing import shared_memory
+        block = shared_memory.SharedMemory(name=block_name)
+        __attached_blocks[block_name] = block
+
+    return plane_views(block.buf, plane_shapes)
+
+
+class SharedFramePool(object):
+    """
+        Fixed set of shared memory blocks, one raw frame each, used to hand frames to worker processes (and get
+    them back) without pickling the pixels. Only the block name travels with the task.
+    """
+
+    def __init__(self, slot_count, frame_size):
+        """
+        :param slot_count: number of frames that can be in flight at the same time
+        :param frame_size: size of one frame in bytes
+        """
+        # Imported here as it needs Python 3.8, while only --workers > 1 uses it
+        from multiprocessing import shared_memory
+
+        self.__blocks = [shared_memory.SharedMemory(create=True, size=max(1, frame_size)) for _ in range(slot_count)]
+        self.__free_slots = list(range(slot_count))
+
+    def has_free_slot(self):
+        return len(self.__free_slots) > 0
+
+    def acquire(self):
+        """
+            Takes a free slot. Callers must check has_free_slot() first.
+        :return: slot index
+        """
+        return self.__free_slots.pop()
+
+    def release(self, slot):
+        self.__free_slots.append(slot)
+
+    def name(self, slot):
+        return self.__blocks[slot].name
+
+    def write_planes(self, slot, planes):
+        """
+            Copies the planes into the slot, one after the other
+        :param slot:
+        :param planes: list of 2D uint8 arrays
+        :return:
+        """
+        for shared_plane, plane in zip(plane_views(self.__blocks[slot].buf, [plane.shape for plane in planes]), planes):
+            shared_plane[...] = plane
+
+    def read_planes(self, slot, plane_shapes):
+        """
+            Copies the planes out of the slot, so it can be reused
+        :param slot:
+        :param plane_shapes: list of (rows, cols)
+        :return: list of 2D uint8 arrays
+        """
+        return [plane.copy() for plane in plane_views(self.__blocks[slot].buf, plane_shapes)]
+
+    def close(self):
+        """
+            Releases and removes all the blocks. No views over them may be alive at this point.
+        :return:
+        """
+        for block in self.__blocks:
+            block.close()
+            block.unlink()
+
+        self.__blocks = []
+        self.__free_slots = []
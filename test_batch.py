@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import pathlib
+
+import pytest
+
+import batch
+import jpeg_ls
+from test_jpeg_ls import make_clip
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    input_dir = tmp_path / 'in'
+    (input_dir / 'sub').mkdir(parents=True)
+
+    for seed, name in enumerate(['a.y4m', 'b.y4m', os.path.join('sub', 'a.y4m')]):
+        (input_dir / name).write_bytes(make_clip(frame_count=2 + seed, seed=seed)[0])
+
+    (input_dir / 'notes.txt').write_text('not a clip')
+
+    return input_dir
+
+
+def manifest_entries(output_dir):
+    with open(output_dir / batch.MANIFEST_NAME) as manifest_file:
+        return [json.loads(line) for line in manifest_file]
+
+
+def test_encode_and_resume(inputs, tmp_path):
+    output_dir = tmp_path / 'out'
+    options = {'adaptive': True}
+
+    assert batch.run([str(inputs)], str(output_dir), 'enc', options, processes=2) == {'done': 3, 'skipped': 0, 'failed': 0}
+
+    entries = manifest_entries(output_dir)
+    assert sorted(os.path.relpath(entry['output'], output_dir) for entry in entries) == \
+        ['a.y4m_enc', 'b.y4m_enc', os.path.join('sub', 'a.y4m_enc')]
+
+    for entry in entries:
+        input_data = pathlib.Path(entry['input']).read_bytes()
+
+        assert entry['input_sha256'] == hashlib.sha256(input_data).hexdigest()
+        assert entry['output_size'] == os.path.getsize(entry['output'])
+        assert jpeg_ls.decode_bytes(pathlib.Path(entry['output']).read_bytes()) == input_data
+
+    assert not list(output_dir.rglob('*' + batch.PARTIAL_SUFFIX))
+
+    # Nothing changed: everything is skipped
+    assert batch.run([str(inputs)], str(output_dir), 'enc', options) == {'done': 0, 'skipped': 3, 'failed': 0}
+
+    # A modified input and a deleted output are coded again
+    (inputs / 'b.y4m').write_bytes(make_clip(frame_count=3, seed=7)[0])
+    os.remove(output_dir / 'sub' / 'a.y4m_enc')
+    assert batch.run([str(inputs)], str(output_dir), 'enc', options) == {'done': 2, 'skipped': 1, 'failed': 0}
+
+    # Other options: everything is coded again
+    assert batch.run([str(inputs)], str(output_dir), 'enc', {'adaptive': False}) == {'done': 3, 'skipped': 0, 'failed': 0}
+
+
+def test_failures_are_recorded_and_retried(inputs, tmp_path):
+    output_dir = tmp_path / 'out'
+    (inputs / 'broken.y4m').write_bytes(b'YUV4MPEG2 W4 H2 F25:1 C411\nFRAME\n' + bytes(12))
+
+    assert batch.run([str(inputs)], str(output_dir), 'enc', {}, processes=1) == {'done': 3, 'skipped': 0, 'failed': 1}
+
+    failed_entries = [entry for entry in manifest_entries(output_dir) if 'error' in entry]
+    assert [os.path.basename(entry['input']) for entry in failed_entries] == ['broken.y4m']
+    assert not os.path.exists(failed_entries[0]['output'])
+    assert not list(output_dir.rglob('*' + batch.PARTIAL_SUFFIX))
+
+    assert batch.run([str(inputs)], str(output_dir), 'enc', {}, processes=1) == {'done': 0, 'skipped': 3, 'failed': 1}
+    assert batch.main(['enc', str(inputs), '--output-dir', str(output_dir), '--processes', '1']) == 1
+
+
+def test_load_manifest_ignores_truncated_line(tmp_path):
+    manifest_path = tmp_path / batch.MANIFEST_NAME
+    manifest_path.write_text(json.dumps({'output': 'x', 'seconds': 1}) + '\n' +
+                             json.dumps({'output': 'x', 'seconds': 2}) + '\n{"output": "y", "sec')
+
+    assert batch.load_manifest(str(manifest_path)) == {'x': {'output': 'x', 'seconds': 2}}
+
+
+def test_find_inputs(inputs):
+    found = batch.find_inputs([str(inputs), str(inputs / '*.y4m')], '*.y4m')
+
+    assert sorted(name for _, name in found) == ['a.y4m', 'a.y4m', 'b.y4m', 'b.y4m', os.path.join('sub', 'a.y4m')]
+
+    with pytest.raises(FileNotFoundError):
+        batch.find_inputs([str(inputs / '*.mkv')], '*.y4m')
+
+
+def test_colliding_outputs(inputs, tmp_path):
+    # sub/a.y4m and a.y4m both end up as a.y4m_enc when given as files
+    with pytest.raises(ValueError):
+        batch.plan_jobs(batch.find_inputs([str(inputs / 'a.y4m'), str(inputs / 'sub' / 'a.y4m')], '*.y4m'),
+                        str(tmp_path / 'out'), 'enc')
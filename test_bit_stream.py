@@ -0,0 +1,135 @@
+import io
+import os
+import random
+
+import pytest
+
+from bit_stream import BitStream, OpenMode
+from conftest import UnseekableReader
+
+
+def random_codes(count, max_length=32, seed=0):
+    rng = random.Random(seed)
+    lengths = [rng.randint(1, max_length) for _ in range(count)]
+
+    return [rng.getrandbits(length) for length in lengths], lengths
+
+
+def written_bytes(write):
+    output_file = io.BytesIO()
+    output_bit_stream = BitStream(output_file, OpenMode.WRITE)
+    write(output_bit_stream)
+    output_bit_stream.flush()
+
+    return output_file.getvalue()
+
+
+def test_write_bits_read_bits_round_trip():
+    values, lengths = random_codes(20000)
+    data = written_bytes(lambda stream: [stream.write_bits(value, length) for value, length in zip(values, lengths)])
+
+    assert len(data) == (sum(lengths) + 7) >> 3
+
+    input_bit_stream = BitStream(io.BytesIO(data), OpenMode.READ)
+    assert [input_bit_stream.read_bits(length) for length in lengths] == values
+    assert input_bit_stream.tell_bits() == sum(lengths)
+
+
+def test_write_codes_matches_write_bits():
+    values, lengths = random_codes(5000, seed=1)
+
+    assert written_bytes(lambda stream: stream.write_codes(values, lengths)) == \
+        written_bytes(lambda stream: [stream.write_bits(value, length) for value, length in zip(values, lengths)])
+
+
+@pytest.mark.parametrize('offset_bits', [0, 3])
+def test_write_packed_bits(offset_bits):
+    packed = bytes(range(256)) * 3
+
+    def write(stream):
+        stream.write_bits(0b101, offset_bits)
+        stream.write_packed_bits(packed, len(packed) * 8 - 5)
+
+    expected = int.from_bytes(packed, byteorder='big') >> 5
+    expected |= 0b101 << (len(packed) * 8 - 5) if offset_bits else 0
+    num_of_bits = offset_bits + len(packed) * 8 - 5
+
+    input_bit_stream = BitStream(io.BytesIO(written_bytes(write)), OpenMode.READ)
+    assert input_bit_stream.read_bits(num_of_bits) == expected
+
+
+def test_padding():
+    assert written_bytes(lambda stream: stream.write_bits(1, 1)) == b'\x80'
+
+    def write_with_ones(stream):
+        stream.set_padding_mode(False)
+        stream.write_bits(0, 1)
+
+    assert written_bytes(write_with_ones) == b'\x7f'
+
+
+def test_peek_skip_and_leading_ones():
+    input_bit_stream = BitStream(io.BytesIO(bytes([0xFF, 0xFF, 0xF0, 0x0F])), OpenMode.READ)
+
+    assert input_bit_stream.peek_bits(4) == 0xF
+    assert input_bit_stream.count_leading_ones() == 20
+    assert input_bit_stream.tell_bits() == 20
+    input_bit_stream.skip_bits(4)
+    assert input_bit_stream.read_bits(8) == 0x0F
+
+    # The file has ended: bits past the end peek as zeros, reads fail
+    assert input_bit_stream.peek_bits(8) == 0
+    assert input_bit_stream.read_bits(1) == -1
+
+
+def test_reads_across_chunks():
+    # Larger than a read chunk, so the buffer is topped up several times
+    data = os.urandom(300000)
+    input_bit_stream = BitStream(UnseekableReader(data), OpenMode.READ)
+
+    assert input_bit_stream.read_bits(13) == int.from_bytes(data[:2], byteorder='big') >> 3
+    input_bit_stream.skip_bits(3 + 8 * 150000)
+    assert input_bit_stream.read_bytes(4) == data[150002:150006]
+    assert input_bit_stream.read_bits(32) == int.from_bytes(data[150006:150010], byteorder='big')
+
+
+def test_seek():
+    data = bytes(range(256)) * 1024
+    input_bit_stream = BitStream(io.BytesIO(data), OpenMode.READ)
+
+    input_bit_stream.read_bits(5)
+    assert input_bit_stream.seek(1000) == 1000
+    assert input_bit_stream.read_bits(8) == data[1000]
+    assert input_bit_stream.seek(10, os.SEEK_CUR) == 1011
+    assert input_bit_stream.read_bits(8) == data[1011]
+    assert input_bit_stream.seek(-2, os.SEEK_END) == len(data) - 2
+    assert input_bit_stream.read_bits(16) == int.from_bytes(data[-2:], byteorder='big')
+    assert input_bit_stream.seek(3) == 3
+    assert input_bit_stream.read_bits(8) == data[3]
+
+
+def test_seek_unseekable_stream():
+    data = bytes(range(256)) * 1024
+    input_bit_stream = BitStream(UnseekableReader(data), OpenMode.READ)
+
+    input_bit_stream.read_bits(8)
+    assert input_bit_stream.seek(200000) == 200000
+    assert input_bit_stream.read_bits(8) == data[200000]
+
+    with pytest.raises(io.UnsupportedOperation):
+        input_bit_stream.seek(0)
+
+
+@pytest.mark.filterwarnings('error::pytest.PytestUnraisableExceptionWarning')
+@pytest.mark.parametrize('close_stream', [True, False])
+def test_del_after_file_object_closed(close_stream):
+    file_object = io.BytesIO()
+    stream = BitStream(file_object, OpenMode.WRITE)
+    stream.write_bits(0b101, 3)
+
+    if close_stream:
+        stream.close()
+        assert file_object.getvalue() == b'\xa0'
+
+    file_object.close()
+    del stream
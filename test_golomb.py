@@ -0,0 +1,92 @@
+import io
+
+import numpy as np
+import pytest
+
+import golomb
+from bit_stream import BitStream, OpenMode
+
+M_PARAMS = [2, 3, 4, 5, 7, 8, 16, 100, 255]
+
+
+def packed_stream(residuals, m):
+    data, num_of_bits = golomb.pack_array(residuals, m)
+
+    return BitStream(io.BytesIO(data), OpenMode.READ), num_of_bits
+
+
+def random_residuals(count, seed=0):
+    rng = np.random.default_rng(seed)
+
+    # Mostly small residuals, as MED produces, plus the extremes
+    residuals = np.clip(np.round(rng.laplace(0, 8, count)), -255, 255).astype(np.int16)
+    residuals[:4] = [-255, 255, 0, -1]
+
+    return residuals
+
+
+@pytest.mark.parametrize('m', M_PARAMS)
+def test_code_table_matches_encode(m):
+    values, lengths = golomb.code_table(m)
+
+    for residual in range(-255, 256):
+        row = residual + 255
+        code = ''.join(format(int(value), f'0{length}b')
+                       for value, length in zip(values[row], lengths[row]) if length)
+
+        assert code == golomb.encode(residual, m)
+
+
+@pytest.mark.parametrize('m', M_PARAMS)
+def test_decode_table_matches_encode(m):
+    values, lengths = golomb.decode_table(m)
+
+    for residual in range(-255, 256):
+        code = golomb.encode(residual, m)
+
+        if len(code) > golomb.DECODE_TABLE_BITS:
+            continue
+
+        window = int(code, 2) << (golomb.DECODE_TABLE_BITS - len(code))
+        assert (values[window], lengths[window]) == (residual, len(code))
+
+
+@pytest.mark.parametrize('m', M_PARAMS)
+def test_pack_array_matches_encode(m):
+    residuals = random_residuals(3000, seed=m)
+    data, num_of_bits = golomb.pack_array(residuals, m)
+    bits = ''.join(golomb.encode(int(residual), m) for residual in residuals)
+
+    assert num_of_bits == len(bits)
+    assert data == int(bits + '0' * (-len(bits) % 8), 2).to_bytes((len(bits) + 7) // 8, byteorder='big')
+
+
+@pytest.mark.parametrize('m', M_PARAMS)
+def test_decode_array_round_trip(m):
+    # More residuals than a pack chunk
+    residuals = random_residuals(golomb.PACK_CHUNK_SIZE + 1000, seed=m)
+    input_bit_stream, _ = packed_stream(residuals, m)
+
+    decoded = golomb.decode_array(m, len(residuals), input_bit_stream)
+
+    assert decoded.dtype == np.int16
+    assert np.array_equal(decoded, residuals)
+
+
+@pytest.mark.parametrize('m', [3, 8])
+def test_decode_round_trip(m):
+    residuals = random_residuals(2000, seed=m)
+    input_bit_stream, _ = packed_stream(residuals, m)
+
+    assert golomb.decode(m, len(residuals), input_bit_stream) == residuals.tolist()
+
+
+def test_decode_array_stops_at_end_of_stream():
+    residuals = random_residuals(500)
+    input_bit_stream, _ = packed_stream(residuals, 4)
+
+    decoded = golomb.decode_array(4, 1000, input_bit_stream)
+
+    # The zero padding of the last byte may decode as one more residual
+    assert 500 <= len(decoded) <= 501
+    assert np.array_equal(decoded[:500], residuals)
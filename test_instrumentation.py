@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+import pytest
+
+import instrumentation
+import jpeg_ls
+import prediction
+from test_jpeg_ls import make_clip
+
+
+@pytest.fixture
+def recorder_options(tmp_path):
+    yield {'json_lines_path': str(tmp_path / 'metrics.jsonl'), 'prometheus_path': str(tmp_path / 'metrics.prom')}
+    instrumentation.disable()
+
+
+def test_disabled_by_default():
+    assert not instrumentation.recorder().enabled
+    assert not instrumentation.recorder().histograms
+
+
+def test_escape_label_value():
+    assert instrumentation.escape_label_value('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+    assert instrumentation.escape_label_value(3) == '3'
+
+
+def test_metrics_outputs(tmp_path, recorder_options):
+    y4m_data, frames = make_clip(frame_count=3)
+    instrumentation.enable(labels={'content': 'say "hi"\n'}, **recorder_options)
+    jpeg_ls.encode_bytes(y4m_data)
+    instrumentation.disable()
+
+    with open(recorder_options['json_lines_path']) as json_lines_file:
+        records = [json.loads(line) for line in json_lines_file]
+
+    assert [record['event'] for record in records] == ['frame'] * len(frames) + ['summary']
+    assert all(record['content'] == 'say "hi"\n' for record in records)
+
+    summary = records[-1]
+    assert summary['planes']['y']['samples'] == sum(frame[0].size for frame in frames)
+    assert set(summary['seconds']) == set(instrumentation.STAGES)
+
+    # Fixed m codes the MED residuals
+    counts = np.zeros(instrumentation.HISTOGRAM_BINS, dtype=np.int64)
+    for frame in frames:
+        counts += np.bincount((prediction.residuals(frame[0]).ravel() - instrumentation.HISTOGRAM_MIN) & 0xFF,
+                              minlength=instrumentation.HISTOGRAM_BINS)
+
+    assert summary['planes']['y']['residual_histogram']['counts'] == counts.tolist()
+
+    with open(recorder_options['prometheus_path']) as prometheus_file:
+        prometheus_text = prometheus_file.read()
+
+    assert 'jpeg_ls_frames_total{content="say \\"hi\\"\\n"} 3' in prometheus_text.splitlines()
+
+
+@pytest.mark.parametrize('options', [{'adaptive': True}, {'near': 2}, {'intra_period': 2}], ids=str)
+def test_adaptive_histograms_count_coded_errors(options, recorder_options):
+    y4m_data, frames = make_clip(frame_count=3)
+
+    recorder = instrumentation.enable(**recorder_options)
+    encoded_data = jpeg_ls.encode_bytes(y4m_data, **options)
+    encoder_summary = recorder.summary()
+
+    recorder = instrumentation.enable()
+    jpeg_ls.decode_bytes(encoded_data)
+    decoder_summary = recorder.summary()
+
+    histogram = encoder_summary['planes']['y']['residual_histogram']
+    assert decoder_summary['planes']['y']['residual_histogram'] == histogram
+
+    # Samples coded in runs have no error of their own
+    assert 0 < sum(histogram['counts']) < encoder_summary['planes']['y']['samples']
+
+    if 'near' in options:
+        # Quantized errors are small
+        values = np.flatnonzero(histogram['counts']) + instrumentation.HISTOGRAM_MIN
+        assert np.abs(values).max() <= 256 // (2 * options['near'] + 1)
@@ -0,0 +1,216 @@
+import hashlib
+import io
+import math
+import os
+
+import numpy as np
+import pytest
+
+import jpeg_ls
+
+# SHA-256 of new_flowers.y4m encoded with the default options (fixed Golomb parameter, one process) by the original
+# implementation. The default bitstream must not change.
+BASELINE_FLOWERS_SHA256 = 'fb588b2e5005f696782ac1e3afe83db6376a8fa4f443bda85a79adeb22fa0729'
+
+FLOWERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'new_flowers.y4m')
+
+CHROMA_SHAPES = {
+    '420': lambda width, height: (math.ceil(height / 2), math.ceil(width / 2)),
+    '422': lambda width, height: (height, math.ceil(width / 2)),
+    '444': lambda width, height: (height, width),
+    'mono': lambda width, height: (0, 0),
+}
+
+
+def make_clip(width=40, height=26, color_space='420', frame_count=5, seed=0):
+    """
+        Small Y4M clip: a gradient panning by a column per frame, with noise and a static part
+    :return: (Y4M file contents, list of [y, u, v] frames)
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:height, 0:width]
+    chroma_shape = CHROMA_SHAPES[color_space](width, height)
+    frames = []
+
+    for frame_number in range(frame_count):
+        y = ((rows * 4 + (cols + frame_number) * 6) % 256).astype(np.uint8)
+        y[:height // 3] = 90
+        y[rng.random((height, width)) < 0.05] = 255
+        u = rng.integers(100, 110, chroma_shape, dtype=np.uint8)
+        v = np.full(chroma_shape, 128 + frame_number, dtype=np.uint8)
+        frames.append([y, u, v])
+
+    data = f'YUV4MPEG2 W{width} H{height} F25:1 Ip A1:1 C{color_space}\n'.encode()
+    data += b''.join(b'FRAME\n' + b''.join(plane.tobytes() for plane in frame) for frame in frames)
+
+    return data, frames
+
+
+def decoded_frames(encoded_data, start_frame=None, stop_frame=None):
+    return list(jpeg_ls.JpegLs(io.BytesIO(encoded_data)).iter_decoded_frames(start_frame, stop_frame))
+
+
+def encode_file(tmp_path, y4m_data, **options):
+    input_path = tmp_path / 'clip.y4m'
+    input_path.write_bytes(y4m_data)
+    jpeg_ls.encode(str(input_path), str(tmp_path / 'clip.y4m_enc'), **options)
+
+    return (tmp_path / 'clip.y4m_enc').read_bytes()
+
+
+def test_default_output_matches_baseline(tmp_path):
+    jpeg_ls.encode(FLOWERS_PATH, str(tmp_path / 'flowers_enc'))
+    encoded_data = (tmp_path / 'flowers_enc').read_bytes()
+
+    assert hashlib.sha256(encoded_data).hexdigest() == BASELINE_FLOWERS_SHA256
+
+    jpeg_ls.decode(str(tmp_path / 'flowers_enc'), str(tmp_path / 'flowers_dec'))
+    with open(FLOWERS_PATH, 'rb') as flowers_file:
+        assert (tmp_path / 'flowers_dec').read_bytes() == flowers_file.read()
+
+
+LOSSLESS_OPTIONS = [
+    {},
+    {'adaptive': True},
+    {'workers': 2},
+    {'adaptive': True, 'workers': 2},
+    {'frame_index': True},
+    {'adaptive': True, 'segments': True},
+    {'segments': True, 'stripe_rows': 8, 'workers': 2},
+    {'adaptive': True, 'intra_period': 3},
+    {'adaptive': True, 'intra_period': 2, 'frame_index': True, 'workers': 2},
+    {'adaptive': True, 'intra_period': 3, 'segments': True, 'stripe_rows': 8},
+]
+
+
+@pytest.mark.parametrize('options', LOSSLESS_OPTIONS, ids=str)
+def test_lossless_round_trip(tmp_path, options):
+    y4m_data, _ = make_clip()
+    encoded_data = encode_file(tmp_path, y4m_data, **options)
+
+    assert jpeg_ls.decode_bytes(encoded_data) == y4m_data
+    assert jpeg_ls.decode_bytes(encoded_data, workers=2) == y4m_data
+
+
+@pytest.mark.parametrize('options', LOSSLESS_OPTIONS[:4] + LOSSLESS_OPTIONS[7:8], ids=str)
+def test_stream_round_trip(options):
+    y4m_data, _ = make_clip()
+
+    assert jpeg_ls.decode_bytes(jpeg_ls.encode_bytes(y4m_data, **options)) == y4m_data
+
+
+@pytest.mark.parametrize('color_space', sorted(CHROMA_SHAPES))
+@pytest.mark.parametrize('adaptive', [False, True])
+def test_color_spaces(tmp_path, color_space, adaptive):
+    y4m_data, _ = make_clip(width=23, height=17, color_space=color_space, frame_count=2)
+
+    assert jpeg_ls.decode_bytes(encode_file(tmp_path, y4m_data, adaptive=adaptive)) == y4m_data
+
+
+@pytest.mark.parametrize('options', [{'near': 2}, {'near': 3, 'intra_period': 2}, {'near': 1, 'segments': True}],
+                         ids=str)
+def test_near_lossless_bound(tmp_path, options):
+    y4m_data, frames = make_clip()
+    encoded_data = encode_file(tmp_path, y4m_data, **options)
+
+    decoded = decoded_frames(encoded_data)
+    assert len(decoded) == len(frames)
+
+    for frame, decoded_frame in zip(frames, decoded):
+        for plane, decoded_plane in zip(frame, decoded_frame):
+            assert np.abs(decoded_plane.astype(np.int16) - plane).max(initial=0) <= options['near']
+
+
+@pytest.mark.parametrize('options', [{'frame_index': True}, {'adaptive': True, 'intra_period': 3, 'frame_index': True},
+                                     {'adaptive': True, 'intra_period': 3}], ids=str)
+def test_random_access(tmp_path, options):
+    y4m_data, frames = make_clip()
+    encoded_data = encode_file(tmp_path, y4m_data, **options)
+    codec = jpeg_ls.JpegLs(io.BytesIO(encoded_data))
+
+    try:
+        for index in (4, 1, 3):
+            assert all(np.array_equal(plane, decoded_plane)
+                       for plane, decoded_plane in zip(frames[index], codec.decode_frame(index)))
+
+    finally:
+        codec.close()
+
+    decoded_range = decoded_frames(encoded_data, 2, 4)
+    assert len(decoded_range) == 2
+    assert all(np.array_equal(plane, decoded_plane)
+               for frame, decoded_frame in zip(frames[2:4], decoded_range) for plane, decoded_plane in zip(frame, decoded_frame))
+
+
+@pytest.mark.parametrize('options', [{'near': -1}, {'near': 128}, {'intra_period': 0}], ids=str)
+def test_invalid_options(options):
+    with pytest.raises(ValueError):
+        jpeg_ls.JpegLs(io.BytesIO(), output_file_path=io.BytesIO(), **options)
+
+
+TRUNCATION_OPTIONS = [{}, {'adaptive': True}, {'workers': 2}, {'adaptive': True, 'segments': True, 'stripe_rows': 8},
+                      {'adaptive': True, 'intra_period': 3}]
+
+
+@pytest.mark.parametrize('options', TRUNCATION_OPTIONS + [{'frame_index': True}], ids=str)
+def test_truncated_header(tmp_path, options):
+    y4m_data, _ = make_clip()
+    encoded_data = encode_file(tmp_path, y4m_data, **options)
+
+    with pytest.raises(EOFError, match='header'):
+        decoded_frames(encoded_data[:10])
+
+
+@pytest.mark.parametrize('options', TRUNCATION_OPTIONS, ids=str)
+@pytest.mark.parametrize('kept_fraction', [0.5, 0.999])
+def test_truncated_frame(tmp_path, options, kept_fraction):
+    y4m_data, _ = make_clip()
+    encoded_data = encode_file(tmp_path, y4m_data, **options)
+    truncated_data = encoded_data[:int(len(encoded_data) * kept_fraction)]
+
+    with pytest.raises(EOFError, match='inside frame'):
+        decoded_frames(truncated_data)
+
+    with pytest.raises(EOFError, match='inside frame'):
+        jpeg_ls.decode_bytes(truncated_data, workers=2)
+
+
+def test_truncated_stream(tmp_path):
+    y4m_data, _ = make_clip()
+    encoded_data = jpeg_ls.encode_bytes(y4m_data, adaptive=True)
+    first_frames_data = jpeg_ls.encode_bytes(make_clip(frame_count=2)[0], adaptive=True)
+    assert encoded_data.startswith(first_frames_data)
+
+    # The number of frames of a stream is unknown: ending at a frame boundary is not an error
+    assert len(decoded_frames(first_frames_data)) == 2
+
+    for kept_size in (len(first_frames_data) + 2, len(first_frames_data) + 20):
+        with pytest.raises(EOFError, match='inside frame 2'):
+            decoded_frames(encoded_data[:kept_size])
+
+
+def test_invalid_frame_index(tmp_path):
+    y4m_data, _ = make_clip()
+    encoded_data = encode_file(tmp_path, y4m_data, frame_index=True)
+
+    with pytest.raises(ValueError, match='index position'):
+        decoded_frames(encoded_data[:-1])
+
+    # Index entries are (offset, bits) pairs of 8 bytes each, followed by the 8-byte position of the index
+    index_position = int.from_bytes(encoded_data[-8:], byteorder='big')
+    bad_entry = len(encoded_data).to_bytes(8, byteorder='big') + encoded_data[index_position + 8:index_position + 16]
+
+    with pytest.raises(ValueError, match='entry for frame 0'):
+        decoded_frames(encoded_data[:index_position] + bad_entry + encoded_data[index_position + 16:])
+
+
+def test_failed_decode_closes_output(tmp_path):
+    y4m_data, _ = make_clip()
+    encoded_data = encode_file(tmp_path, y4m_data, adaptive=True)
+    codec = jpeg_ls.JpegLs(io.BytesIO(encoded_data[:len(encoded_data) // 2]), output_file_path=str(tmp_path / 'dec.y4m'))
+
+    with pytest.raises(EOFError):
+        codec.decode_file()
+
+    # Written out on close(), not left in the write buffer of the codec
+    assert (tmp_path / 'dec.y4m').read_bytes().startswith(y4m_data[:y4m_data.index(b'\n') + 1])
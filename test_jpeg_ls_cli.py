@@ -0,0 +1,54 @@
+import argparse
+import json
+
+import pytest
+
+import jpeg_ls_cli
+from test_jpeg_ls import make_clip
+
+
+@pytest.mark.parametrize('text, expected', [('10:20', (10, 20)), (':5', (None, 5)), ('-5:', (-5, None)),
+                                            (':', (None, None))])
+def test_frame_range(text, expected):
+    assert jpeg_ls_cli.frame_range(text) == expected
+
+
+@pytest.mark.parametrize('text', ['10', '1:2:3', 'a:b'])
+def test_bad_frame_range(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        jpeg_ls_cli.frame_range(text)
+
+
+def test_metrics_label():
+    assert jpeg_ls_cli.metrics_label('content=sports') == ('content', 'sports')
+    assert jpeg_ls_cli.metrics_label('note=a=b') == ('note', 'a=b')
+
+
+@pytest.mark.parametrize('text', ['foo', '=x', 'a b=c', '1st=x'])
+def test_bad_metrics_label(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        jpeg_ls_cli.metrics_label(text)
+
+
+def test_bad_metrics_label_is_a_usage_error(tmp_path):
+    with pytest.raises(SystemExit) as exit_info:
+        jpeg_ls_cli.main(['enc', str(tmp_path / 'clip.y4m'), '--metrics-label', 'foo'])
+
+    assert exit_info.value.code == 2
+
+
+def test_encode_decode(tmp_path):
+    y4m_data, frames = make_clip()
+    (tmp_path / 'clip.y4m').write_bytes(y4m_data)
+
+    jpeg_ls_cli.main(['enc', str(tmp_path / 'clip.y4m'), '--adaptive', '--metrics', str(tmp_path / 'metrics.jsonl'),
+                      '--metrics-label', 'content=test'])
+    jpeg_ls_cli.main(['dec', str(tmp_path / 'clip.y4m_enc'), str(tmp_path / 'clip.y4m_dec')])
+
+    assert (tmp_path / 'clip.y4m_dec').read_bytes() == y4m_data
+
+    with open(tmp_path / 'metrics.jsonl') as metrics_file:
+        records = [json.loads(line) for line in metrics_file]
+
+    assert len(records) == len(frames) + 1
+    assert all(record['content'] == 'test' and record['action'] == 'enc' for record in records)
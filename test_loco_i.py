@@ -0,0 +1,139 @@
+import io
+
+import numpy as np
+import pytest
+
+import loco_i
+import prediction
+from bit_stream import BitStream, OpenMode
+
+
+def sample_planes():
+    """
+        Small planes covering the regular and run modes, the borders and the extremes of the sample range
+    :return: dict of name -> 2D uint8 array
+    """
+    rng = np.random.default_rng(0)
+    rows, cols = np.mgrid[0:40, 0:56]
+
+    gradient = ((rows * 3 + cols * 5) % 256).astype(np.uint8)
+    flat_with_edges = np.full((40, 56), 200, dtype=np.uint8)
+    flat_with_edges[10:20, 5:30] = 0
+    flat_with_edges[25:, 40:] = 255
+
+    return {
+        'noise': rng.integers(0, 256, (40, 56), dtype=np.uint8),
+        'gradient': gradient,
+        'flat_with_edges': flat_with_edges,
+        'speckled': np.where(rng.random((40, 56)) < 0.05, 255, gradient).astype(np.uint8),
+        'single_row': rng.integers(0, 256, (1, 57), dtype=np.uint8),
+        'single_column': rng.integers(0, 256, (33, 1), dtype=np.uint8),
+    }
+
+
+def encoded(plane, near=0, reference=None):
+    output_file = io.BytesIO()
+    output_bit_stream = BitStream(output_file, OpenMode.WRITE)
+    reconstructed_plane = loco_i.encode_plane(plane, output_bit_stream, near, reference)
+    output_bit_stream.flush()
+
+    return output_file.getvalue(), reconstructed_plane
+
+
+def decoded(data, shape, near=0, reference=None):
+    return loco_i.decode_plane(*shape, BitStream(io.BytesIO(data), OpenMode.READ), near, reference)
+
+
+@pytest.mark.parametrize('name', sorted(sample_planes()))
+def test_lossless_round_trip(name):
+    plane = sample_planes()[name]
+    data, reconstructed_plane = encoded(plane)
+
+    assert np.array_equal(reconstructed_plane, plane)
+    assert np.array_equal(decoded(data, plane.shape), plane)
+
+
+def test_flat_plane_compresses():
+    data, _ = encoded(np.full((64, 64), 17, dtype=np.uint8))
+
+    # Run mode: a few bits per row
+    assert len(data) < 64
+
+
+@pytest.mark.parametrize('near', [1, 2, 5, loco_i.MAX_NEAR])
+@pytest.mark.parametrize('name', sorted(sample_planes()))
+def test_near_lossless_bound(name, near):
+    plane = sample_planes()[name]
+    data, reconstructed_plane = encoded(plane, near)
+    decoded_plane = decoded(data, plane.shape, near)
+
+    # The encoder predicts from what the decoder will rebuild
+    assert np.array_equal(decoded_plane, reconstructed_plane)
+    assert np.abs(decoded_plane.astype(np.int16) - plane).max() <= near
+
+
+def test_near_lossless_is_smaller():
+    plane = sample_planes()['noise']
+
+    assert len(encoded(plane, 2)[0]) < len(encoded(plane)[0])
+
+
+
+def moved(plane, rng):
+    """
+        Next frame of a plane: shifted by a column, with part of it unchanged and some noise
+    :return:
+    """
+    next_plane = np.roll(plane, 1, axis=1)
+    next_plane[:plane.shape[0] // 3] = plane[:plane.shape[0] // 3]
+    noise = rng.integers(-3, 4, plane.shape)
+
+    return np.clip(next_plane + noise * (rng.random(plane.shape) < 0.1), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('near', [0, 2])
+@pytest.mark.parametrize('name', sorted(sample_planes()))
+def test_temporal_round_trip(name, near):
+    rng = np.random.default_rng(1)
+    reference = sample_planes()[name]
+    plane = moved(reference, rng)
+
+    data, reconstructed_plane = encoded(plane, near, reference)
+    decoded_plane = decoded(data, plane.shape, near, reference)
+
+    assert np.array_equal(decoded_plane, reconstructed_plane)
+    assert np.abs(decoded_plane.astype(np.int16) - plane).max() <= near
+
+
+def test_temporal_row_modes():
+    reference = sample_planes()['noise'] // 2
+    plane = reference.copy()
+    plane[10:20] = sample_planes()['gradient'][10:20]
+    plane[20:30] += 7
+
+    modes = prediction.temporal_row_modes(plane, reference)
+
+    # Unchanged rows cost nothing from the reference, either way
+    assert (modes[:10] != prediction.ROW_INTRA).all()
+    assert (modes[10:20] == prediction.ROW_INTRA).all()
+    # Brighter rows: constant difference (the first one is predicted from a changed row above)
+    assert (modes[21:30] == prediction.ROW_DIFFERENCE).all()
+
+
+def test_static_content_shrinks():
+    reference = sample_planes()['noise']
+
+    assert len(encoded(reference, 0, reference)[0]) * 10 < len(encoded(reference)[0])
+
+
+@pytest.mark.parametrize('mode', [prediction.ROW_INTRA, prediction.ROW_DIFFERENCE, prediction.ROW_PREVIOUS])
+def test_every_row_mode_round_trips(mode, monkeypatch):
+    rng = np.random.default_rng(2)
+    reference = sample_planes()['speckled']
+    plane = moved(reference, rng)
+
+    monkeypatch.setattr(prediction, 'temporal_row_modes', lambda plane, reference: np.full(plane.shape[0], mode))
+    data, reconstructed_plane = encoded(plane, 0, reference)
+
+    assert np.array_equal(reconstructed_plane, plane)
+    assert np.array_equal(decoded(data, plane.shape, 0, reference), plane)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import prediction
+
+
+def med(a, b, c):
+    if c >= max(a, b):
+        return min(a, b)
+
+    if c <= min(a, b):
+        return max(a, b)
+
+    return a + b - c
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (1, 17), (13, 1), (24, 31)])
+def test_residuals_match_per_pixel_med(shape):
+    plane = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    plane_residuals = prediction.residuals(plane)
+    samples = plane.astype(int).tolist()
+
+    for row in range(shape[0]):
+        for col in range(shape[1]):
+            a = samples[row][col - 1] if col else 0
+            b = samples[row - 1][col] if row else 0
+            c = samples[row - 1][col - 1] if row and col else 0
+
+            assert plane_residuals[row, col] == samples[row][col] - med(a, b, c)
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (1, 17), (13, 1), (24, 31), (31, 24)])
+def test_reconstruct_plane(shape):
+    rng = np.random.default_rng(1)
+    plane = rng.integers(0, 256, shape, dtype=np.uint8)
+    plane[:, ::3] = 255
+
+    assert np.array_equal(prediction.reconstruct_plane(prediction.residuals(plane)), plane)
+
+
+def test_reconstruct_plane_wraps_modulo_256():
+    # The fixed-m bitstream stores residuals modulo 256, the decoder adds them back with the same wraparound
+    plane = np.random.default_rng(2).integers(0, 256, (16, 16), dtype=np.uint8)
+    wrapped_residuals = np.mod(prediction.residuals(plane), 256).astype(np.int16)
+
+    assert np.array_equal(prediction.reconstruct_plane(wrapped_residuals), plane)
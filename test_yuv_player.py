@@ -0,0 +1,205 @@
+import io
+
+import numpy as np
+import pytest
+
+from conftest import UnseekableReader
+from test_jpeg_ls import make_clip
+from yuv_player import FrameCache, YuvDecoder
+
+
+def stream(data):
+    return io.BufferedReader(UnseekableReader(data))
+
+
+@pytest.fixture
+def clip(tmp_path):
+    y4m_data, frames = make_clip(frame_count=6)
+    path = tmp_path / 'clip.y4m'
+    path.write_bytes(y4m_data)
+
+    return str(path), y4m_data, frames
+
+
+def same_frame(planes, frame):
+    return all(np.array_equal(plane, frame_plane) for plane, frame_plane in zip(planes, frame))
+
+
+def test_read_frame(clip):
+    path, _, frames = clip
+    decoder = YuvDecoder(path)
+
+    try:
+        assert decoder.number_of_frames == len(frames)
+        assert (decoder.frame_width, decoder.frame_height, decoder.color_space) == (40, 26, '4:2:0')
+
+        for index in (3, 0, 5):
+            y, u, v, ret = decoder.read_frame(index)
+            assert ret and same_frame((y, u, v), frames[index])
+
+        # Zero-copy views over the mapped file
+        assert not y.flags.writeable
+
+        assert decoder.read_frame(6)[3] is False
+
+    finally:
+        decoder.close()
+
+
+def test_read_stream(clip):
+    _, y4m_data, frames = clip
+    decoder = YuvDecoder(stream(y4m_data))
+
+    assert decoder.number_of_frames is None
+
+    for frame in frames:
+        y, u, v, ret = decoder.read_frame()
+        assert ret and same_frame((y, u, v), frame)
+
+    assert decoder.read_frame()[3] is False
+
+    # Streams only go forward
+    with pytest.raises(ValueError):
+        decoder.read_frame(0)
+
+
+def test_prefetch_frames(clip):
+    path, _, frames = clip
+    decoder = YuvDecoder(path)
+
+    with decoder.prefetch_frames(depth=2) as prefetched_frames:
+        assert all(same_frame(planes, frame) for planes, frame in zip(prefetched_frames, frames))
+
+    decoder.close()
+
+
+def test_unsupported_color_space():
+    y4m_data = b'YUV4MPEG2 W4 H2 F25:1 C411\nFRAME\n' + bytes(12)
+
+    with pytest.raises(ValueError, match='C411'):
+        YuvDecoder(stream(y4m_data))
+
+
+def test_frame_cache_evicts_least_recently_used():
+    cache = FrameCache(300)
+    arrays = [np.zeros(100, dtype=np.uint8) for _ in range(4)]
+
+    for key in range(3):
+        assert cache.put((key, 'planes'), arrays[key])
+
+    assert cache.get((0, 'planes')) is arrays[0]
+    cache.put((3, 'planes'), arrays[3])
+
+    # 1 was the least recently used one
+    assert (1, 'planes') not in cache
+    assert all((key, 'planes') in cache for key in (0, 2, 3))
+    assert cache.get((1, 'planes')) is None
+    assert cache.stats() == {'frames': 3, 'size_bytes': 300, 'max_bytes': 300, 'hits': 1, 'misses': 1, 'evictions': 1}
+
+    # Cached arrays are shared with every caller
+    assert not arrays[0].flags.writeable
+
+
+def test_frame_cache_counts_bytes():
+    cache = FrameCache(1000)
+
+    # Planes of a frame count together
+    cache.put((0, 'planes'), [np.zeros((10, 20), dtype=np.uint8), np.zeros((5, 10), dtype=np.uint8)])
+    assert cache.size_bytes == 250
+
+    # Replacing a frame does not count it twice
+    cache.put((0, 'planes'), np.zeros(400, dtype=np.uint8))
+    assert (len(cache), cache.size_bytes) == (1, 400)
+
+    # Larger than the whole cache: not kept, nothing evicted
+    assert not cache.put((1, 'bgr'), np.zeros(1001, dtype=np.uint8))
+    assert (len(cache), cache.evictions) == (1, 0)
+
+    cache.put((2, 'bgr'), np.zeros(700, dtype=np.uint8))
+    assert (len(cache), cache.size_bytes, cache.evictions) == (1, 700, 1)
+
+    cache.clear()
+    assert (len(cache), cache.size_bytes) == (0, 0)
+
+
+def test_read_converted_frame_from_cache(clip):
+    path, _, frames = clip
+    uncached_decoder = YuvDecoder(path)
+    expected_frames = [uncached_decoder.read_converted_frame(index)[1] for index in range(len(frames))]
+    uncached_decoder.close()
+
+    frame_size = expected_frames[0].nbytes
+    decoder = YuvDecoder(path, cache_bytes=3 * frame_size)
+
+    for index in (0, 1, 2, 1, 0, 3, 4, 0):
+        ret, frame = decoder.read_converted_frame(index)
+        assert ret and np.array_equal(frame, expected_frames[index])
+
+    stats = decoder.frame_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (3, 5, 2)
+    assert stats['size_bytes'] <= 3 * frame_size
+
+    assert decoder.read_converted_frame(len(frames)) == (False, None)
+    decoder.close()
+
+
+def test_stream_goes_back_to_cached_frames(clip):
+    _, y4m_data, frames = clip
+    decoder = YuvDecoder(stream(y4m_data), cache_bytes=1 << 20)
+
+    for _ in range(4):
+        decoder.read_frame()
+
+    y, u, v, ret = decoder.read_frame(1)
+    assert ret and same_frame((y, u, v), frames[1])
+
+    # The stream goes on where it was
+    y, u, v, ret = decoder.read_frame()
+    assert ret and same_frame((y, u, v), frames[4])
+
+
+def test_playback_fills_the_cache(clip):
+    path, _, frames = clip
+    decoder = YuvDecoder(path, cache_bytes=1 << 20)
+    decoder.start()
+
+    played_frames = []
+    while True:
+        ret, frame = decoder.get_frame()
+        if not ret:
+            break
+
+        played_frames.append(frame.copy())
+
+    decoder.join()
+
+    assert len(played_frames) == len(frames)
+    assert decoder.frame_cache.stats()['frames'] == len(frames)
+
+    # Stepping back after playback is served from memory
+    ret, frame = decoder.read_converted_frame(2)
+    assert ret and np.array_equal(frame, played_frames[2])
+    assert decoder.frame_cache.hits == 1
+
+    decoder.close()
+
+
+def test_read_converted_frame_during_playback(clip):
+    path, _, frames = clip
+    uncached_decoder = YuvDecoder(path)
+    expected_frames = [uncached_decoder.read_converted_frame(index)[1] for index in range(len(frames))]
+    uncached_decoder.close()
+
+    for _ in range(20):
+        decoder = YuvDecoder(path, prefetch_depth=1, cache_bytes=2 * expected_frames[0].nbytes)
+        decoder.start()
+
+        for index in (5, 1, 3, 0):
+            ret, frame = decoder.get_frame()
+            assert not ret or any(np.array_equal(frame, expected_frame) for expected_frame in expected_frames)
+
+            # Races the start() thread for the position of the next frame and the cache
+            assert np.array_equal(decoder.read_converted_frame(index)[1], expected_frames[index])
+
+        decoder.join()
+        decoder.close()
@@ -1,68 +1,398 @@
+import collections
 import logging
 import math
-import re
+import mmap
+import os
+import queue
+import stat
 import time
-from threading import Thread
+from threading import Lock, RLock, Thread
 
-import cv2 as cv
 import numpy as np
 
 
-class YuvDecoder(Thread):
+# Chroma subsampling given by the 'C' tag of the Y4M header. The chroma siting variants are read the same way.
+COLOR_SPACE_TAGS = {
+    '420jpeg': '4:2:0',
+    '420mpeg2': '4:2:0',
+    '420paldv': '4:2:0',
+    '420': '4:2:0',
+    '422': '4:2:2',
+    '444': '4:4:4',
+    'mono': 'mono',
+}
+
+
+def plane_shapes(frame_width, frame_height, color_space):
+    """
+        Shapes of the Y, U and V planes of a frame. Monochrome frames have empty U and V planes.
+    :param frame_width:
+    :param frame_height:
+    :param color_space: '4:4:4', '4:2:2', '4:2:0' or 'mono'
+    :return: list of three (rows, cols) tuples
+    """
+    uv_shapes = {
+        '4:4:4': (frame_height, frame_width),
+        '4:2:2': (frame_height, math.ceil(frame_width / 2)),
+        '4:2:0': (math.ceil(frame_height / 2), math.ceil(frame_width / 2)),
+        'mono': (0, 0),
+    }
+
+    return [(frame_height, frame_width), uv_shapes[color_space], uv_shapes[color_space]]
+
+
+class FrameCache(object):
+    """
+        Least recently used cache of frames, bounded by the size in bytes of the arrays it holds rather than by a
+    number of frames, so it holds the same amount of memory whatever the resolution. Cached arrays are made
+    read-only, as they are handed out to every caller asking for them. Safe to use from the prefetching thread and
+    the caller at the same time.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: the least recently used frames are evicted once the cached arrays take more than this
+        """
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = collections.OrderedDict()
+        self.__lock = Lock()
+
+    @staticmethod
+    def __arrays(value):
+        return [value] if isinstance(value, np.ndarray) else list(value)
+
+    def get(self, key):
+        """
+            Looks a frame up and marks it as the most recently used one
+        :param key: (frame index, conversion mode) tuple
+        :return: the cached value, or None
+        """
+        with self.__lock:
+            value = self.__entries.get(key)
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(self, key, value):
+        """
+            Caches a frame, evicting the least recently used ones to make room for it
+        :param key: see get()
+        :param value: array, or list/tuple of arrays (e.g. the Y, U and V planes)
+        :return: False when the frame alone is larger than the cache, which then does not keep it
+        """
+        arrays = self.__arrays(value)
+        size = sum(array.nbytes for array in arrays)
+
+        if size > self.max_bytes:
+            return False
+
+        for array in arrays:
+            array.flags.writeable = False
+
+        with self.__lock:
+            if key in self.__entries:
+                self.size_bytes -= sum(array.nbytes for array in self.__arrays(self.__entries.pop(key)))
+
+            self.__entries[key] = value
+            self.size_bytes += size
+
+            while self.size_bytes > self.max_bytes:
+                _, evicted_value = self.__entries.popitem(last=False)
+                self.size_bytes -= sum(array.nbytes for array in self.__arrays(evicted_value))
+                self.evictions += 1
+
+        return True
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__entries
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+    def clear(self):
+        """
+            Drops every frame. The counters are kept.
+        :return:
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        """
+            Counters of the cache
+        :return: dict
+        """
+        with self.__lock:
+            return {'frames': len(self.__entries), 'size_bytes': self.size_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class FramePrefetcher(object):
+    """
+        Decode-ahead producer. A background thread fills frames ahead of the consumer and hands them out through a
+    bounded queue. Frames go into a fixed ring of preallocated buffers: a buffer returned by get() is given back to
+    the producer on the next get() (or close()) call and then reused, so it must not be kept around.
+    """
+    __end_of_stream = object()
+
+    def __init__(self, fill_frame, allocate_frame, depth=4):
+        """
+        :param fill_frame: function(frame) writing the next frame into a preallocated frame buffer. Returns False at
+        the end of the stream.
+        :param allocate_frame: function() returning a new frame buffer (e.g. a numpy array or a list of them)
+        :param depth: number of frames decoded ahead of the consumer
+        """
+        self.__logger = logging.getLogger(__name__)
+        self.__fill_frame = fill_frame
+        self.__free_frames = queue.Queue()
+        self.__ready_frames = queue.Queue(maxsize=depth)
+        self.__current_frame = None
+        self.__finished = False
+
+        # One more buffer than the queue depth: the consumer holds one while the producer fills the others
+        for _ in range(depth + 1):
+            self.__free_frames.put(allocate_frame())
+
+        self.__producer = Thread(target=self.__produce, daemon=True)
+        self.__producer.start()
+
+    def __produce(self):
+        try:
+            while True:
+                frame = self.__free_frames.get()
+
+                # close() was called
+                if frame is None:
+                    return
+
+                if not self.__fill_frame(frame):
+                    self.__ready_frames.put(self.__end_of_stream)
+                    return
+
+                self.__ready_frames.put(frame)
+
+        except Exception as error:
+            self.__logger.debug('Frame producer failed', exc_info=True)
+            self.__ready_frames.put(error)
+
+    def get(self):
+        """
+            Waits for the next frame. Exceptions raised while producing it are raised here.
+        :return: the frame buffer, or None at the end of the stream
+        """
+        if self.__current_frame is not None:
+            self.__free_frames.put(self.__current_frame)
+            self.__current_frame = None
+
+        if self.__finished:
+            return None
+
+        frame = self.__ready_frames.get()
+
+        if frame is self.__end_of_stream:
+            self.__finished = True
+            return None
+
+        if isinstance(frame, Exception):
+            self.__finished = True
+            raise frame
+
+        self.__current_frame = frame
+        return frame
+
+    def __iter__(self):
+        while True:
+            frame = self.get()
+            if frame is None:
+                return
+
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """
+            Stops the producer thread
+        :return:
+        """
+        self.__finished = True
+        self.__free_frames.put(None)
+
+        # Unblock a producer waiting for room in the queue
+        while self.__producer.is_alive():
+            try:
+                self.__ready_frames.get(timeout=0.01)
+
+            except queue.Empty:
+                pass
+
+        self.__producer.join()
+
+
+class YuvDecoder(object):
+    # Conversion mode of the Y, U and V planes in the frame cache, as returned by read_frame(). Converted frames use
+    # '4:4:4' or 'bgr'.
+    CACHE_PLANES = 'planes'
+
     frame_width = 0
     frame_height = 0
     frame_rate = 0
-    number_of_frames = 0
     __pixel_aspect_ratio = 0
     color_space = 0
     __first_frame_raw_data_position = 0
     __frame_raw_data_size = 0
+    # Position of the raw data of every frame. A range when all frames are the same size apart, a list when they
+    # had to be found one by one, None until then (see number_of_frames).
+    __frame_offsets = None
+    __plane_shapes = None
+    # Read-only memory map of the whole file. Frames are returned as views over it. None for streams (pipes), which
+    # are read one frame after the other instead.
+    __mmap = None
+    # False when the caller handed over an already open file object, which is then left open on close()
+    __owns_file_object = True
+    # Frame returned by the next sequential read_frame() call
+    __next_frame_index = 0
     __convert_to_bgr = False
     y_values = []
     u_values = []
     v_values = []
+    # Time (seconds) spent reading and converting every frame decoded by start()/get_frame()
+    decode_times = None
+    convert_times = None
+    # FrameCache of the decoded planes (streams only) and converted frames, None when disabled
+    frame_cache = None
 
-    def __init__(self, input_file_path, convert_to_bgr=False):
+    def __init__(self, input_file_path, convert_to_bgr=False, prefetch_depth=4, cache_bytes=0):
         """
             Initializes all the needed resources for the YUV decoder
-        :param input_file_path:
+        :param input_file_path: path of the Y4M file, or an open binary file object (e.g. sys.stdin.buffer). Regular
+        files are memory mapped; other inputs (pipes) are read as a stream, see read_frame().
         :param convert_to_bgr:
+        :param prefetch_depth: number of frames decoded ahead by start()/get_frame()
+        :param cache_bytes: size of the frame cache (see FrameCache), 0 for none. It keeps the converted frames (see
+        read_converted_frame()) and, for streams, the planes read, so frames already read can be read again. Planes
+        of regular files are views over the memory mapped file and are not cached.
         """
-        Thread.__init__(self)
         self.__logger = logging.getLogger(__name__)
         # self.__logger.setLevel(logging.DEBUG)
         self.__input_file_path = input_file_path
         self.__convert_to_bgr = convert_to_bgr
-        self.__file_object = open(self.__input_file_path, 'rb')
-        self.raw_header = self.__read_header()
-        self.__calculate_number_of_frames()
+        self.__prefetch_depth = prefetch_depth
+        self.__prefetcher = None
+        self.decode_times = []
+        self.convert_times = []
+
+        # Guards the position of the next frame (and the stream) shared by the caller and the start() thread
+        self.__read_lock = RLock()
+
+        if cache_bytes > 0:
+            self.frame_cache = FrameCache(cache_bytes)
+
+        if hasattr(input_file_path, 'read'):
+            self.__file_object = input_file_path
+            self.__owns_file_object = False
+
+        else:
+            self.__file_object = open(self.__input_file_path, 'rb')
+
+        self.__streaming = not self.__is_regular_file()
+
+        try:
+            self.raw_header = self.__read_header()
+
+        except ValueError:
+            if self.__owns_file_object:
+                self.__file_object.close()
+
+            raise
+
+        if not self.__streaming:
+            self.__mmap = mmap.mmap(self.__file_object.fileno(), 0, access=mmap.ACCESS_READ)
 
         self.__stopped = False
 
         # Calculate number of frames
 
-    def __calculate_number_of_frames(self):
+    @property
+    def number_of_frames(self):
         """
-            Calculates the number of frames o file
+            Number of frames of the file. Counted on first use when it could not be derived from the file size.
+        :return: None for streams, whose length is only known once they have been read
+        """
+        if self.__streaming:
+            return None
+
+        return len(self.__get_frame_offsets())
+
+    def __is_regular_file(self):
+        try:
+            return stat.S_ISREG(os.fstat(self.__file_object.fileno()).st_mode)
+
+        except (AttributeError, OSError):
+            # In-memory file objects (io.BytesIO) have no file descriptor
+            return False
+
+    def __get_frame_offsets(self):
+        if self.__frame_offsets is None:
+            self.__frame_offsets = self.__find_frame_offsets()
+
+        return self.__frame_offsets
+
+    def __calculate_frame_offsets(self, first_frame_header):
+        """
+            Derives the position of every frame from the file size, which works when every frame header is a plain
+        'FRAME\\n'. Otherwise (frame parameters, truncated file) the frames are found lazily.
+        :param first_frame_header: header line of the first frame
         :return:
         """
-        # Save current position
-        current_pos = self.__file_object.tell()
+        frame_stride = len(first_frame_header) + self.__frame_raw_data_size
+        frames_size = os.fstat(self.__file_object.fileno()).st_size - self.__first_frame_raw_data_position + len(first_frame_header)
 
-        # Go to start of first frame
-        self.__file_object.seek(self.__first_frame_raw_data_position)
-        self.number_of_frames = 0
+        self.__frame_offsets = None
 
-        while True:
-            if not self.__file_object.read(self.__frame_raw_data_size):
+        if first_frame_header == b'FRAME\n' and frames_size % frame_stride == 0:
+            self.__frame_offsets = range(self.__first_frame_raw_data_position,
+                                         self.__first_frame_raw_data_position + frames_size, frame_stride)
+
+    def __find_frame_offsets(self):
+        """
+            Finds the frames by hopping from one frame header to the next. Only the headers are read.
+        :return: list of positions of the raw data of the frames
+        """
+        frame_offsets = []
+        file_size = len(self.__mmap)
+        frame_position = self.__first_frame_raw_data_position
+
+        while frame_position + self.__frame_raw_data_size <= file_size:
+            frame_offsets.append(frame_position)
+
+            frame_header_position = frame_position + self.__frame_raw_data_size
+            frame_header_end = self.__mmap.find(b'\n', frame_header_position)
+            if self.__mmap[frame_header_position:frame_header_position + 5] != b'FRAME' or frame_header_end < 0:
                 break
 
-            self.__file_object.readline()
-            self.number_of_frames += 1
+            frame_position = frame_header_end + 1
 
-        # Restore file pointer
-        self.__file_object.seek(current_pos)
-        print('Number of frames:', self.number_of_frames)
+        self.__logger.info(f'Number of frames: {len(frame_offsets)}')
+        return frame_offsets
 
     def __read_header(self):
         """
@@ -71,64 +401,65 @@ class YuvDecoder(Thread):
         """
         header = self.__file_object.readline()
         header_string = header.decode('utf-8')
-        print(header_string)
-        # Ignore first letter
-        self.frame_width = int(re.findall('W\d+', header_string)[0][1:])
-        self.frame_height = int(re.findall('H\d+', header_string)[0][1:])
-        self.frame_rate = re.findall('F\d+\:\d+', header_string)[0][1:]
+        self.__logger.info(header_string.strip())
+
+        # Tags are separated by spaces and identified by their first letter. Ignore first token (YUV4MPEG2).
+        tags = {}
+        for token in header_string.split()[1:]:
+            tags.setdefault(token[0], token[1:])
+
+        self.frame_width = int(tags['W'])
+        self.frame_height = int(tags['H'])
 
         # Calculate actual frame rate given the value is a ratio
-        tokens = [int(d.replace(' ', '')) for d in self.frame_rate.split(':')]
+        tokens = [int(d) for d in tags.get('F', '25:1').split(':')]
         self.frame_rate = round(tokens[0] / tokens[1], 1)
 
-        self.__pixel_aspect_ratio = re.findall('A\d+\:\d+', header_string)[0][1:]
-
-        # Calculate actual pixel aspect ratio rate given the value is a ratio
-        tokens = [int(d.replace(' ', '')) for d in self.__pixel_aspect_ratio.split(':')]
-        self.__pixel_aspect_ratio = round(tokens[0] / tokens[1], 1)
+        # Calculate actual pixel aspect ratio rate given the value is a ratio (0:0 means unknown)
+        tokens = [int(d) for d in tags.get('A', '1:1').split(':')]
+        self.__pixel_aspect_ratio = round(tokens[0] / tokens[1], 1) if tokens[1] else 0
 
         # Don't ignore for interlacing
-        self.__interlacing_mode = re.findall('I(p|t|b|m)', header_string)[0]
+        self.__interlacing_mode = tags.get('I', 'p')
 
         # Ignore first 'FRAME\n' terminator so the file object points to the first byte of raw data of the first frame
-        self.__file_object.readline()
+        first_frame_header = self.__file_object.readline()
 
-        self.__first_frame_raw_data_position = self.__file_object.tell()
+        if not self.__streaming:
+            self.__first_frame_raw_data_position = self.__file_object.tell()
 
-        self.determine_color_space_by_frame_size()
+        if tags.get('C') in COLOR_SPACE_TAGS:
+            self.color_space = COLOR_SPACE_TAGS[tags['C']]
 
-        # Restore
-        self.__file_object.seek(self.__first_frame_raw_data_position)
+        elif 'C' in tags:
+            raise ValueError(f'Unsupported color space C{tags["C"]}')
 
-        return header
+        elif self.__streaming or not self.determine_color_space_by_frame_size():
+            # Y4M default when the tag is missing. Streams cannot be probed, as that needs to seek.
+            self.color_space = '4:2:0'
+
+        self.__plane_shapes = plane_shapes(self.frame_width, self.frame_height, self.color_space)
+        self.__frame_raw_data_size = sum(rows * cols for rows, cols in self.__plane_shapes)
 
-        # Color space parameter is missing?
-        print('FourCC:\t\t', header_string[:4])
-        print('Input file:\t', self.__input_file_path)
-        print('Frame size:\t', f'{self.frame_width}x{self.frame_height}')
-        print('Frame rate:\t', f'{self.frame_rate} FPS')
-        print('Aspect Ratio:\t', self.__pixel_aspect_ratio)
-        print('Color space\t', self.color_space)
-        print('Frame size (raw data):', self.__frame_raw_data_size)
-        print('Position of first raw:', self.__first_frame_raw_data_position)
+        if not self.__streaming:
+            self.__calculate_frame_offsets(first_frame_header)
+
+            # Restore
+            self.__file_object.seek(self.__first_frame_raw_data_position)
+
+        return header
 
     def determine_color_space_by_frame_size(self):
         """
-            Tries to extrapolate the sub-sampling method by the frame size
+            Tries to extrapolate the sub-sampling method by the frame size. Only used when the header has no 'C' tag.
         :return:
         """
         possible_sub_sampling_methods = {}
-        # Calculate 4:2:0 frame size
-        possible_sub_sampling_methods['4:2:0'] = int(
-            self.frame_width * self.frame_height * 3 / 2)
-
-        # Calculate 4:2:2 frame size
-        possible_sub_sampling_methods['4:2:2'] = int(
-            self.frame_width * self.frame_height * 2)
 
-        # Calculate 4:4:4 frame size
-        possible_sub_sampling_methods['4:4:4'] = int(
-            self.frame_width * self.frame_height * 3)
+        # Calculate 4:2:0, 4:2:2 and 4:4:4 frame sizes
+        for color_space in ('4:2:0', '4:2:2', '4:4:4'):
+            possible_sub_sampling_methods[color_space] = sum(
+                rows * cols for rows, cols in plane_shapes(self.frame_width, self.frame_height, color_space))
 
         for k, v in possible_sub_sampling_methods.items():
             self.__logger.debug(f'Checking {k}')
@@ -161,161 +492,279 @@ class YuvDecoder(Thread):
             # Reset file pointer to first byte of first frame raw data
             # self.__file_object.seek(self.__first_frame_raw_data_position)
 
-        self.__logger.critical('Failed to extrapolate color space! Aborting...')
+        self.__logger.warning('Failed to extrapolate color space!')
         return False
 
-    def __get_next_yuv_frame(self):
+    def read_frame(self, index=None):
         """
-            Returns a buffer containing the next frame in the file
-        :return:
+            Returns NON-Converted (to 4:4:4) YUV planes of a frame. The planes are read-only views over the memory
+        mapped file, so no pixel data is copied. Streams are read one frame at a time instead, in order only, apart
+        from frames still in the frame cache.
+        :param index: frame number (0-based). Defaults to the frame after the last one read.
+        :return: returns the reshaped Y, U, V planes. Shape depends on file sampling method.
         """
-        raw_frame_buffer = self.__file_object.read(self.__frame_raw_data_size)
+        with self.__read_lock:
+            return self.__read_frame(index)
+
+    def __read_frame(self, index):
+        if index is None:
+            index = self.__next_frame_index
+
+        if self.__streaming:
+            if index != self.__next_frame_index and self.frame_cache is not None:
+                planes = self.frame_cache.get((index, self.CACHE_PLANES))
+
+                if planes is not None:
+                    return (*planes, True)
+
+            return self.__read_next_frame(index)
+
+        frame_offsets = self.__get_frame_offsets()
+        if not 0 <= index < len(frame_offsets):
+            return None, None, None, False
+
+        self.__next_frame_index = index + 1
+
+        # np.frombuffer (unlike np.ndarray(buffer=...)) holds on to the buffer, so close() cannot unmap the file
+        # under a plane that is still in use
+        y_plane, u_plane, v_plane = self.__split_planes(self.__mmap, frame_offsets[index])
 
-        # Ignore FRAME header
-        self.__file_object.readline()
-        return raw_frame_buffer
+        return y_plane, u_plane, v_plane, True
 
-    def read_frame(self):
+    def __read_next_frame(self, index):
         """
-            Reads the frame and returns NON-Converted (to 4:4:4) YUV planes
-        :return: returns the reshaped Y, U, V planes. Shape depends on file sampling method.
+            read_frame() for streams: reads the raw data of the next frame, so only one frame is held at a time
+        :param index: must be the next frame of the stream
+        :return:
         """
-        buffer = self.__get_next_yuv_frame()
-        if len(buffer) != self.__frame_raw_data_size:
+        if index != self.__next_frame_index:
+            raise ValueError(f'Cannot read frame {index} of a stream, only the next one ({self.__next_frame_index}) '
+                             f'or ones still in the frame cache')
+
+        # The header of the first frame was read along with the file header
+        if index > 0 and not self.__file_object.readline().startswith(b'FRAME'):
             return None, None, None, False
 
-        buf = np.frombuffer(buffer, dtype=np.uint8)
+        frame_data = self.__file_object.read(self.__frame_raw_data_size)
 
-        plane_size = self.frame_height * self.frame_width
+        if len(frame_data) < self.__frame_raw_data_size:
+            if frame_data:
+                self.__logger.warning(f'Stream ends in the middle of frame {index}')
 
-        uv_sizes_dict = {
-            "4:4:4": plane_size,
-            "4:2:2": int(plane_size / 2),
-            "4:2:0": int(plane_size / 4),
-        }
+            return None, None, None, False
 
-        y_plane = buf[0:plane_size]
-        u_plane = buf[plane_size:plane_size + uv_sizes_dict[self.color_space]]
-        v_plane = buf[plane_size + uv_sizes_dict[self.color_space]:plane_size + uv_sizes_dict[self.color_space] * 2]
+        self.__next_frame_index = index + 1
+        y_plane, u_plane, v_plane = self.__split_planes(frame_data, 0)
 
-        # Reshape planes
-        y_plane.shape = (self.frame_height, self.frame_width)
+        if self.frame_cache is not None:
+            # The planes own their data (read-only views over frame_data), so caching them copies nothing
+            self.frame_cache.put((index, self.CACHE_PLANES), (y_plane, u_plane, v_plane))
 
-        if self.color_space == '4:2:2':
-            # Half the columns
-            columns = math.ceil(self.frame_width / 2)
+        return y_plane, u_plane, v_plane, True
 
-            u_plane.shape = (self.frame_height, columns)
-            v_plane.shape = (self.frame_height, columns)
+    def __split_planes(self, buffer, offset):
+        """
+            Read-only Y, U and V plane views over the raw data of a frame
+        :param buffer: bytes-like object holding the frame
+        :param offset: position of the frame in buffer
+        :return: list of 2D uint8 arrays
+        """
+        planes = []
 
-        elif self.color_space == '4:2:0':
-            # Half the columns and half the rows
-            columns = math.ceil(self.frame_width / 2)
-            rows = math.ceil(self.frame_height / 2)
+        for rows, cols in self.__plane_shapes:
+            planes.append(np.frombuffer(buffer, dtype=np.uint8, count=rows * cols, offset=offset).reshape(rows, cols))
+            offset += rows * cols
 
-            u_plane.shape = (rows, columns)
-            v_plane.shape = (rows, columns)
-            
+        return planes
 
-        elif self.color_space == '4:4:4':
-            u_plane.shape = (self.frame_height, self.frame_width)
-            v_plane.shape = (self.frame_height, self.frame_width)
+    def __conversion_mode(self):
+        return 'bgr' if self.__convert_to_bgr else '4:4:4'
 
-        return y_plane, u_plane, v_plane, True
+    def read_converted_frame(self, index=None):
+        """
+            Random access counterpart of get_frame(): frame index converted to 4:4:4 (BGR if requested), served from
+        the frame cache when it holds it. Otherwise it is read (see read_frame()), converted and cached.
+        Safe to call while start() decodes ahead. Both move the same position, so get_frame() then goes on from the
+        frame after this one.
+        :param index: frame number (0-based). Defaults to the frame after the last one read.
+        :return: (True, frame), or (False, None) past the end of the file. Cached frames are read-only.
+        """
+        with self.__read_lock:
+            if index is None:
+                index = self.__next_frame_index
+
+            cache_key = (index, self.__conversion_mode())
+
+            if self.frame_cache is not None:
+                frame = self.frame_cache.get(cache_key)
+
+                if frame is not None:
+                    # Same position as after read_frame(index). Streams stay where they are.
+                    if not self.__streaming:
+                        self.__next_frame_index = index + 1
+
+                    return True, frame
+
+            y, u, v, ret = self.__read_frame(index)
+            if not ret:
+                return False, None
 
-    def __concatenate_planes_to_444yuv_frame(self, y_plane, u_plane, v_plane):
+        frame = self.convert_frame(y, u, v)
+
+        if self.frame_cache is not None:
+            self.frame_cache.put(cache_key, frame)
+
+        return True, frame
+
+    def convert_frame(self, y_plane, u_plane, v_plane, out=None):
         """
-            Builds a YUV frame from the 3 planes
-        :return: numpy array representing RGB image
+            Builds a 4:4:4 frame from the 3 planes, converted to BGR if requested. Chroma is upsampled (nearest
+        neighbour) straight into the output channels and the color conversion runs in place, so no intermediate
+        frames are allocated.
+        :param y_plane: planes as returned by read_frame()
+        :param u_plane:
+        :param v_plane:
+        :param out: (height, width, 3) uint8 array to write to. A new one is allocated if not given.
+        :return: out
         """
-        np.set_printoptions(formatter={'int': hex})
+        if out is None:
+            out = np.empty((self.frame_height, self.frame_width, 3), dtype=np.uint8)
 
-        y_plane.shape = (self.frame_height, self.frame_width, 1)
-        u_plane.shape = (self.frame_height, self.frame_width, 1)
-        v_plane.shape = (self.frame_height, self.frame_width, 1)
+        out[:, :, 0] = y_plane
 
-        yuv = np.concatenate((y_plane, u_plane, v_plane), axis=2)
+        if self.color_space == 'mono':
+            # Neutral chroma
+            out[:, :, 1:] = 128
 
-        # Use OpenCV to convert color since the implementation is MUCH faster
+        else:
+            # Every chroma sample covers row_factor x col_factor luma samples
+            row_factor = math.ceil(self.frame_height / u_plane.shape[0])
+            col_factor = math.ceil(self.frame_width / u_plane.shape[1])
+
+            for channel, chroma_plane in ((1, u_plane), (2, v_plane)):
+                for row_phase in range(row_factor):
+                    for col_phase in range(col_factor):
+                        target = out[row_phase::row_factor, col_phase::col_factor, channel]
+                        target[...] = chroma_plane[:target.shape[0], :target.shape[1]]
+
+        # Use OpenCV to convert color since the implementation is MUCH faster. Imported here as it is slow to load and
+        # not needed by the codec.
         if self.__convert_to_bgr:
-            yuv = cv.cvtColor(yuv, cv.COLOR_YUV2BGR)
+            import cv2 as cv
+            cv.cvtColor(out, cv.COLOR_YUV2BGR, dst=out)
 
-        return yuv
+        return out
 
-    def __extract_yuv_planes(self, frame_buffer):
+    def __fill_converted_frame(self, frame):
         """
-            Splits incoming frame buffer into YUV planes, converting the input to 4:4:4 format
-        :return:
+            Writes the next frame, converted to 4:4:4 (and BGR if requested), into a preallocated buffer
+        :param frame: (height, width, 3) uint8 array
+        :return: False at the end of the file
         """
-        buf = np.frombuffer(frame_buffer, dtype=np.uint8)
+        decode_start = time.monotonic()
 
-        plane_size = self.frame_height * self.frame_width
+        # The key must be the one of the frame read, which the caller could move to in between
+        with self.__read_lock:
+            cache_key = (self.__next_frame_index, self.__conversion_mode())
+            y, u, v, ret = self.__read_frame(None)
 
-        uv_sizes_dict = {
-            "4:4:4": plane_size,
-            "4:2:2": int(plane_size / 2),
-            "4:2:0": int(plane_size / 4),
-        }
+        if not ret:
+            return False
+
+        convert_start = time.monotonic()
+        cached_frame = None if self.frame_cache is None else self.frame_cache.get(cache_key)
 
-        y_plane = buf[0:plane_size]
-        u_plane = buf[plane_size:plane_size + uv_sizes_dict[self.color_space]]
-        v_plane = buf[plane_size + uv_sizes_dict[self.color_space]:plane_size + uv_sizes_dict[self.color_space] * 2]
+        if cached_frame is not None:
+            frame[...] = cached_frame
 
-        if self.color_space == '4:2:2':
-            u_plane = np.repeat(u_plane, 2)
-            v_plane = np.repeat(v_plane, 2)
+        else:
+            self.convert_frame(y, u, v, out=frame)
 
-        elif self.color_space == '4:2:0':
-            u_plane.shape = (int(self.frame_height / 2), int(self.frame_width / 2))
-            v_plane.shape = (int(self.frame_height / 2), int(self.frame_width / 2))
+            # The buffer gets reused, the cache keeps a copy
+            if self.frame_cache is not None:
+                self.frame_cache.put(cache_key, frame.copy())
 
-            u_plane = np.repeat(u_plane, 2, axis=0).repeat(2, axis=1)
-            v_plane = np.repeat(v_plane, 2, axis=0).repeat(2, axis=1)
+        self.decode_times.append(convert_start - decode_start)
+        self.convert_times.append(time.monotonic() - convert_start)
 
-        return y_plane, u_plane, v_plane
+        return True
 
-    def next_frame(self):
+    def __fill_planes(self, planes):
         """
-            Gets the next frame from the stream as RGB. Returns (False, None) if EOF.
-        :return:
+            Copies the Y, U and V planes of the next frame into preallocated planes
+        :param planes: list of three 2D uint8 arrays
+        :return: False at the end of the file
         """
-        while True:
-            if self.grabbed:
-                buffer = self.__get_next_yuv_frame()
-                if len(buffer) != self.__frame_raw_data_size:
-                    self.frame = False, False
-                    self.stopped = True
-                    break
-
-                y, u, v = self.__extract_yuv_planes(buffer)
+        y, u, v, ret = self.read_frame()
+        if not ret:
+            return False
 
-                # Save YUV planes now because they will be reshaped from (height, width) to (height, width, 1)
+        for plane, frame_plane in zip(planes, (y, u, v)):
+            plane[...] = frame_plane
 
-                converted_frame = self.__concatenate_planes_to_444yuv_frame(y, u, v)
+        return True
 
-                self.frame = True, converted_frame
-                self.grabbed = False
-
-            if self.stopped:
-                break
+    def prefetch_frames(self, depth=None):
+        """
+            Reads the (NON-Converted) frames in a background thread, ahead of the caller. The planes handed out are
+        reused once the next frame is requested.
+        :param depth: number of frames read ahead (defaults to the prefetch_depth of the constructor)
+        :return: FramePrefetcher yielding [y, u, v] lists of planes. Use it as a context manager, so the thread is
+        stopped if the caller stops early.
+        """
+        return FramePrefetcher(
+            self.__fill_planes,
+            lambda: [np.empty(shape, dtype=np.uint8) for shape in self.__plane_shapes],
+            self.__prefetch_depth if depth is None else depth)
 
-            time.sleep(1/1000)
+    def start(self):
+        """
+            Starts decoding the (converted) frames ahead in a background thread. See get_frame().
+        :return:
+        """
+        self.__prefetcher = FramePrefetcher(
+            self.__fill_converted_frame,
+            lambda: np.empty((self.frame_height, self.frame_width, 3), dtype=np.uint8),
+            self.__prefetch_depth)
 
     def get_frame(self):
-        self.grabbed = True
-        return self.frame
+        """
+            Gets the next frame (4:4:4, BGR if requested). The frame is only valid until the next call.
+        :return: (True, frame), or (False, None) at the end of the file
+        """
+        frame = self.__prefetcher.get()
+
+        return frame is not None, frame
 
-    def run(self):
-        self.stopped = False
-        self.grabbed = True
-        self.next_frame()
+    def join(self):
+        """
+            Stops the background decoding started by start()
+        :return:
+        """
+        if self.__prefetcher is not None:
+            self.__prefetcher.close()
+            self.__prefetcher = None
 
     def close(self):
         """
             Gracefully closes the resources
         :return:
         """
-        self.__file_object.close()
+        self.join()
+
+        if self.frame_cache is not None:
+            self.frame_cache.clear()
+
+        try:
+            if self.__mmap is not None:
+                self.__mmap.close()
+
+        except BufferError:
+            # Frames returned by read_frame() still point to the mapping. It is unmapped once they are gone.
+            pass
+
+        if self.__owns_file_object:
+            self.__file_object.close()
 
 
 class YuvPlayer(object):
@@ -329,27 +778,82 @@ class YuvPlayer(object):
 
     def play_video(self):
         """
-            Plays the specified stream
-        :return:
+            Plays the specified stream at its frame rate, paced against a monotonic clock. Frames are decoded ahead
+        in the background; a frame that is ready more than one frame period after its due time is dropped. Press q
+        or Esc to stop.
+        :return: playback statistics, see print_stats()
         """
+        import cv2 as cv
+
         cv.namedWindow('Planes', cv.WINDOW_NORMAL)
         cv.resizeWindow('Planes', self.__yuv_video.frame_width, self.__yuv_video.frame_height)
 
-        inter_frame_delay = int(1000 / self.__yuv_video.frame_rate)
+        frame_period = 1 / self.__yuv_video.frame_rate if self.__yuv_video.frame_rate else 0
+        wait_times = []
+        display_times = []
+        dropped_frames = 0
+        frame_number = 0
+
+        start_time = time.monotonic()
 
         while True:
+            wait_start = time.monotonic()
             (ret, frame) = self.__yuv_video.get_frame()
+            wait_times.append(time.monotonic() - wait_start)
 
             if not ret:
                 break
 
+            due_time = start_time + frame_number * frame_period
+            frame_number += 1
+
+            if time.monotonic() - due_time > frame_period:
+                dropped_frames += 1
+                continue
+
+            display_start = time.monotonic()
             cv.imshow('Planes', frame)
-            cv.waitKey(0)
+            display_times.append(time.monotonic() - display_start)
+
+            # Sleep until the next frame is due (at least 1 ms, which also lets the window redraw)
+            key = cv.waitKey(max(1, int((due_time + frame_period - time.monotonic()) * 1000)))
+            if key in (ord('q'), 27):
+                break
 
+        elapsed_time = time.monotonic() - start_time
         self.__yuv_video.join()
 
+        stats = {
+            'frames': frame_number,
+            'displayed_frames': frame_number - dropped_frames,
+            'dropped_frames': dropped_frames,
+            'target_fps': self.__yuv_video.frame_rate,
+            'achieved_fps': round((frame_number - dropped_frames) / elapsed_time, 2) if elapsed_time else 0,
+            'decode_ms': self.avg_list(self.__yuv_video.decode_times),
+            'convert_ms': self.avg_list(self.__yuv_video.convert_times),
+            'display_ms': self.avg_list(display_times),
+            'wait_ms': self.avg_list(wait_times),
+        }
+
+        self.print_stats(stats)
+        return stats
+
+    def print_stats(self, stats):
+        """
+            Prints the statistics returned by play_video(). Times are averages per frame; wait is the time spent
+        waiting for the background decoder (non-zero when decoding cannot keep up).
+        :param stats:
+        :return:
+        """
+        print(f'Frames:\t\t{stats["displayed_frames"]} displayed, {stats["dropped_frames"]} dropped')
+        print(f'Frame rate:\t{stats["achieved_fps"]} FPS (target {stats["target_fps"]} FPS)')
+        print(f'Decode:\t\t{stats["decode_ms"]} ms')
+        print(f'Convert:\t{stats["convert_ms"]} ms')
+        print(f'Display:\t{stats["display_ms"]} ms')
+        print(f'Wait:\t\t{stats["wait_ms"]} ms')
+
     def avg_list(self, lst):
-        return round(sum(lst) / len(lst) * 1000, 2)
+        return round(sum(lst) / len(lst) * 1000, 2) if lst else 0
 
 # v = YuvPlayer('videos/ducks_take_off_444_720p50.y4m', convert_to_bgr=True)
 # v.play_video()